@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+#_____________________________________________________________________________
+#
+# Admission control for the SOCKS5 proxy: limits per client source address
+#
+# Author:   Samdney  <contact@carolin-zoebelein.de>
+# D4A7 35E8 D47F 801F 2CF6 2BA7 927A FD3C DE47 E13B
+# License:  See LICENSE for licensing information
+#_____________________________________________________________________________
+
+"""
+***Admission control per source***
+
+Clients are grouped by their source address, cut to a prefix (e.g. /32 or /24
+for IPv4, /64 for IPv6). IPv4-mapped IPv6 addresses (::ffff:a.b.c.d, IPv4
+clients of a [::] listener) are IPv4 sources. For every source we limit:
+=> New connections/sec, as token bucket with rate and burst
+=> Concurrent sessions
+
+---
+Token bucket
+---
+=> The bucket is kept as a single float per source, the "theoretical arrival
+	time" (tat) of the next connection (GCRA, the virtual scheduling form of a
+	token bucket):
+		interval	= 1 / rate
+		tat			= max(tat, now) + interval
+		=> Allowed, if tat - now <= burst * interval
+=> No timers and no refill loop, the refill happens lazily on lookup.
+=> A bucket with tat <= now is full, hence equal to a missing one and can be
+	dropped.
+
+---
+Expiry of idle buckets
+---
+=> Buckets live in two generations (dicts), which are rotated every
+	burst * interval seconds. A bucket found in the old generation is moved to
+	the new one. At rotation the old generation is dropped as a whole:
+	everything in it was not touched for at least one period, so it is full.
+=> Memory is bounded by the sources seen in the last two periods, no scans.
+=> Session counters only exist while a source has open sessions.
+
+---
+Reload
+---
+=> Unchanged limits keep the object. Changed ones: a new object takes the
+	buckets, session counters and counts of the old one over (take_over()),
+	with the source keys cut to the new prefixes. With a finer prefix a
+	source keeps the first address of its old prefix.
+"""
+
+import socket
+import time
+
+V4_MAPPED = bytes(10) + b"\xff\xff"		# ::ffff:0:0/96
+
+class AdmissionControl():
+
+	def __init__(self,rate=None,burst=1,max_sessions=None,prefix_v4=32,prefix_v6=64):
+		self.interval		= 1.0 / rate if rate else 0.0
+		self.burst_time		= self.interval * burst
+		self.max_sessions	= max_sessions
+		self.shift_v4		= 32 - prefix_v4
+		self.shift_v6		= 128 - prefix_v6
+
+		self.tat			= {}	# source -> theoretical arrival time
+		self.tat_old		= {}
+		self.rotate_at		= time.monotonic() + self.burst_time
+		self.sessions		= {}	# source -> open sessions
+
+		self.admitted		= 0
+		self.rejected		= 0
+
+	def source(self,client_addr):
+		host = client_addr[0]
+		if ":" in host:
+			packed = socket.inet_pton(socket.AF_INET6, host)
+			# An IPv4 client of a dual stack listener (::ffff:a.b.c.d)
+			if packed[:12] == V4_MAPPED:
+				return int.from_bytes(packed[12:], "big") >> self.shift_v4
+			# IPv6 sources are kept apart from IPv4 ones by the extra high bit
+			return (int.from_bytes(packed, "big") >> self.shift_v6) | (1 << 128)
+		return int.from_bytes(socket.inet_aton(host), "big") >> self.shift_v4
+
+	def rate_ok(self,source,now):
+		if now >= self.rotate_at:
+			if now >= self.rotate_at + self.burst_time:
+				# Idle for more than a period, both generations are full
+				self.tat_old = {}
+			else:
+				self.tat_old = self.tat
+			self.tat = {}
+			self.rotate_at = now + self.burst_time
+
+		tat = self.tat.get(source)
+		if tat is None:
+			tat = self.tat_old.pop(source, None)
+			if tat is None:
+				tat = now
+			else:
+				self.tat[source] = tat
+		tat = max(tat, now) + self.interval
+		if tat - now > self.burst_time + 1e-9:
+			return False
+		self.tat[source] = tat
+		return True
+
+	# Returns the source key if the client is admitted (release it at the end
+	# of the session), else None
+	def admit(self,client_addr):
+		source = self.source(client_addr)
+
+		sessions = self.sessions.get(source, 0)
+		if self.max_sessions is not None and sessions >= self.max_sessions:
+			self.rejected += 1
+			return None
+		if self.interval and not self.rate_ok(source, time.monotonic()):
+			self.rejected += 1
+			return None
+
+		self.sessions[source] = sessions + 1
+		self.admitted += 1
+		return source
+
+	def release(self,source):
+		sessions = self.sessions[source] - 1
+		if sessions:
+			self.sessions[source] = sessions
+		else:
+			del self.sessions[source]
+
+	# Takes the live state of old (limits changed by a reload) over. Returns
+	# the mapping of the source keys of old to those of this one.
+	def take_over(self,old):
+		def rekey(source):
+			if source >> 128:
+				addr = (source & ((1 << 128) - 1)) << old.shift_v6
+				return (addr >> self.shift_v6) | (1 << 128)
+			return (source << old.shift_v4) >> self.shift_v4
+
+		# Both generations go to the new one, rotation drops them later
+		for tats in (old.tat_old, old.tat):
+			for source, tat in tats.items():
+				source = rekey(source)
+				self.tat[source] = max(tat, self.tat.get(source, tat))
+		for source, sessions in old.sessions.items():
+			source = rekey(source)
+			self.sessions[source] = self.sessions.get(source, 0) + sessions
+		self.admitted	= old.admitted
+		self.rejected	= old.rejected
+		return rekey
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+#_____________________________________________________________________________
+#
+# Benchmark: SOCKS5 handshakes with and without username/password
+# authentication (RFC 1929)
+#
+# Author:   Samdney  <contact@carolin-zoebelein.de>
+#			D4A7 35E8 D47F 801F 2CF6 2BA7 927A FD3C DE47 E13B
+# License:  See LICENSE for licensing information
+#_____________________________________________________________________________
+
+# Measures:
+# - auth latency: first login (KDF run) and repeated login (cache hit)
+# - handshakes/sec: Hallo (+Auth) + CONNECT, auth off vs. auth on, with
+#	concurrent clients reconnecting as fast as possible
+
+import asyncio
+import contextlib
+import io
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import proxy
+import socks5auth
+from socks5 import *
+
+Socks5_Protocol = Protocol()
+
+# **********
+# Config
+# **********
+clients		= 4		# concurrent clients
+duration	= 3.0	# seconds per run
+username	= b"bench"
+password	= b"secret"
+# **********
+
+def free_port():
+	sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	sock.bind(("127.0.0.1", 0))
+	port = sock.getsockname()[1]
+	sock.close()
+	return port
+
+# Target server, accepts and closes
+def start_target():
+	sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	sock.bind(("127.0.0.1", 0))
+	sock.listen(1024)
+	def run():
+		while True:
+			conn, addr = sock.accept()
+			conn.close()
+	threading.Thread(target=run, daemon=True).start()
+	return sock.getsockname()
+
+def start_proxy(auth_file):
+	proxy_addr = ("127.0.0.1", free_port())
+	argv = ["--listen", "%s:%d" % proxy_addr, "--backlog", "1024", "--handoff-path", "none",
+			"--set", "admission.conn_rate=none", "--set", "admission.max_sessions=none"]
+	if auth_file:
+		argv += ["--auth-file", auth_file]
+	threading.Thread(target=proxy.main, args=(argv,), daemon=True).start()
+	time.sleep(0.5)
+	return proxy_addr
+
+def handshake(proxy_addr,target_addr,auth):
+	Socks5_Client = Client()
+	Socks5_Client.init_socketToProxy(socket.AF_INET, socket.SOCK_STREAM, proxy_addr)
+	if auth:
+		Socks5_Client.hallo_send(Socks5_Protocol.VER, b'\x01', Socks5_Protocol.METHOD_USERNAME)
+	else:
+		Socks5_Client.hallo_send(Socks5_Protocol.VER, b'\x01', Socks5_Protocol.METHOD_NOAUTH)
+	Socks5_Client.hallo_recv()
+	if auth:
+		Socks5_Client.auth_send(username, password)
+		Socks5_Client.auth_recv()
+	DST_ADDR = socket.inet_aton(target_addr[0])
+	DST_PORT = target_addr[1]
+	Socks5_Client.connect_send(Socks5_Protocol.VER, Socks5_Protocol.CMD_CONNECT,
+		Socks5_Protocol.RSV, Socks5_Protocol.ATYP_IPV4, DST_ADDR, DST_PORT)
+	Socks5_Client.connect_recv()
+	Socks5_Client.sockToProxy.close()
+
+def run_handshakes(proxy_addr,target_addr,auth):
+	count = [0] * clients
+	stop = time.monotonic() + duration
+	def run(i):
+		while time.monotonic() < stop:
+			handshake(proxy_addr, target_addr, auth)
+			count[i] += 1
+	threads = [threading.Thread(target=run, args=(i,)) for i in range(clients)]
+	for t in threads:
+		t.start()
+	for t in threads:
+		t.join()
+	return sum(count) / duration
+
+def main():
+	results = []
+	target_addr = start_target()
+
+	with tempfile.NamedTemporaryFile("w", suffix=".passwd", delete=False) as f:
+		f.write("%s:%s\n" % (username.decode(), socks5auth.hash_password(password)))
+		auth_file = f.name
+
+	try:
+		with contextlib.redirect_stdout(io.StringIO()):
+			noauth_addr = start_proxy(None)
+			auth_addr = start_proxy(auth_file)
+
+			# Auth latency
+			t0 = time.perf_counter()
+			handshake(auth_addr, target_addr, True)
+			t_cold = time.perf_counter() - t0
+			t0 = time.perf_counter()
+			for i in range(100):
+				handshake(auth_addr, target_addr, True)
+			t_cached = (time.perf_counter() - t0) / 100
+			t0 = time.perf_counter()
+			for i in range(100):
+				handshake(noauth_addr, target_addr, False)
+			t_noauth = (time.perf_counter() - t0) / 100
+
+			# Handshakes/sec
+			hs_noauth = run_handshakes(noauth_addr, target_addr, False)
+			hs_auth = run_handshakes(auth_addr, target_addr, True)
+	finally:
+		os.unlink(auth_file)
+
+	print("[*] Handshake latency, auth off:            %8.3f ms" % (t_noauth * 1000))
+	print("[*] Handshake latency, auth on (KDF):       %8.3f ms" % (t_cold * 1000))
+	print("[*] Handshake latency, auth on (cached):    %8.3f ms" % (t_cached * 1000))
+	print("[*] Handshakes/sec, auth off (%d clients):   %8.1f" % (clients, hs_noauth))
+	print("[*] Handshakes/sec, auth on  (%d clients):   %8.1f" % (clients, hs_auth))
+
+if __name__=='__main__':
+	main()
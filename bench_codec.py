@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+#_____________________________________________________________________________
+#
+# Benchmark: the SOCKS5 codec (socks5codec.py), ops/sec per message type
+#
+# Author:   Samdney  <contact@carolin-zoebelein.de>
+#			D4A7 35E8 D47F 801F 2CF6 2BA7 927A FD3C DE47 E13B
+# License:  See LICENSE for licensing information
+#_____________________________________________________________________________
+
+# No sockets, the encoders/decoders alone. For each op the best of rounds
+# runs of calls calls, as ops/sec.
+#
+#	./bench_codec.py					compare with bench_codec.baseline, exit
+#										code 1 if an op is slower than
+#										baseline * (1 - tolerance)
+#	./bench_codec.py --save-baseline	store the results as the new baseline
+#
+# Machines differ: every result is stored and compared relative to a
+# calibration loop (an empty function call), measured in the same run. A
+# relative result of 0.5 means the op takes twice as long as the call.
+
+import argparse
+import json
+import os
+import socket
+import sys
+import time
+
+from socks5codec import *
+
+# **********
+# Config
+# **********
+calls			= 200000		# calls per run
+rounds			= 5				# runs per op, the best counts
+tolerance		= 0.3			# slower than baseline by more: regression
+baseline_file	= os.path.join(os.path.dirname(os.path.abspath(__file__)),
+								"bench_codec.baseline")
+# **********
+
+P = Socks5_Protocol
+
+HALLO			= encode_hallo(P.METHOD_NOAUTH + P.METHOD_USERNAME)
+AUTH			= encode_auth(b"user", b"secret")
+IPV4_ADDR		= socket.inet_aton("192.0.2.10")
+IPV6_ADDR		= socket.inet_pton(socket.AF_INET6, "2001:db8::10")
+DOMAIN_ADDR		= b"www.example.com"
+IPV4_REQUEST	= encode_request(P.CMD_CONNECT, P.ATYP_IPV4, IPV4_ADDR, 8888)
+IPV6_REQUEST	= encode_request(P.CMD_CONNECT, P.ATYP_IPV6, IPV6_ADDR, 8888)
+DOMAIN_REQUEST	= encode_request(P.CMD_CONNECT, P.ATYP_DOMAINNAME, DOMAIN_ADDR, 443)
+REPLY			= CONNECT_REPLIES[P.REP_SUCCESSED]
+
+# name -> function without arguments, one op
+OPS = {
+	"hallo encode":				lambda: encode_hallo(P.METHOD_NOAUTH),
+	"hallo decode":				lambda: decode_hallo(HALLO),
+	"hallo reply":				lambda: HALLO_REPLIES[P.METHOD_NOAUTH],
+	"auth encode":				lambda: encode_auth(b"user", b"secret"),
+	"auth decode":				lambda: decode_auth(AUTH),
+	"auth reply":				lambda: AUTH_REPLIES[P.AUTH_SUCCESS],
+	"request ipv4 encode":		lambda: encode_request(P.CMD_CONNECT, P.ATYP_IPV4, IPV4_ADDR, 8888),
+	"request ipv4 decode":		lambda: decode_request(IPV4_REQUEST),
+	"request ipv6 encode":		lambda: encode_request(P.CMD_CONNECT, P.ATYP_IPV6, IPV6_ADDR, 8888),
+	"request ipv6 decode":		lambda: decode_request(IPV6_REQUEST),
+	"request domain encode":	lambda: encode_request(P.CMD_CONNECT, P.ATYP_DOMAINNAME,
+											DOMAIN_ADDR, 443),
+	"request domain decode":	lambda: decode_request(DOMAIN_REQUEST),
+	"request length":			lambda: message_length(IPV4_REQUEST),
+	"reply encode":				lambda: encode_reply(P.REP_CONNREFUSED),
+	"reply decode":				lambda: decode_reply(REPLY),
+	"reply precomputed":		lambda: CONNECT_REPLIES[P.REP_SUCCESSED],
+}
+
+def calibration():
+	pass
+
+# ops/sec of fn, best of rounds
+def measure(fn):
+	best = None
+	for r in range(rounds):
+		start = time.perf_counter()
+		for i in range(calls):
+			fn()
+		elapsed = time.perf_counter() - start
+		best = elapsed if best is None else min(best, elapsed)
+	return calls / best
+
+def load_baseline():
+	try:
+		with open(baseline_file) as f:
+			return json.load(f)
+	except FileNotFoundError:
+		return None
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="SOCKS5 codec benchmark")
+	parser.add_argument("--save-baseline", action="store_true",
+						help="store the results in %s" % os.path.basename(baseline_file))
+	args = parser.parse_args(argv)
+
+	calibrated = measure(calibration)
+	results = {name: measure(fn) for name, fn in OPS.items()}
+	relative = {name: ops / calibrated for name, ops in results.items()}
+
+	baseline = None if args.save_baseline else load_baseline()
+	regressions = []
+	print("[*] Calibration: %.0f calls/sec" % (calibrated))
+	print("[*] %-24s %12s %9s %9s" % ("op", "ops/sec", "relative", "baseline"))
+	for name, ops in results.items():
+		line = "[*] %-24s %12.0f %9.3f" % (name, ops, relative[name])
+		if baseline and name in baseline["relative"]:
+			expected = baseline["relative"][name]
+			line += " %9.3f" % (expected)
+			if relative[name] < expected * (1 - tolerance):
+				line += "  slower by %.0f%%" % ((1 - relative[name] / expected) * 100)
+				regressions.append(name)
+		print(line)
+
+	if args.save_baseline:
+		with open(baseline_file, "w") as f:
+			json.dump({"calibration": calibrated, "relative": relative}, f, indent=1,
+						sort_keys=True)
+			f.write("\n")
+		print("[*] Baseline saved: %s" % (baseline_file))
+	elif baseline is None:
+		print("[*] No baseline (%s), see --save-baseline" % (baseline_file))
+	if regressions:
+		print("[*] REGRESSION (tolerance %.0f%%): %s" % (tolerance * 100, ", ".join(regressions)))
+		return 1
+	return 0
+
+if __name__=='__main__':
+	sys.exit(main())
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+#_____________________________________________________________________________
+#
+# Benchmark: HTTP through the proxyfilter, relay = raw and relay = http
+#
+# Author:   Samdney  <contact@carolin-zoebelein.de>
+#			D4A7 35E8 D47F 801F 2CF6 2BA7 927A FD3C DE47 E13B
+# License:  See LICENSE for licensing information
+#_____________________________________________________________________________
+
+# Setup, everything on 127.0.0.1, proxy (filter 1) and target (./target.py
+# --mode http, --mode http-chunked) are their own processes. GET requests,
+# a response is ok if its framing is valid and its body is the filtered
+# body of the target:
+#
+#	keep-alive:	one session, requests one after the other
+#	reconnect:	a new session per request (what relay = raw needs)
+#	pipelined:	one session, depth requests sent at once, then all
+#				responses read
+#
+# A session whose framing broke is closed, the next request opens a new one.
+# After max_failed failed requests a test stops.
+
+import contextlib
+import io
+import socket
+import time
+
+from socks5 import *
+from proxy import load_filter, filter_data
+from bench_sockets import free_port, start, stop, percentile
+
+Socks5_Protocol = Protocol()
+
+# **********
+# Config
+# **********
+requests		= 1000			# per test
+depth			= 16			# pipelined requests at once
+body_size		= 4096
+relays			= ["raw", "http"]
+target_modes	= ["http", "http-chunked"]
+timeout			= 0.5			# waiting for a response which never comes
+max_failed		= 10			# a test stops after these failed requests
+rp_msg			= "She is a nice girl."		# the respond message of the target
+# **********
+
+REQUEST = b"GET / HTTP/1.1\r\nHost: target\r\n\r\n"
+
+class BrokenFraming(Exception):
+	pass
+
+class Connection():
+
+	def __init__(self,proxy_addr,target_addr):
+		Socks5_Client = Client()
+		Socks5_Client.init_socketToProxy(socket.AF_INET, socket.SOCK_STREAM, proxy_addr, 10)
+		Socks5_Client.hallo_send(Socks5_Protocol.VER, b'\x01', Socks5_Protocol.METHOD_NOAUTH)
+		Socks5_Client.hallo_recv()
+		DST_ADDR = socket.inet_aton(target_addr[0])
+		DST_PORT = target_addr[1]
+		Socks5_Client.connect_send(Socks5_Protocol.VER, Socks5_Protocol.CMD_CONNECT,
+			Socks5_Protocol.RSV, Socks5_Protocol.ATYP_IPV4, DST_ADDR, DST_PORT)
+		Socks5_Client.connect_recv()
+		self.sock = Socks5_Client.sockToProxy
+		self.sock.settimeout(timeout)
+		self.buf = b""
+
+	def close(self):
+		self.sock.close()
+
+	def fill(self):
+		try:
+			data = self.sock.recv(65536)
+		except socket.timeout:
+			raise BrokenFraming("response incomplete")
+		if not data:
+			raise BrokenFraming("connection closed")
+		self.buf += data
+
+	def read_line(self,marker=b"\r\n"):
+		while marker not in self.buf:
+			self.fill()
+		line, self.buf = self.buf.split(marker, 1)
+		return line
+
+	def read(self,n):
+		while len(self.buf) < n:
+			self.fill()
+		data, self.buf = self.buf[:n], self.buf[n:]
+		return data
+
+	# Returns the body
+	def read_response(self):
+		head = self.read_line(b"\r\n\r\n").lower()
+		if not head.startswith(b"http/1.1 200 "):
+			raise BrokenFraming("no status line")
+		if b"transfer-encoding: chunked" in head:
+			body = b""
+			while True:
+				size = int(self.read_line().split(b";")[0], 16)
+				if not size:
+					break
+				body += self.read(size)
+				if self.read(2) != b"\r\n":
+					raise BrokenFraming("chunk without CRLF")
+			while self.read_line():
+				pass
+			return body
+		length = int(head.split(b"content-length:")[1].split(b"\r\n")[0])
+		return self.read(length)
+
+def expected_body():
+	text = (rp_msg + " ").encode()
+	body = (text * (body_size // len(text) + 1))[:body_size]
+	return filter_data(load_filter(), 1, body)
+
+# Returns (ok, failed, latencies)
+def run_keepalive(proxy_addr,target_addr,expected):
+	ok, failed, latencies = 0, 0, []
+	conn = None
+	for i in range(requests):
+		if failed >= max_failed:
+			break
+		start = time.perf_counter()
+		try:
+			if conn is None:
+				conn = Connection(proxy_addr, target_addr)
+			conn.sock.sendall(REQUEST)
+			if conn.read_response() != expected:
+				raise BrokenFraming("body not filtered")
+			ok += 1
+			latencies.append(time.perf_counter() - start)
+		except (BrokenFraming, ValueError, IndexError, OSError, Socks5Error):
+			failed += 1
+			if conn:
+				conn.close()
+			conn = None
+	if conn:
+		conn.close()
+	return ok, failed, latencies
+
+def run_reconnect(proxy_addr,target_addr,expected):
+	ok, failed, latencies = 0, 0, []
+	for i in range(requests):
+		if failed >= max_failed:
+			break
+		start = time.perf_counter()
+		conn = None
+		try:
+			conn = Connection(proxy_addr, target_addr)
+			conn.sock.sendall(REQUEST)
+			if conn.read_response() != expected:
+				raise BrokenFraming("body not filtered")
+			ok += 1
+			latencies.append(time.perf_counter() - start)
+		except (BrokenFraming, ValueError, IndexError, OSError, Socks5Error):
+			failed += 1
+		finally:
+			if conn:
+				conn.close()
+	return ok, failed, latencies
+
+def run_pipelined(proxy_addr,target_addr,expected):
+	ok, failed, latencies = 0, 0, []
+	conn = None
+	for i in range(requests // depth):
+		if failed >= max_failed:
+			break
+		start = time.perf_counter()
+		done = 0
+		try:
+			if conn is None:
+				conn = Connection(proxy_addr, target_addr)
+			conn.sock.sendall(REQUEST * depth)
+			for j in range(depth):
+				if conn.read_response() != expected:
+					raise BrokenFraming("body not filtered")
+				done += 1
+			latencies.append(time.perf_counter() - start)
+		except (BrokenFraming, ValueError, IndexError, OSError, Socks5Error):
+			if conn:
+				conn.close()
+			conn = None
+		ok += done
+		failed += depth - done
+	if conn:
+		conn.close()
+	return ok, failed, latencies
+
+TESTS = [("keep-alive", run_keepalive), ("reconnect", run_reconnect),
+		("pipelined", run_pipelined)]
+
+def run_target(target_mode,expected):
+	target_addr = ("127.0.0.1", free_port())
+	target = start("target.py", "--listen", "%s:%d" % target_addr, "--backlog", "1024",
+					"--mode", target_mode, "--size", str(body_size), "--response", rp_msg)
+	results = []
+	try:
+		for relay in relays:
+			proxy_addr = ("127.0.0.1", free_port())
+			proxy = start("proxy.py", "--listen", "%s:%d" % proxy_addr, "--handoff-path", "none",
+						"--filter", "1", "--chunk-size", "65536",
+						"--set", "admission.conn_rate=none", "--set", "admission.max_sessions=none",
+						"--set", "route default.relay=%s" % relay)
+			time.sleep(1.0)
+			try:
+				for name, test in TESTS:
+					start_time = time.perf_counter()
+					ok, failed, latencies = test(proxy_addr, target_addr, expected)
+					results.append((relay, name, ok, failed, latencies,
+									time.perf_counter() - start_time))
+			finally:
+				stop(proxy)
+	finally:
+		stop(target)
+	return results
+
+def main():
+	expected = expected_body()
+	with contextlib.redirect_stdout(io.StringIO()):
+		results = [(mode, run_target(mode, expected)) for mode in target_modes]
+
+	for mode, tests in results:
+		print("[*] Target --mode %s, %d octets per body:" % (mode, body_size))
+		for relay, name, ok, failed, latencies, elapsed in tests:
+			latencies = latencies or [0]
+			print("[*]   relay = %-4s  %-10s  ok %5d  failed %5d  %7.0f req/s  "
+				"p50 %6.3f ms  p99 %6.3f ms" % (relay, name, ok, failed, ok / elapsed,
+				percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000))
+
+if __name__=='__main__':
+	main()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+
+#_____________________________________________________________________________
+#
+# Benchmark: edge -> core proxy, mux streams vs. one TCP connection per session
+#
+# Author:   Samdney  <contact@carolin-zoebelein.de>
+#			D4A7 35E8 D47F 801F 2CF6 2BA7 927A FD3C DE47 E13B
+# License:  See LICENSE for licensing information
+#_____________________________________________________________________________
+
+# Setup, everything on 127.0.0.1, each proxy is its own process:
+#
+#	tcp:	clients -> edge proxy --(SOCKS5, new TCP connection)--> core proxy -> echo target
+#	mux:	clients -> edge proxy ==(stream on one mux connection)==> core proxy -> echo target
+#
+# Clients open sessions as fast as they can (Hallo, CONNECT, one message to
+# the target and back). Measures:
+# - session setup latency: connect to the edge until the CONNECT answer
+# - sessions/sec
+# - CPU time of edge and core proxy per session (user + system, from wait4)
+
+import contextlib
+import io
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from socks5 import *
+
+Socks5_Protocol = Protocol()
+
+# **********
+# Config
+# **********
+clients		= 8		# concurrent clients
+duration	= 3.0	# seconds per run
+msg			= b"She is a nice girl."
+# **********
+
+def free_port():
+	sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	sock.bind(("127.0.0.1", 0))
+	port = sock.getsockname()[1]
+	sock.close()
+	return port
+
+# Echo target server, one thread per connection
+def start_target():
+	sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	sock.bind(("127.0.0.1", 0))
+	sock.listen(1024)
+	def echo(conn):
+		while True:
+			data = conn.recv(1024)
+			if not data:
+				break
+			conn.sendall(data)
+		conn.close()
+	def run():
+		while True:
+			conn, addr = sock.accept()
+			threading.Thread(target=echo, args=(conn,), daemon=True).start()
+	threading.Thread(target=run, daemon=True).start()
+	return sock.getsockname()
+
+def start_proxy(listen_addr,*options):
+	path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "proxy.py")
+	argv = [sys.executable, path, "--listen", "%s:%d" % listen_addr, "--backlog", "1024",
+			"--handoff-path", "none", "--filter", "0",
+			"--set", "admission.conn_rate=none", "--set", "admission.max_sessions=none"]
+	return subprocess.Popen(argv + list(options), stdout=subprocess.DEVNULL)
+
+# Seconds of CPU, after the process is stopped
+def stop_proxy(proc):
+	proc.send_signal(signal.SIGTERM)
+	pid, status, rusage = os.wait4(proc.pid, 0)
+	proc.returncode = status
+	return rusage.ru_utime + rusage.ru_stime
+
+# Returns the setup latency
+def session(proxy_addr,target_addr):
+	start = time.perf_counter()
+	Socks5_Client = Client()
+	Socks5_Client.init_socketToProxy(socket.AF_INET, socket.SOCK_STREAM, proxy_addr, 10)
+	try:
+		Socks5_Client.hallo_send(Socks5_Protocol.VER, b'\x01', Socks5_Protocol.METHOD_NOAUTH)
+		Socks5_Client.hallo_recv()
+		DST_ADDR = socket.inet_aton(target_addr[0])
+		DST_PORT = target_addr[1]
+		Socks5_Client.connect_send(Socks5_Protocol.VER, Socks5_Protocol.CMD_CONNECT,
+			Socks5_Protocol.RSV, Socks5_Protocol.ATYP_IPV4, DST_ADDR, DST_PORT)
+		Socks5_Client.connect_recv()
+		setup = time.perf_counter() - start
+		Socks5_Client.sockToProxy.sendall(msg)
+		data = Socks5_Client.sockToProxy.recv(1024)
+		if data != msg:
+			raise Socks5Error("wrong data from target server")
+	finally:
+		Socks5_Client.sockToProxy.close()
+	return setup
+
+def run_sessions(proxy_addr,target_addr):
+	ok = [0] * clients
+	failed = [0] * clients
+	setup = [0.0] * clients
+	stop = time.monotonic() + duration
+	def run(i):
+		while time.monotonic() < stop:
+			try:
+				setup[i] += session(proxy_addr, target_addr)
+				ok[i] += 1
+			except Exception as e:
+				failed[i] += 1
+	threads = [threading.Thread(target=run, args=(i,)) for i in range(clients)]
+	for t in threads:
+		t.start()
+	for t in threads:
+		t.join()
+	return sum(ok), sum(failed), sum(setup) / max(sum(ok), 1)
+
+def run_mode(mode,target_addr):
+	core_addr = ("127.0.0.1", free_port())
+	edge_addr = ("127.0.0.1", free_port())
+	if mode == "tcp":
+		core = start_proxy(core_addr)
+		edge = start_proxy(edge_addr, "--parent", "%s:%d" % core_addr,
+							"--set", "upstream.check_interval=0")
+	else:
+		mux_addr = ("127.0.0.1", free_port())
+		core = start_proxy(core_addr, "--set", "mux.listen=%s:%d" % mux_addr)
+		edge = start_proxy(edge_addr, "--set", "mux.peer=%s:%d" % mux_addr)
+	time.sleep(1.0)
+	try:
+		ok, failed, setup = run_sessions(edge_addr, target_addr)
+	finally:
+		cpu_edge = stop_proxy(edge)
+		cpu_core = stop_proxy(core)
+	return ok, failed, setup, cpu_edge, cpu_core
+
+def main():
+	target_addr = start_target()
+	with contextlib.redirect_stdout(io.StringIO()):
+		results = [(mode,) + run_mode(mode, target_addr) for mode in ("tcp", "mux")]
+
+	for mode, ok, failed, setup, cpu_edge, cpu_core in results:
+		print("[*] %s (%d clients):" % ("One TCP connection per session" if mode == "tcp"
+										else "Mux streams", clients))
+		print("[*]   Sessions ok/failed:     %d/%d" % (ok, failed))
+		print("[*]   Sessions/sec:           %8.1f" % (ok / duration))
+		print("[*]   Setup latency:          %8.3f ms" % (setup * 1000))
+		print("[*]   CPU edge per session:   %8.1f us" % (cpu_edge / max(ok, 1) * 1e6))
+		print("[*]   CPU core per session:   %8.1f us" % (cpu_core / max(ok, 1) * 1e6))
+
+if __name__=='__main__':
+	main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+#_____________________________________________________________________________
+#
+# Benchmark: CONNECTs to dead target servers, with and without negative cache
+#
+# Author:   Samdney  <contact@carolin-zoebelein.de>
+#			D4A7 35E8 D47F 801F 2CF6 2BA7 927A FD3C DE47 E13B
+# License:  See LICENSE for licensing information
+#_____________________________________________________________________________
+
+# Setup, everything on 127.0.0.1, the proxy is its own process:
+#
+#	refused:	a port without listener, CONNECTs one after the other.
+#				Latency until the answer (REP 5).
+#	blackhole:	a listener which never accepts, its queue is full, SYNs are
+#				dropped. CONNECTs one after the other, connect timeout 1
+#				second. Time until all are answered (REP 6).
+#
+# Each with [timeouts] negative = 0 (off) and = 5.
+
+import contextlib
+import io
+import socket
+import time
+
+from socks5 import *
+from bench_sockets import free_port, start, stop, percentile
+
+Socks5_Protocol = Protocol()
+
+# **********
+# Config
+# **********
+requests		= 200			# CONNECTs to the refused port
+blackhole		= 10			# CONNECTs to the blackhole
+connect_timeout	= 1
+negative_ttls	= [0, 5]
+# **********
+
+# Returns (REP, seconds)
+def connect(proxy_addr,target_addr):
+	start = time.perf_counter()
+	Socks5_Client = Client()
+	Socks5_Client.init_socketToProxy(socket.AF_INET, socket.SOCK_STREAM, proxy_addr, 30)
+	try:
+		Socks5_Client.hallo_send(Socks5_Protocol.VER, b'\x01', Socks5_Protocol.METHOD_NOAUTH)
+		Socks5_Client.hallo_recv()
+		DST_ADDR = socket.inet_aton(target_addr[0])
+		DST_PORT = target_addr[1]
+		Socks5_Client.connect_send(Socks5_Protocol.VER, Socks5_Protocol.CMD_CONNECT,
+			Socks5_Protocol.RSV, Socks5_Protocol.ATYP_IPV4, DST_ADDR, DST_PORT)
+		try:
+			Socks5_Client.connect_recv()
+			rep = 0
+		except ConnectError as e:
+			rep = e.rep[0]
+	finally:
+		Socks5_Client.sockToProxy.close()
+	return rep, time.perf_counter() - start
+
+# A listener with a full accept queue
+def open_blackhole():
+	listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	listener.bind(("127.0.0.1", 0))
+	listener.listen(0)
+	fill = []
+	for i in range(4):
+		sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		sock.setblocking(False)
+		sock.connect_ex(listener.getsockname())
+		fill.append(sock)
+	time.sleep(0.2)
+	return listener, fill
+
+def run_refused(proxy_addr):
+	dead = ("127.0.0.1", free_port())
+	results = [connect(proxy_addr, dead) for i in range(requests)]
+	return set(r[0] for r in results), [r[1] for r in results]
+
+def run_blackhole(proxy_addr,target_addr):
+	start = time.perf_counter()
+	results = [connect(proxy_addr, target_addr) for i in range(blackhole)]
+	return set(r[0] for r in results), time.perf_counter() - start
+
+def run_ttl(ttl,blackhole_addr):
+	proxy_addr = ("127.0.0.1", free_port())
+	proxy = start("proxy.py", "--listen", "%s:%d" % proxy_addr, "--handoff-path", "none",
+				"--set", "admission.conn_rate=none", "--set", "admission.max_sessions=none",
+				"--set", "timeouts.connect=%s" % connect_timeout,
+				"--set", "timeouts.tick=0.05", "--set", "timeouts.negative=%s" % ttl)
+	time.sleep(1.0)
+	try:
+		refused = run_refused(proxy_addr)
+		held = run_blackhole(proxy_addr, blackhole_addr)
+		alive = proxy.poll() is None
+	finally:
+		stop(proxy)
+	return refused, held, alive
+
+def main():
+	listener, fill = open_blackhole()
+	try:
+		with contextlib.redirect_stdout(io.StringIO()):
+			results = [(ttl,) + run_ttl(ttl, listener.getsockname()) for ttl in negative_ttls]
+	finally:
+		for sock in fill:
+			sock.close()
+		listener.close()
+
+	for ttl, (reps, latencies), (held_reps, held), alive in results:
+		print("[*] Negative cache %s:" % ("off" if not ttl else "%s s" % ttl))
+		print("[*]   Refused, REP %s:       p50 %.3f ms, p99 %.3f ms" % (sorted(reps),
+				percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000))
+		print("[*]   Blackhole, REP %s:     %d CONNECTs answered in %.2f s" % (sorted(held_reps),
+				blackhole, held))
+		print("[*]   Proxy running:          %s" % (alive))
+
+if __name__=='__main__':
+	main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+#_____________________________________________________________________________
+#
+# Load test: rolling restart of the SOCKS5 proxy with listener handoff
+#
+# Author:   Samdney  <contact@carolin-zoebelein.de>
+#			D4A7 35E8 D47F 801F 2CF6 2BA7 927A FD3C DE47 E13B
+# License:  See LICENSE for licensing information
+#_____________________________________________________________________________
+
+# Clients open sessions through the proxy as fast as they can (Hallo, CONNECT,
+# one message to an echo target server and back), while every `interval`
+# seconds a new proxy process is started, which takes the listening socket
+# over from the running one (see handoff.py). Counts refused and failed
+# sessions.
+
+import contextlib
+import io
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from socks5 import *
+
+Socks5_Protocol = Protocol()
+
+# **********
+# Config
+# **********
+clients		= 8		# concurrent clients
+restarts	= 5		# proxy processes started after the first one
+interval	= 1.0	# seconds between restarts
+msg			= b"She is a nice girl."
+# **********
+
+def free_port():
+	sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	sock.bind(("127.0.0.1", 0))
+	port = sock.getsockname()[1]
+	sock.close()
+	return port
+
+# Echo target server, one thread per connection
+def start_target():
+	sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	sock.bind(("127.0.0.1", 0))
+	sock.listen(1024)
+	def echo(conn):
+		while True:
+			data = conn.recv(1024)
+			if not data:
+				break
+			conn.sendall(data)
+		conn.close()
+	def run():
+		while True:
+			conn, addr = sock.accept()
+			threading.Thread(target=echo, args=(conn,), daemon=True).start()
+	threading.Thread(target=run, daemon=True).start()
+	return sock.getsockname()
+
+def start_proxy(proxy_addr,handoff_path):
+	path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "proxy.py")
+	argv = [sys.executable, path, "--listen", "%s:%d" % proxy_addr, "--backlog", "1024",
+			"--handoff-path", handoff_path,
+			"--set", "admission.conn_rate=none", "--set", "admission.max_sessions=none"]
+	return subprocess.Popen(argv, stdout=subprocess.DEVNULL)
+
+def session(proxy_addr,target_addr):
+	Socks5_Client = Client()
+	Socks5_Client.init_socketToProxy(socket.AF_INET, socket.SOCK_STREAM, proxy_addr, 10)
+	try:
+		Socks5_Client.hallo_send(Socks5_Protocol.VER, b'\x01', Socks5_Protocol.METHOD_NOAUTH)
+		Socks5_Client.hallo_recv()
+		DST_ADDR = socket.inet_aton(target_addr[0])
+		DST_PORT = target_addr[1]
+		Socks5_Client.connect_send(Socks5_Protocol.VER, Socks5_Protocol.CMD_CONNECT,
+			Socks5_Protocol.RSV, Socks5_Protocol.ATYP_IPV4, DST_ADDR, DST_PORT)
+		Socks5_Client.connect_recv()
+		Socks5_Client.sockToProxy.sendall(msg)
+		data = Socks5_Client.sockToProxy.recv(1024)
+		if not data:
+			raise Socks5Error("no data from target server")
+	finally:
+		Socks5_Client.sockToProxy.close()
+
+def main():
+	target_addr = start_target()
+	proxy_addr = ("127.0.0.1", free_port())
+	handoff_path = os.path.join(tempfile.mkdtemp(), "handoff")
+
+	ok = [0] * clients
+	failed = [0] * clients
+	running = [True]
+
+	def run(i):
+		while running[0]:
+			try:
+				session(proxy_addr, target_addr)
+				ok[i] += 1
+			except BaseException as e:
+				# Client calls sys.exit() if it can not connect
+				failed[i] += 1
+
+	procs = [start_proxy(proxy_addr, handoff_path)]
+	time.sleep(1.0)
+
+	with contextlib.redirect_stdout(io.StringIO()):
+		threads = [threading.Thread(target=run, args=(i,)) for i in range(clients)]
+		for t in threads:
+			t.start()
+		for i in range(restarts):
+			time.sleep(interval)
+			procs.append(start_proxy(proxy_addr, handoff_path))
+		time.sleep(interval)
+		running[0] = False
+		for t in threads:
+			t.join()
+
+	# All but the last process have to exit by themselves after draining
+	exited = 0
+	for proc in procs[:-1]:
+		try:
+			proc.wait(timeout=10)
+			exited += 1
+		except subprocess.TimeoutExpired:
+			proc.kill()
+	procs[-1].terminate()
+	procs[-1].wait()
+
+	print("[*] Proxy processes:        %d (%d restarts)" % (len(procs), restarts))
+	print("[*] Old processes exited:   %d/%d" % (exited, len(procs) - 1))
+	print("[*] Sessions ok:            %d" % (sum(ok)))
+	print("[*] Sessions failed:        %d" % (sum(failed)))
+
+if __name__=='__main__':
+	main()
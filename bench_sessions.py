@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+#_____________________________________________________________________________
+#
+# Memory per idle session of the SOCKS5 proxy
+#
+# Author:   Samdney  <contact@carolin-zoebelein.de>
+#			D4A7 35E8 D47F 801F 2CF6 2BA7 927A FD3C DE47 E13B
+# License:  See LICENSE for licensing information
+#_____________________________________________________________________________
+
+# Opens idle sessions through a proxy process (Hallo, CONNECT to an echo
+# target, then nothing) and reads the resident memory (VmRSS) of the proxy
+# at some steps. Memory per session is the slope between the steps, the
+# totals for 10k and 100k sessions are computed from it.
+#
+# Every session costs the proxy 2 file descriptors, this process 1 and the
+# target 1, so the number of sessions is limited by RLIMIT_NOFILE.
+
+import contextlib
+import io
+import os
+import resource
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+from socks5 import *
+
+Socks5_Protocol = Protocol()
+
+# **********
+# Config
+# **********
+steps		= [1000, 2000, 4000, 6000, 8000, 9500]	# sessions open at each measurement
+report		= [10000, 100000]						# sessions, from the slope
+# **********
+
+def free_port():
+	sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	sock.bind(("127.0.0.1", 0))
+	port = sock.getsockname()[1]
+	sock.close()
+	return port
+
+def start(script,*argv):
+	path = os.path.join(os.path.dirname(os.path.abspath(__file__)), script)
+	return subprocess.Popen([sys.executable, path] + list(argv), stdout=subprocess.DEVNULL)
+
+def rss(pid):
+	with open("/proc/%d/status" % pid) as f:
+		for line in f:
+			if line.startswith("VmRSS:"):
+				return int(line.split()[1]) * 1024
+	return 0
+
+def open_session(proxy_addr,target_addr):
+	Socks5_Client = Client()
+	Socks5_Client.init_socketToProxy(socket.AF_INET, socket.SOCK_STREAM, proxy_addr, 10)
+	Socks5_Client.hallo_send(Socks5_Protocol.VER, b'\x01', Socks5_Protocol.METHOD_NOAUTH)
+	Socks5_Client.hallo_recv()
+	DST_ADDR = socket.inet_aton(target_addr[0])
+	DST_PORT = target_addr[1]
+	Socks5_Client.connect_send(Socks5_Protocol.VER, Socks5_Protocol.CMD_CONNECT,
+		Socks5_Protocol.RSV, Socks5_Protocol.ATYP_IPV4, DST_ADDR, DST_PORT)
+	Socks5_Client.connect_recv()
+	return Socks5_Client.sockToProxy
+
+def main():
+	limit = resource.getrlimit(resource.RLIMIT_NOFILE)[1]
+	resource.setrlimit(resource.RLIMIT_NOFILE, (limit, limit))
+	max_sessions = (limit - 200) // 2
+	sizes = [n for n in steps if n <= max_sessions]
+
+	target_addr = ("127.0.0.1", free_port())
+	proxy_addr = ("127.0.0.1", free_port())
+	target = start("target.py", "--listen", "%s:%d" % target_addr, "--backlog", "4096",
+					"--mode", "echo")
+	proxy = start("proxy.py", "--listen", "%s:%d" % proxy_addr, "--backlog", "4096",
+					"--handoff-path", "none",
+					"--set", "admission.conn_rate=none", "--set", "admission.max_sessions=none",
+					"--set", "timeouts.idle=3600")
+	time.sleep(1.0)
+
+	sessions = []
+	results = []
+	try:
+		with contextlib.redirect_stdout(io.StringIO()):
+			for n in sizes:
+				while len(sessions) < n:
+					sessions.append(open_session(proxy_addr, target_addr))
+				# Let the proxy finish the last handshakes
+				time.sleep(1.0)
+				results.append((n, rss(proxy.pid)))
+	finally:
+		for sock in sessions:
+			sock.close()
+		for proc in (proxy, target):
+			proc.send_signal(signal.SIGINT)
+			proc.wait()
+
+	# Least squares: rss = base + n * per_session
+	count = len(results)
+	mean_n = sum(n for n, r in results) / count
+	mean_r = sum(r for n, r in results) / count
+	per_session = sum((n - mean_n) * (r - mean_r) for n, r in results) \
+				/ sum((n - mean_n) ** 2 for n, r in results)
+	base = mean_r - per_session * mean_n
+
+	print("[*] RLIMIT_NOFILE %d: at most %d sessions measured" % (limit, max_sessions))
+	for n, r in results:
+		print("[*]   %6d idle sessions:   RSS %8.1f MB" % (n, r / 1e6))
+	print("[*] Memory per idle session:  %8.0f bytes" % (per_session))
+	for n in report:
+		print("[*]   %6d idle sessions:   RSS %8.1f MB%s" % (n, (base + n * per_session) / 1e6,
+				"" if n <= max_sessions else " (computed)"))
+
+if __name__=='__main__':
+	main()
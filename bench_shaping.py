@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+#_____________________________________________________________________________
+#
+# Benchmark: bandwidth shaping (shaper.py), bulk sessions next to small ones
+#
+# Author:   Samdney  <contact@carolin-zoebelein.de>
+#			D4A7 35E8 D47F 801F 2CF6 2BA7 927A FD3C DE47 E13B
+# License:  See LICENSE for licensing information
+#_____________________________________________________________________________
+
+# Setup, everything on 127.0.0.1, proxy (filter 0, chunk_size 65536) and
+# targets are their own processes. At the same time, for duration seconds:
+#
+#	bulk:	bulk_sessions sessions, each reads from ./target.py --mode stream
+#			as fast as it can. Throughput of each and all together.
+#	small:	one session, request (64 octets) -> response (response_size
+#			octets, ./target.py --mode fixed), think seconds between. Round
+#			trip latency.
+#
+# Runs:
+#
+#	off:		no [shaping] rate
+#	equal:		[shaping] rate = link_rate, every route weight 1
+#	weighted:	[shaping] rate = link_rate, [route 127.0.0.1/32] with the
+#				port of the bulk target weight 1, [route default] (the small
+#				session) small_weight
+
+import contextlib
+import io
+import socket
+import threading
+import time
+
+from socks5 import *
+from bench_sockets import free_port, start, stop, percentile
+
+Socks5_Protocol = Protocol()
+
+# **********
+# Config
+# **********
+duration		= 5.0			# seconds per run
+bulk_sessions	= 4
+link_rate		= 100000000		# [shaping] rate, octets/sec
+small_weight	= 8
+request_size	= 64
+response_size	= 1500
+think			= 0.005			# seconds between two small requests
+# **********
+
+def open_session(proxy_addr,target_addr):
+	Socks5_Client = Client()
+	Socks5_Client.init_socketToProxy(socket.AF_INET, socket.SOCK_STREAM, proxy_addr, 10)
+	Socks5_Client.hallo_send(Socks5_Protocol.VER, b'\x01', Socks5_Protocol.METHOD_NOAUTH)
+	Socks5_Client.hallo_recv()
+	DST_ADDR = socket.inet_aton(target_addr[0])
+	DST_PORT = target_addr[1]
+	Socks5_Client.connect_send(Socks5_Protocol.VER, Socks5_Protocol.CMD_CONNECT,
+		Socks5_Protocol.RSV, Socks5_Protocol.ATYP_IPV4, DST_ADDR, DST_PORT)
+	Socks5_Client.connect_recv()
+	return Socks5_Client.sockToProxy
+
+# Appends the octets received until deadline to received
+def bulk_session(proxy_addr,target_addr,deadline,received):
+	sock = open_session(proxy_addr, target_addr)
+	octets = 0
+	try:
+		sock.sendall(b"x")
+		while time.perf_counter() < deadline:
+			data = sock.recv(65536)
+			if not data:
+				break
+			octets += len(data)
+	finally:
+		sock.close()
+		received.append(octets)
+
+# Appends the round trip seconds until deadline to rtts
+def small_session(proxy_addr,target_addr,deadline,rtts):
+	sock = open_session(proxy_addr, target_addr)
+	request = b"x" * request_size
+	try:
+		while time.perf_counter() < deadline:
+			start = time.perf_counter()
+			sock.sendall(request)
+			received = 0
+			while received < response_size:
+				data = sock.recv(65536)
+				if not data:
+					raise Socks5Error("connection closed")
+				received += len(data)
+			rtts.append(time.perf_counter() - start)
+			time.sleep(think)
+	finally:
+		sock.close()
+
+# Returns ([MB/s of each bulk session], [round trip seconds])
+def run(options,small_target,bulk_target):
+	proxy_addr = ("127.0.0.1", free_port())
+	proxy = start("proxy.py", "--listen", "%s:%d" % proxy_addr, "--handoff-path", "none",
+				"--filter", "0", "--chunk-size", "65536",
+				"--set", "admission.conn_rate=none", "--set", "admission.max_sessions=none",
+				*options)
+	time.sleep(1.0)
+	try:
+		received, rtts = [], []
+		deadline = time.perf_counter() + duration
+		threads = [threading.Thread(target=bulk_session,
+									args=(proxy_addr, bulk_target, deadline, received))
+					for i in range(bulk_sessions)]
+		threads.append(threading.Thread(target=small_session,
+										args=(proxy_addr, small_target, deadline, rtts)))
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+	finally:
+		stop(proxy)
+	return [octets / duration / 1e6 for octets in received], rtts
+
+def main():
+	small_target = ("127.0.0.1", free_port())
+	bulk_target = ("127.0.0.1", free_port())
+	targets = [
+		start("target.py", "--listen", "%s:%d" % small_target, "--mode", "fixed",
+				"--size", str(response_size)),
+		start("target.py", "--listen", "%s:%d" % bulk_target, "--mode", "stream",
+				"--size", str(1 << 50), "--buffer-size", "65536")]
+	shaped = ["--set", "shaping.rate=%d" % link_rate]
+	bulk_route = ["--set", "route 127.0.0.1/32.ports=%d" % bulk_target[1],
+				"--set", "route 127.0.0.1/32.weight=1"]
+	runs = [
+		("off", []),
+		("equal", shaped),
+		("weighted", shaped + bulk_route + ["--set", "route default.weight=%d" % small_weight]),
+	]
+	time.sleep(1.0)
+	try:
+		with contextlib.redirect_stdout(io.StringIO()):
+			results = [(name,) + run(options, small_target, bulk_target) for name, options in runs]
+	finally:
+		for target in targets:
+			stop(target)
+
+	print("[*] %d bulk sessions and one small session, %.0f s, link_rate %.1f MB/s:"
+			% (bulk_sessions, duration, link_rate / 1e6))
+	for name, throughput, rtts in results:
+		rtts = rtts or [0]
+		print("[*] Shaping %s:" % (name))
+		print("[*]   Bulk throughput:        %8.1f MB/s (%s)" % (sum(throughput),
+				", ".join("%.1f" % t for t in throughput)))
+		print("[*]   Small round trip p50/p99: %6.3f / %.3f ms (%d)" % (percentile(rtts, 50) * 1000,
+				percentile(rtts, 99) * 1000, len(rtts)))
+
+if __name__=='__main__':
+	main()
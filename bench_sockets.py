@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+
+#_____________________________________________________________________________
+#
+# Benchmark: socket profiles (see sockopts.py), small requests and bulk
+#
+# Author:   Samdney  <contact@carolin-zoebelein.de>
+#			D4A7 35E8 D47F 801F 2CF6 2BA7 927A FD3C DE47 E13B
+# License:  See LICENSE for licensing information
+#_____________________________________________________________________________
+
+# Setup, everything on 127.0.0.1, proxy and targets are their own processes.
+# For each profile the proxy uses it on the listener and in [route default],
+# the clients of this script on their socket to the proxy:
+#
+#	setup:	sessions opened one after the other, latency from connect until
+#			the CONNECT answer
+#	small:	one session, request (64 octets) -> response (response_size
+#			octets, more than one relay chunk), one after the other. Round
+#			trip latency.
+#	bulk:	one session, bulk_size octets from the target (./target.py
+#			--mode stream), chunk_size 65536. Throughput.
+
+import contextlib
+import io
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+from socks5 import *
+from sockopts import PROFILES
+
+Socks5_Protocol = Protocol()
+
+# **********
+# Config
+# **********
+profiles		= ["default", "interactive", "bulk"]
+setup_sessions	= 100			# sessions for the setup latency
+requests		= 200			# round trips per small session
+request_size	= 64
+response_size	= 1500			# > chunk_size 1024: two writes of the relay
+bulk_size		= 200000000
+rounds			= 3				# small and bulk sessions per profile
+# **********
+
+def free_port():
+	sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	sock.bind(("127.0.0.1", 0))
+	port = sock.getsockname()[1]
+	sock.close()
+	return port
+
+def start(script,*argv):
+	path = os.path.join(os.path.dirname(os.path.abspath(__file__)), script)
+	return subprocess.Popen([sys.executable, path] + list(argv), stdout=subprocess.DEVNULL)
+
+def stop(proc):
+	proc.send_signal(signal.SIGTERM)
+	proc.wait()
+
+def open_session(proxy_addr,target_addr,profile):
+	Socks5_Client = Client()
+	Socks5_Client.init_socketToProxy(socket.AF_INET, socket.SOCK_STREAM, proxy_addr, 10,
+									PROFILES[profile])
+	Socks5_Client.hallo_send(Socks5_Protocol.VER, b'\x01', Socks5_Protocol.METHOD_NOAUTH)
+	Socks5_Client.hallo_recv()
+	DST_ADDR = socket.inet_aton(target_addr[0])
+	DST_PORT = target_addr[1]
+	Socks5_Client.connect_send(Socks5_Protocol.VER, Socks5_Protocol.CMD_CONNECT,
+		Socks5_Protocol.RSV, Socks5_Protocol.ATYP_IPV4, DST_ADDR, DST_PORT)
+	Socks5_Client.connect_recv()
+	return Socks5_Client.sockToProxy
+
+def recv_exact(sock,n):
+	received = 0
+	while received < n:
+		data = sock.recv(65536)
+		if not data:
+			raise Socks5Error("connection closed")
+		received += len(data)
+
+def setup_session(proxy_addr,target_addr,profile):
+	start = time.perf_counter()
+	sock = open_session(proxy_addr, target_addr, profile)
+	setup = time.perf_counter() - start
+	sock.close()
+	return setup
+
+# Returns [round trip seconds]
+def small_session(proxy_addr,target_addr,profile):
+	sock = open_session(proxy_addr, target_addr, profile)
+	request = b"x" * request_size
+	rtts = []
+	try:
+		for i in range(requests):
+			start = time.perf_counter()
+			sock.sendall(request)
+			recv_exact(sock, response_size)
+			rtts.append(time.perf_counter() - start)
+	finally:
+		sock.close()
+	return rtts
+
+# Returns MB/s
+def bulk_session(proxy_addr,target_addr,profile):
+	sock = open_session(proxy_addr, target_addr, profile)
+	try:
+		start = time.perf_counter()
+		sock.sendall(b"x")
+		recv_exact(sock, bulk_size)
+		return bulk_size / (time.perf_counter() - start) / 1e6
+	finally:
+		sock.close()
+
+def start_proxy(profile,*options):
+	addr = ("127.0.0.1", free_port())
+	proc = start("proxy.py", "--listen", "%s:%d" % addr, "--handoff-path", "none",
+				"--filter", "0", "--set", "proxy.socket_profile=%s" % profile,
+				"--set", "route default.socket_profile=%s" % profile, *options)
+	return proc, addr
+
+def percentile(values,p):
+	values = sorted(values)
+	return values[min(int(p / 100 * len(values)), len(values) - 1)]
+
+def run_profile(profile,small_target,bulk_target):
+	proxy, proxy_addr = start_proxy(profile, "--set", "admission.conn_rate=none")
+	bulk_proxy, bulk_proxy_addr = start_proxy(profile, "--chunk-size", "65536")
+	time.sleep(1.0)
+	try:
+		setups, rtts, throughput = [], [], []
+		for i in range(setup_sessions):
+			setups.append(setup_session(proxy_addr, small_target, profile))
+		for i in range(rounds):
+			rtts.extend(small_session(proxy_addr, small_target, profile))
+			throughput.append(bulk_session(bulk_proxy_addr, bulk_target, profile))
+	finally:
+		stop(proxy)
+		stop(bulk_proxy)
+	return percentile(setups, 50), percentile(rtts, 50), percentile(rtts, 99), max(throughput)
+
+def main():
+	small_target = ("127.0.0.1", free_port())
+	bulk_target = ("127.0.0.1", free_port())
+	targets = [
+		start("target.py", "--listen", "%s:%d" % small_target, "--mode", "fixed",
+				"--size", str(response_size)),
+		start("target.py", "--listen", "%s:%d" % bulk_target, "--mode", "stream",
+				"--size", str(bulk_size), "--buffer-size", "65536")]
+	time.sleep(1.0)
+	try:
+		with contextlib.redirect_stdout(io.StringIO()):
+			results = [(profile,) + run_profile(profile, small_target, bulk_target)
+						for profile in profiles]
+	finally:
+		for target in targets:
+			stop(target)
+
+	for profile, setup, p50, p99, throughput in results:
+		print("[*] Profile %s:" % (profile))
+		print("[*]   Setup latency p50:      %8.3f ms" % (setup * 1000))
+		print("[*]   Round trip p50/p99:     %8.3f / %.3f ms" % (p50 * 1000, p99 * 1000))
+		print("[*]   Bulk throughput:        %8.1f MB/s" % (throughput))
+
+if __name__=='__main__':
+	main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+#_____________________________________________________________________________
+#
+# Benchmark: start of embedded proxies (embed.py) and of ./proxy.py
+#
+# Author:   Samdney  <contact@carolin-zoebelein.de>
+#			D4A7 35E8 D47F 801F 2CF6 2BA7 927A FD3C DE47 E13B
+# License:  See LICENSE for licensing information
+#_____________________________________________________________________________
+
+# Setup, everything on 127.0.0.1, the target server is its own process:
+#
+#	embedded:	start_server() and close(), one after the other. Latency of
+#				each, and start until the answer of the first session.
+#	many:		instances proxies at once in this process, one session
+#				through each, then all closed.
+#	process:	./proxy.py, from the start of the process until the first
+#				session is answered.
+
+import contextlib
+import io
+import socket
+import time
+
+from socks5 import *
+from embed import start_server
+from bench_sockets import free_port, start, stop, percentile
+
+Socks5_Protocol = Protocol()
+
+# **********
+# Config
+# **********
+starts			= 200			# embedded starts one after the other
+instances		= 200			# embedded proxies at once
+processes		= 5				# starts of ./proxy.py
+config			= {"route default.filter": 0, "proxy.drain_timeout": 1}
+# **********
+
+def session(proxy_addr,target_addr):
+	Socks5_Client = Client()
+	Socks5_Client.init_socketToProxy(socket.AF_INET, socket.SOCK_STREAM, proxy_addr, 10)
+	try:
+		Socks5_Client.hallo_send(Socks5_Protocol.VER, b'\x01', Socks5_Protocol.METHOD_NOAUTH)
+		Socks5_Client.hallo_recv()
+		DST_ADDR = socket.inet_aton(target_addr[0])
+		DST_PORT = target_addr[1]
+		Socks5_Client.connect_send(Socks5_Protocol.VER, Socks5_Protocol.CMD_CONNECT,
+			Socks5_Protocol.RSV, Socks5_Protocol.ATYP_IPV4, DST_ADDR, DST_PORT)
+		Socks5_Client.connect_recv()
+		Socks5_Client.sockToProxy.sendall(b"ping")
+		if not Socks5_Client.sockToProxy.recv(1024):
+			raise Socks5Error("no data from target server")
+	finally:
+		Socks5_Client.sockToProxy.close()
+
+def run_embedded(target_addr):
+	starting, first, closing = [], [], []
+	for i in range(starts):
+		begin = time.perf_counter()
+		proxy = start_server(config)
+		started = time.perf_counter()
+		session(("127.0.0.1", proxy.port), target_addr)
+		answered = time.perf_counter()
+		proxy.close()
+		starting.append(started - begin)
+		first.append(answered - begin)
+		closing.append(time.perf_counter() - answered)
+	return starting, first, closing
+
+def run_many(target_addr):
+	begin = time.perf_counter()
+	proxies = [start_server(config) for i in range(instances)]
+	started = time.perf_counter()
+	for proxy in proxies:
+		session(("127.0.0.1", proxy.port), target_addr)
+	done = sum(proxy.stats()["sessions_done"] for proxy in proxies)
+	answered = time.perf_counter()
+	for proxy in proxies:
+		proxy.close()
+	return started - begin, answered - started, time.perf_counter() - answered, done
+
+def run_process(target_addr):
+	times = []
+	for i in range(processes):
+		proxy_addr = ("127.0.0.1", free_port())
+		begin = time.perf_counter()
+		proc = start("proxy.py", "--listen", "%s:%d" % proxy_addr, "--handoff-path", "none",
+					"--filter", "0")
+		try:
+			while True:
+				try:
+					session(proxy_addr, target_addr)
+					break
+				except Socks5Error:
+					# Not listening yet
+					time.sleep(0.001)
+			times.append(time.perf_counter() - begin)
+		finally:
+			stop(proc)
+	return times
+
+def main():
+	target_addr = ("127.0.0.1", free_port())
+	target = start("target.py", "--listen", "%s:%d" % target_addr)
+	time.sleep(1.0)
+	try:
+		with contextlib.redirect_stdout(io.StringIO()):
+			# Imports and first use, not part of the numbers
+			start_server(config).close()
+			starting, first, closing = run_embedded(target_addr)
+			many = run_many(target_addr)
+			process = run_process(target_addr)
+	finally:
+		stop(target)
+
+	print("[*] Embedded, %d starts:" % (starts))
+	print("[*]   start_server() p50/p99:   %8.3f / %.3f ms" % (percentile(starting, 50) * 1000,
+			percentile(starting, 99) * 1000))
+	print("[*]   First session p50/p99:    %8.3f / %.3f ms" % (percentile(first, 50) * 1000,
+			percentile(first, 99) * 1000))
+	print("[*]   close() p50/p99:          %8.3f / %.3f ms" % (percentile(closing, 50) * 1000,
+			percentile(closing, 99) * 1000))
+	print("[*] Embedded, %d at once:" % (instances))
+	print("[*]   Started in:               %8.1f ms" % (many[0] * 1000))
+	print("[*]   One session each in:      %8.1f ms (%d sessions)" % (many[1] * 1000, many[3]))
+	print("[*]   Closed in:                %8.1f ms" % (many[2] * 1000))
+	print("[*] ./proxy.py, %d starts:" % (processes))
+	print("[*]   First session p50:        %8.3f ms" % (percentile(process, 50) * 1000))
+
+if __name__=='__main__':
+	main()
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+
+#_____________________________________________________________________________
+#
+# Load test: chaining through parent SOCKS5 servers on loopback
+#
+# Author:   Samdney  <contact@carolin-zoebelein.de>
+#			D4A7 35E8 D47F 801F 2CF6 2BA7 927A FD3C DE47 E13B
+# License:  See LICENSE for licensing information
+#_____________________________________________________________________________
+
+# Setup, everything on 127.0.0.1:
+#
+#	clients -> proxy -> parent 1 (proxy process)          -> echo target
+#	                 -> parent 2 (proxy process)          ->
+#	                 -> slow parent (relay with delay, in front of a proxy process)
+#	                 -> dead parent (nobody listening)
+#
+# For each policy (see upstream.py) clients open sessions through the proxy
+# as fast as they can (Hallo, CONNECT, one message to the target and back).
+# Shows the sessions per parent, its health and latency average, and the
+# session latency. The slow and the dead parent should be ejected by the
+# health checks.
+
+import asyncio
+import contextlib
+import io
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import proxy
+from socks5 import *
+
+Socks5_Protocol = Protocol()
+
+# **********
+# Config
+# **********
+clients		= 8		# concurrent clients
+duration	= 3.0	# seconds per policy
+delay		= 0.05	# seconds, slow parent: per answer
+max_latency	= 0.02	# seconds, slower parents are ejected
+msg			= b"She is a nice girl."
+# **********
+
+def free_port():
+	sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	sock.bind(("127.0.0.1", 0))
+	port = sock.getsockname()[1]
+	sock.close()
+	return port
+
+# Echo target server, one thread per connection
+def start_target():
+	sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	sock.bind(("127.0.0.1", 0))
+	sock.listen(1024)
+	def echo(conn):
+		while True:
+			data = conn.recv(1024)
+			if not data:
+				break
+			conn.sendall(data)
+		conn.close()
+	def run():
+		while True:
+			conn, addr = sock.accept()
+			threading.Thread(target=echo, args=(conn,), daemon=True).start()
+	threading.Thread(target=run, daemon=True).start()
+	return sock.getsockname()
+
+def start_parent():
+	parent_addr = ("127.0.0.1", free_port())
+	path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "proxy.py")
+	argv = [sys.executable, path, "--listen", "%s:%d" % parent_addr, "--backlog", "1024",
+			"--handoff-path", "none", "--filter", "0",
+			"--set", "admission.conn_rate=none", "--set", "admission.max_sessions=none"]
+	return parent_addr, subprocess.Popen(argv, stdout=subprocess.DEVNULL)
+
+# TCP relay in front of parent_addr, every chunk from the parent is delayed
+def start_slow_relay(parent_addr):
+	sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	sock.bind(("127.0.0.1", 0))
+	sock.listen(1024)
+	def pump(src,dst,wait):
+		try:
+			while True:
+				data = src.recv(1024)
+				if not data:
+					break
+				time.sleep(wait)
+				dst.sendall(data)
+			dst.shutdown(socket.SHUT_WR)
+		except OSError:
+			pass
+	def run():
+		while True:
+			conn, addr = sock.accept()
+			try:
+				up = socket.create_connection(parent_addr)
+			except OSError:
+				conn.close()
+				continue
+			threading.Thread(target=pump, args=(conn, up, 0), daemon=True).start()
+			threading.Thread(target=pump, args=(up, conn, delay), daemon=True).start()
+	threading.Thread(target=run, daemon=True).start()
+	return sock.getsockname()
+
+def start_proxy(parents,policy):
+	proxy_addr = ("127.0.0.1", free_port())
+	argv = ["--listen", "%s:%d" % proxy_addr, "--backlog", "1024", "--handoff-path", "none",
+			"--filter", "0",
+			"--set", "admission.conn_rate=none", "--set", "admission.max_sessions=none",
+			"--set", "upstream.policy=%s" % policy,
+			"--set", "upstream.check_interval=0.5",
+			"--set", "upstream.check_timeout=0.5",
+			"--set", "upstream.max_latency=%s" % max_latency]
+	for parent_addr in parents:
+		argv += ["--parent", "%s:%d" % parent_addr]
+	args = proxy.argument_parser("bench").parse_args(argv)
+	settings, routes = proxy.load_config(args)
+	server = proxy.ProxyServer(args, settings, routes, *proxy.open_listeners(settings))
+	loops = []
+	async def serve():
+		loops.append(asyncio.get_running_loop())
+		await server.run()
+	thread = threading.Thread(target=asyncio.run, args=(serve(),))
+	thread.start()
+	time.sleep(0.5)
+	# Stops accepting and waits for the end of the proxy
+	def stop():
+		loops[0].call_soon_threadsafe(server.stop)
+		thread.join()
+	return proxy_addr, server, stop
+
+def session(proxy_addr,target_addr):
+	Socks5_Client = Client()
+	Socks5_Client.init_socketToProxy(socket.AF_INET, socket.SOCK_STREAM, proxy_addr, 10)
+	try:
+		Socks5_Client.hallo_send(Socks5_Protocol.VER, b'\x01', Socks5_Protocol.METHOD_NOAUTH)
+		Socks5_Client.hallo_recv()
+		DST_ADDR = socket.inet_aton(target_addr[0])
+		DST_PORT = target_addr[1]
+		Socks5_Client.connect_send(Socks5_Protocol.VER, Socks5_Protocol.CMD_CONNECT,
+			Socks5_Protocol.RSV, Socks5_Protocol.ATYP_IPV4, DST_ADDR, DST_PORT)
+		Socks5_Client.connect_recv()
+		Socks5_Client.sockToProxy.sendall(msg)
+		data = Socks5_Client.sockToProxy.recv(1024)
+		if not data:
+			raise Socks5Error("no data from target server")
+	finally:
+		Socks5_Client.sockToProxy.close()
+
+def run_policy(parents,names,policy,target_addr):
+	proxy_addr, server, stop_proxy = start_proxy(parents, policy)
+	# The first health checks
+	time.sleep(1.0)
+
+	ok = [0] * clients
+	failed = [0] * clients
+	latency = [0.0] * clients
+	stop = time.monotonic() + duration
+	def run(i):
+		while time.monotonic() < stop:
+			start = time.perf_counter()
+			try:
+				session(proxy_addr, target_addr)
+				ok[i] += 1
+				latency[i] += time.perf_counter() - start
+			except Exception as e:
+				failed[i] += 1
+	threads = [threading.Thread(target=run, args=(i,)) for i in range(clients)]
+	for t in threads:
+		t.start()
+	for t in threads:
+		t.join()
+
+	pool = server.upstream
+	stats = [(names[i], parent.sessions, parent.healthy, parent.ewma)
+			for i, parent in enumerate(pool.parents)]
+	stop_proxy()
+	return sum(ok), sum(failed), sum(latency) / max(sum(ok), 1), stats
+
+def main():
+	target_addr = start_target()
+	procs = []
+	parent1, proc = start_parent()
+	procs.append(proc)
+	parent2, proc = start_parent()
+	procs.append(proc)
+	parent3, proc = start_parent()
+	procs.append(proc)
+	slow = start_slow_relay(parent3)
+	dead = ("127.0.0.1", free_port())
+	parents = [parent1, parent2, slow, dead]
+	names = ["parent 1", "parent 2", "slow parent", "dead parent"]
+	time.sleep(1.0)
+
+	results = []
+	try:
+		with contextlib.redirect_stdout(io.StringIO()):
+			for policy in ("least_inflight", "ewma"):
+				results.append((policy,) + run_policy(parents, names, policy, target_addr))
+	finally:
+		for proc in procs:
+			proc.terminate()
+			proc.wait()
+
+	for policy, ok, failed, latency, stats in results:
+		print("[*] Policy %s (%d clients):" % (policy, clients))
+		print("[*]   Sessions ok:            %d" % (ok))
+		print("[*]   Sessions failed:        %d" % (failed))
+		print("[*]   Session latency:        %8.3f ms" % (latency * 1000))
+		for name, sessions, healthy, ewma in stats:
+			print("[*]   %-12s %6d sessions, %-9s ewma %8.3f ms"
+				% (name + ":", sessions, "healthy," if healthy else "ejected,", (ewma or 0) * 1000))
+
+if __name__=='__main__':
+	main()
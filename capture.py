@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+#_____________________________________________________________________________
+#
+# Binary traffic capture of the SOCKS5 proxy
+#
+# Author:   Samdney  <contact@carolin-zoebelein.de>
+# D4A7 35E8 D47F 801F 2CF6 2BA7 927A FD3C DE47 E13B
+# License:  See LICENSE for licensing information
+#_____________________________________________________________________________
+
+"""
+***Capture log***
+
+	[capture]
+	file = /tmp/pysocks5sys.cap		(or ./proxy.py --capture FILE)
+
+=> Appends every session to a binary log, for replay.py. A log is a sequence
+	of frames, nothing else:
+
+	+-------+---------+------+--------+-------------+
+	| TIME  | SESSION | KIND | LENGTH |   PAYLOAD   |
+	+-------+---------+------+--------+-------------+
+	|   8   |    8    |  1   |   4    |   LENGTH    |
+	+-------+---------+------+--------+-------------+
+	(network byte order, TIME: double, seconds since the epoch)
+
+	SESSION: pid << 32 | id of the session table, unique over the workers
+		and restarts which append to the same file
+	KIND:
+		START		a process starts writing, payload CAPTURE_MAGIC
+		OPEN		the CONNECT request of the client (VER+CMD+RSV+ATYP+
+					DST.ADDR+DST.PORT), after the target is connected
+		TO_TARGET	data client -> target
+		TO_CLIENT	data target -> client, as received, before the filter
+		CLOSE		end of the session
+		GAP			frames of the session were dropped here (see below),
+					the session is incomplete, payload empty
+
+=> Costs of the event loop per frame: one struct.pack and one put into a
+	queue. A background thread writes the queue every flush_interval seconds,
+	one write() per batch (O_APPEND: batches of workers do not mix).
+=> The queue holds at most max_pending octets. Above it frames are dropped
+	(counted, reported at close), the relay never waits for the disk. The
+	first dropped frame of a session (again after a frame of it got through)
+	puts a GAP frame in its place, over max_pending: replay.py knows the
+	session is incomplete.
+"""
+
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+
+FRAME_HEADER	= struct.Struct("!dQBI")
+CAPTURE_MAGIC	= b"pysocks5sys capture 1"
+
+# Kinds of frames
+START, OPEN, TO_TARGET, TO_CLIENT, CLOSE, GAP = range(6)
+KIND_NAMES = ("start", "open", "to_target", "to_client", "close", "gap")
+
+class CaptureWriter():
+
+	def __init__(self,path,max_pending=67108864,flush_interval=0.1):
+		self.path			= path
+		self.max_pending	= max_pending
+		self.flush_interval	= flush_interval
+		self.key			= os.getpid() << 32
+		self.queue			= queue.SimpleQueue()
+		self.queued			= 0		# octets, only the event loop counts it
+		self.written		= 0		# octets, only the writer thread counts it
+		self.frames			= 0
+		self.dropped		= 0
+		self.gaps			= set()	# sessions with a GAP for their last dropped frame
+		self.fd				= None
+		self.thread			= None
+		self.stopping		= threading.Event()
+
+	def start(self):
+		self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+		self.frame(0, START, CAPTURE_MAGIC)
+		self.thread = threading.Thread(target=self.run, name="capture", daemon=True)
+		self.thread.start()
+		print("[*] Capturing Sessions To %s ... Done" % (self.path))
+
+	# Call from the event loop thread
+	def frame(self,session_id,kind,data=b""):
+		if self.fd is None:
+			self.dropped += 1
+			return
+		size = FRAME_HEADER.size + len(data)
+		if self.queued - self.written + size > self.max_pending:
+			self.dropped += 1
+			if session_id not in self.gaps:
+				self.put(session_id, GAP, b"")
+				self.gaps.add(session_id)
+			if kind == CLOSE:
+				self.gaps.discard(session_id)
+			return
+		if self.gaps:
+			self.gaps.discard(session_id)
+		self.put(session_id, kind, data)
+
+	def put(self,session_id,kind,data):
+		self.queue.put((FRAME_HEADER.pack(time.time(), self.key | session_id, kind, len(data)),
+						data))
+		self.queued += FRAME_HEADER.size + len(data)
+		self.frames += 1
+
+	def run(self):
+		while not self.stopping.wait(self.flush_interval):
+			self.flush()
+		self.flush()
+
+	def flush(self):
+		batch = []
+		try:
+			while True:
+				batch.extend(self.queue.get_nowait())
+		except queue.Empty:
+			pass
+		if not batch:
+			return
+		data = b"".join(batch)
+		try:
+			view = memoryview(data)
+			while view:
+				view = view[os.write(self.fd, view):]
+		except OSError as e:
+			print("[*] Unable To Write Capture: %s" % (e))
+		self.written += len(data)
+
+	def close(self):
+		if self.thread:
+			self.stopping.set()
+			self.thread.join()
+			self.thread = None
+		if self.fd is not None:
+			os.close(self.fd)
+			self.fd = None
+			print("[*] Capture Closed: %d Frames, %d Dropped" % (self.frames, self.dropped))
+
+
+# Reads a log through mmap: the payloads are slices of the mapping, the file
+# is not read into memory
+class CaptureLog():
+
+	def __init__(self,path):
+		self.file	= open(path, "rb")
+		self.map	= mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+	def close(self):
+		self.map.close()
+		self.file.close()
+
+	# (time, session, kind, offset of the payload, length), in file order.
+	# A frame cut off at the end (capture still running) is skipped.
+	def frames(self):
+		data, size = self.map, len(self.map)
+		offset = 0
+		while offset + FRAME_HEADER.size <= size:
+			t, session, kind, length = FRAME_HEADER.unpack_from(data, offset)
+			offset += FRAME_HEADER.size
+			if offset + length > size:
+				break
+			yield t, session, kind, offset, length
+			offset += length
+
+	def payload(self,offset,length):
+		return self.map[offset:offset + length]
+
+	# session -> [(time, kind, offset, length)], for sessions with an OPEN
+	# frame, in the order they were opened. With a GAP frame: incomplete.
+	def sessions(self):
+		sessions = {}
+		for t, session, kind, offset, length in self.frames():
+			if kind == OPEN:
+				sessions[session] = [(t, kind, offset, length)]
+			elif kind != START and session in sessions:
+				sessions[session].append((t, kind, offset, length))
+		return sessions
@@ -10,7 +10,6 @@
 # License:  See LICENSE for licensing information
 #_____________________________________________________________________________
 
-# TODO: configfile/argparsing
 # TODO: logging
 # TODO: bufferhandling is very bad! A lot of bugs! Values have NO fixed size!
 # TODO: connections run in troubles if data > buffer_size
@@ -22,47 +21,72 @@
 # specification, see section: Addressing
 
 
+import argparse
 import socket
 import string
 import sys
 
 from socks5 import *
+from config import parse_addr
 
 Socks5_Protocol = Protocol()
 
 # **********
-# Config
+# Config: defaults, see ./client.py --help
 # **********
 proxy_host	= "127.0.0.1"
 proxy_port	= 1080
 proxy_addr	= (proxy_host, proxy_port)
 
 target_host	= "127.0.0.1"
-target_port	= 8888				# TODO: CAUSED BY BUG, THIS IS TEMPORARY HARDCODED in socks5.py!!!!!
+target_port	= 8888
 target_addr	= (target_host,target_port)
 
+timeout		= 10				# seconds, for connecting and each recv/send
+
 # SOCKS5 - Hallo
 VER 				= Socks5_Protocol.VER
-NMETHODS 			= b'\x01'	# TODO: Further methods hast still to be written
-METHODS				= Socks5_Protocol.METHOD_NOAUTH
+NMETHODS 			= b'\x02'
+METHODS				= Socks5_Protocol.METHOD_NOAUTH + Socks5_Protocol.METHOD_USERNAME
+
+# Username/Password authentication (rfc1929), used if selected by the proxy
+username			= b"user"
+password			= b"password"
 
 # SOCKS5 - Connecting
 CMD					= Socks5_Protocol.CMD_CONNECT
 RSV					= Socks5_Protocol.RSV
-ATYP				= Socks5_Protocol.ATYP_IPV4
 
 # Message for Target Server
 msg = "Hallo"
 # **********
 
-def main():
+def parse_args(argv):
+	parser = argparse.ArgumentParser(description="A very simple SOCKS5 (RFC 1928) client")
+	parser.add_argument("--proxy", default="%s:%d" % proxy_addr, metavar="HOST:PORT")
+	parser.add_argument("--target", default="%s:%d" % target_addr, metavar="HOST:PORT")
+	parser.add_argument("--timeout", type=float, default=timeout)
+	parser.add_argument("--username", default=username.decode())
+	parser.add_argument("--password", default=password.decode())
+	parser.add_argument("--msg", default=msg, help="message for the target server")
+	return parser.parse_args(argv)
+
+def main(argv=None):
+	args = parse_args(argv)
+	proxy_family, proxy_addr	= parse_addr(args.proxy)
+	target_family, target_addr	= parse_addr(args.target)
+	target_host, target_port	= target_addr
+	timeout						= args.timeout
+	username, password			= args.username.encode(), args.password.encode()
+	msg							= args.msg
+
 	print("[*] Starting Client ...")
 	
 	# *****
 	# SOCKS5
 	# *****
 	Socks5_Client = Client()	
-	Socks5_Client.init_socketToProxy(socket.AF_INET, socket.SOCK_STREAM, proxy_addr)
+	Socks5_Client.init_socketToProxy(proxy_family, socket.SOCK_STREAM, proxy_addr,timeout)
 
 	try:
 		print("[*] Start Initialization of SOCKS5 Connection")
@@ -78,24 +102,24 @@ def main():
 		# VER+METHOD
 		#s = 2
 		Socks5_Client.hallo_recv()
+
+		if Socks5_Client.method == Socks5_Protocol.METHOD_USERNAME:
+			# Step 2a: Send Username/Password
+			# VER+ULEN+UNAME+PLEN+PASSWD
+			Socks5_Client.auth_send(username,password)
+
+			# Step 2b: Receive status from Proxy Server
+			# VER+STATUS
+			Socks5_Client.auth_recv()
 		
 		print("[*] *** Connecting ***")	
 		# Step 3: Send request details
 		# VER+CMD+RSV+ATYP+DST.ADDR+DST.PORT
 		#s = 3
-		# TODO: Depending of atyp, generating of valid (DST_ADDR,DST_PORT)
-		# format
-		DST_ADDR			= socket.inet_aton(target_host)
-				
-		str_target_port = str(target_port)
-		lstr_target_port = len(str_target_port)
-				
-		DST_PORT = b''
-		for val in range(0,len(str_target_port)):
-			tmp = str_target_port[val]
-			erg = bytes([int(tmp)])
-			DST_PORT = DST_PORT + erg
-			
+		# IPv4, IPv6 or a domain name, resolved by the proxy
+		ATYP, DST_ADDR		= pack_host(target_host)
+		DST_PORT			= target_port
+
 		Socks5_Client.connect_send(VER,CMD,RSV,ATYP,DST_ADDR,DST_PORT)
 				
 		# Step 4: Receive request details from proxy
@@ -134,7 +158,7 @@ def main():
 		sys.exit(2)	# Error number?
 	finally:
 		# Close socket 
-		Socks5Client.sockToProxy.close()
+		Socks5_Client.sockToProxy.close()
 
 
 if __name__=='__main__':
@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+
+#_____________________________________________________________________________
+#
+# Configuration of the SOCKS5 proxy: config file, command line, routing table
+#
+# Author:   Samdney  <contact@carolin-zoebelein.de>
+# D4A7 35E8 D47F 801F 2CF6 2BA7 927A FD3C DE47 E13B
+# License:  See LICENSE for licensing information
+#_____________________________________________________________________________
+
+"""
+***Configuration***
+
+Sources, each one overrides the one before:
+	1. Defaults (SETTINGS, ROUTE_SETTINGS below)
+	2. Config file (INI, see proxy.conf for all keys)
+	3. Command line (see ./proxy.py --help)
+
+=> Everything is parsed ONCE, at start (and on SIGHUP), into immutable
+	objects: Settings and a RoutingTable. Sessions only do lookups.
+
+---
+Routes
+---
+Settings which depend on the destination of a CONNECT live in route sections:
+
+	[route default]			used if no other route matches
+	filter		= 1
+	chunk_size	= 1024
+
+	[route 10.0.0.0/8]		destination network
+	ports		= 80, 443	optional, else all ports
+	filter		= 0
+	upstream	= 0			direct, not through mux peer or parents (see
+							mux.py, upstream.py)
+	relay		= http		filter only the bodies of HTTP responses (see
+							httprelay.py)
+	weight		= 8			bandwidth share, rate, session_rate: limits
+							(see shaper.py)
+
+=> Every route is completed with the values of [route default] at load time.
+=> Lookup: Longest prefix match, on the same prefix a route with ports wins
+	over one without.
+	The table keeps one dict per prefix length in use, so a lookup is one
+	shift and one dict lookup per prefix length, longest first.
+"""
+
+import argparse
+import collections
+import configparser
+import ipaddress
+import socket
+
+from sockopts import SOCKET_OPTIONS, PROFILES
+from httprelay import RELAY_MODES
+
+# field, section, key, type, default
+SETTINGS = [
+	("listen",				"proxy",		"listen",		"addrs",	"127.0.0.1:1080"),
+	("backlog",				"proxy",		"backlog",		int,		128),
+	("workers",				"proxy",		"workers",		int,		1),
+	("handoff_path",		"proxy",		"handoff_path",	"str?",		None),
+	("drain_timeout",		"proxy",		"drain_timeout",float,		60),
+	("socket_profile",		"proxy",		"socket_profile", str,		"interactive"),
+	("auth_file",			"auth",			"file",			"str?",		None),
+	("auth_cache_ttl",		"auth",			"cache_ttl",	float,		30),
+	("conn_rate",			"admission",	"conn_rate",	"float?",	50),
+	("conn_burst",			"admission",	"conn_burst",	int,		100),
+	("max_sessions",		"admission",	"max_sessions",	"int?",		256),
+	("source_prefix_v4",	"admission",	"prefix_v4",	int,		32),
+	("source_prefix_v6",	"admission",	"prefix_v6",	int,		64),
+	("admission_reject",	"admission",	"reject",		str,		"reply"),
+	("handshake_timeout",	"timeouts",		"handshake",	float,		10),
+	("connect_timeout",		"timeouts",		"connect",		float,		10),
+	("idle_timeout",		"timeouts",		"idle",			float,		300),
+	("timer_tick",			"timeouts",		"tick",			float,		0.25),
+	("negative_ttl",		"timeouts",		"negative",		float,		5),
+	("negative_max",		"timeouts",		"negative_max",	int,		10000),
+	("upstream_parents",	"upstream",		"parents",		"addrs",	""),
+	("upstream_policy",		"upstream",		"policy",		str,		"least_inflight"),
+	("upstream_username",	"upstream",		"username",		"str?",		None),
+	("upstream_password",	"upstream",		"password",		"str?",		None),
+	("upstream_check_interval", "upstream",	"check_interval", float,	5),
+	("upstream_check_timeout", "upstream",	"check_timeout", float,		2),
+	("upstream_max_latency", "upstream",	"max_latency",	float,		1.0),
+	("upstream_max_fails",	"upstream",		"max_fails",	int,		3),
+	("upstream_ewma_alpha",	"upstream",		"ewma_alpha",	float,		0.3),
+	("mux_listen",			"mux",			"listen",		"addrs",	""),
+	("mux_allow",			"mux",			"allow",		"nets",		"127.0.0.0/8, ::1/128"),
+	("mux_peer",			"mux",			"peer",			"addr?",	None),
+	("mux_window",			"mux",			"window",		int,		262144),
+	("mux_frame_size",		"mux",			"frame_size",	int,		16384),
+	("profile_dir",			"profile",		"dir",			str,		"/tmp"),
+	("profile_duration",	"profile",		"duration",		float,		10),
+	("profile_mode",		"profile",		"mode",			str,		"sample"),
+	("profile_interval",	"profile",		"interval",		float,		0.005),
+	("profile_tracemalloc",	"profile",		"tracemalloc",	int,		1),
+	("profile_top",			"profile",		"top",			int,		25),
+	("capture_file",		"capture",		"file",			"str?",		None),
+	("capture_max_pending",	"capture",		"max_pending",	int,		67108864),
+	("capture_flush_interval", "capture",	"flush_interval", float,	0.1),
+	("shaping_rate",		"shaping",		"rate",			"int?",		None),
+	("shaping_burst",		"shaping",		"burst",		int,		65536),
+]
+
+# field, key, type, default
+ROUTE_SETTINGS = [
+	("filter_switch",		"filter",		int,		1),
+	("chunk_size",			"chunk_size",	int,		1024),
+	("rcvbuf",				"rcvbuf",		int,		0),		# 0: system default
+	("sndbuf",				"sndbuf",		int,		0),
+	("upstream",			"upstream",		int,		1),		# 0: always direct
+	("socket_profile",		"socket_profile", str,		"interactive"),
+	("relay",				"relay",		str,		"raw"),		# raw, http (see httprelay.py)
+	("http_max_body",		"http_max_body", int,		1048576),
+	("rate",				"rate",			"int?",		None),	# octets/sec (see shaper.py)
+	("session_rate",		"session_rate",	"int?",		None),
+	("weight",				"weight",		int,		1),
+]
+
+Settings	= collections.namedtuple("Settings", [s[0] for s in SETTINGS])
+Route		= collections.namedtuple("Route", ["name"] + [s[0] for s in ROUTE_SETTINGS])
+
+class ConfigError(Exception):
+	pass
+
+# "host:port" or "[v6host]:port" -> (family, (host, port))
+def parse_addr(text):
+	host, sep, port = text.strip().rpartition(":")
+	if not sep:
+		raise ConfigError("address without port: %s" % text)
+	if host.startswith("["):
+		return (socket.AF_INET6, (host[1:-1], int(port)))
+	return (socket.AF_INET, (host, int(port)))
+
+def parse_value(kind,text):
+	text = text.strip()
+	if isinstance(kind, str) and kind.endswith("?"):
+		if text == "" or text.lower() == "none":
+			return None
+		kind = kind[:-1]
+	if kind == "addrs":
+		return tuple(parse_addr(a) for a in text.split(",") if a.strip())
+	if kind == "addr":
+		return parse_addr(text)
+	if kind == "nets":
+		return tuple(ipaddress.ip_network(n.strip(), strict=False)
+					for n in text.split(",") if n.strip())
+	if kind in ("str", str):
+		return text
+	if kind in ("int", int):
+		return int(text)
+	if kind in ("float", float):
+		return float(text)
+	raise ConfigError("unknown type: %s" % kind)
+
+def parse_default(kind,value):
+	if kind in ("addrs", "nets"):
+		return parse_value(kind, value)
+	return value
+
+
+class RoutingTable():
+
+	def __init__(self,default,routes):
+		# routes: [(ipaddress network, ports or None, Route)]
+		self.default	= default
+		self.tables		= {4: {}, 6: {}}	# version -> {prefixlen: {network: entry}}
+		self.by_name	= {default.name: default}
+		for network, ports, route in routes:
+			self.by_name[route.name] = route
+			table = self.tables[network.version].setdefault(network.prefixlen, {})
+			key = int(network.network_address) >> (network.max_prefixlen - network.prefixlen)
+			# entry: [route for all ports, {port: route}]
+			entry = table.setdefault(key, [None, {}])
+			if ports:
+				for port in ports:
+					entry[1][port] = route
+			else:
+				entry[0] = route
+
+		# Precomputed: (shift, table) for each prefix length, longest first
+		self.lookups = {}
+		for version, bits in ((4, 32), (6, 128)):
+			tables = self.tables[version]
+			self.lookups[bits // 8] = tuple((bits - plen, tables[plen])
+											for plen in sorted(tables, reverse=True))
+
+	# packed: destination address as in the SOCKS5 request (4 or 16 octets)
+	def lookup(self,packed,port):
+		addr = int.from_bytes(packed, "big")
+		for shift, table in self.lookups.get(len(packed), ()):
+			entry = table.get(addr >> shift)
+			if entry is not None:
+				route = entry[1].get(port) or entry[0]
+				if route is not None:
+					return route
+		return self.default
+
+
+def argument_parser(description):
+	parser = argparse.ArgumentParser(description=description)
+	parser.add_argument("-c", "--config", help="config file (INI), see proxy.conf")
+	parser.add_argument("--listen", action="append", metavar="HOST:PORT",
+						help="listen address, [v6host]:port for IPv6, repeatable")
+	parser.add_argument("--backlog", type=int)
+	parser.add_argument("--workers", type=int, help="worker processes")
+	parser.add_argument("--handoff-path", help="UNIX socket for listener handoff, "
+						"'none' to disable")
+	parser.add_argument("--auth-file", help="password file, see socks5auth.py")
+	parser.add_argument("--parent", action="append", metavar="HOST:PORT",
+						help="upstream parent SOCKS5 server, repeatable")
+	parser.add_argument("--capture", metavar="FILE",
+						help="append all sessions to a capture log, see capture.py")
+	parser.add_argument("--filter", type=int, dest="filter_switch",
+						help="default route: 0 off, 1 simple_switch, 2 lingu_switch")
+	parser.add_argument("--chunk-size", type=int, help="default route: relay chunk size")
+	parser.add_argument("--rcvbuf", type=int, help="default route: SO_RCVBUF, 0 system default")
+	parser.add_argument("--sndbuf", type=int, help="default route: SO_SNDBUF, 0 system default")
+	parser.add_argument("--set", action="append", default=[], metavar="SECTION.KEY=VALUE",
+						help="override any key of the config file, repeatable")
+	return parser
+
+def load_config(args):
+	parser = configparser.ConfigParser(interpolation=None)
+	if args.config:
+		if not parser.read(args.config):
+			raise ConfigError("unable to read config file: %s" % args.config)
+
+	# Command line overrides
+	overrides = [
+		("listen",			"proxy",	"listen",		",".join(args.listen or []) or None),
+		("backlog",			"proxy",	"backlog",		args.backlog),
+		("workers",			"proxy",	"workers",		args.workers),
+		("handoff_path",	"proxy",	"handoff_path",	args.handoff_path),
+		("auth_file",		"auth",		"file",			args.auth_file),
+		("upstream_parents", "upstream", "parents",		",".join(args.parent or []) or None),
+		("capture_file",	"capture",	"file",			args.capture),
+		("filter_switch",	"route default",	"filter",		args.filter_switch),
+		("chunk_size",		"route default",	"chunk_size",	args.chunk_size),
+		("rcvbuf",			"route default",	"rcvbuf",		args.rcvbuf),
+		("sndbuf",			"route default",	"sndbuf",		args.sndbuf),
+	]
+	for item in args.set:
+		name, sep, value = item.partition("=")
+		section, sep2, key = name.rpartition(".")
+		if not sep or not sep2:
+			raise ConfigError("invalid --set: %s" % item)
+		overrides.append((None, section, key, value))
+	for field, section, key, value in overrides:
+		if value is not None:
+			if not parser.has_section(section):
+				parser.add_section(section)
+			parser.set(section, key, str(value))
+
+	# Typos in the config file should not pass silently
+	known = {}
+	for field, section, key, kind, default in SETTINGS:
+		known.setdefault(section, set()).add(key)
+	route_keys = set(s[1] for s in ROUTE_SETTINGS)
+	for section in parser.sections():
+		if section.startswith("route "):
+			keys = route_keys | set(["ports"])
+		elif section.startswith("socket "):
+			keys = set(o[0] for o in SOCKET_OPTIONS)
+		else:
+			keys = known.get(section)
+			if keys is None:
+				raise ConfigError("unknown section: [%s]" % section)
+		for key in parser.options(section):
+			if key not in keys:
+				raise ConfigError("unknown key in [%s]: %s" % (section, key))
+
+	try:
+		values = {}
+		for field, section, key, kind, default in SETTINGS:
+			if parser.has_option(section, key):
+				values[field] = parse_value(kind, parser.get(section, key))
+			else:
+				values[field] = parse_default(kind, default)
+		settings = Settings(**values)
+		if settings.upstream_policy not in ("least_inflight", "ewma"):
+			raise ConfigError("unknown upstream policy: %s" % settings.upstream_policy)
+		if settings.upstream_username is not None and not settings.upstream_password:
+			raise ConfigError("upstream username without password")
+		if settings.admission_reject not in ("reply", "close"):
+			raise ConfigError("unknown admission reject: %s" % settings.admission_reject)
+		if not 0 <= settings.source_prefix_v4 <= 32:
+			raise ConfigError("admission prefix_v4 out of range: %d" % settings.source_prefix_v4)
+		if not 0 <= settings.source_prefix_v6 <= 128:
+			raise ConfigError("admission prefix_v6 out of range: %d" % settings.source_prefix_v6)
+		if settings.profile_mode not in ("sample", "cprofile"):
+			raise ConfigError("unknown profile mode: %s" % settings.profile_mode)
+		if not 0 < settings.mux_frame_size <= 65535:
+			raise ConfigError("mux frame_size out of range: %d" % settings.mux_frame_size)
+
+		# Socket profiles: the built-in ones, changed or added by
+		# [socket NAME] sections
+		profiles = dict(PROFILES)
+		for section in parser.sections():
+			if not section.startswith("socket "):
+				continue
+			name = section[7:].strip()
+			profile = profiles.get(name, PROFILES["default"])._replace(name=name)
+			for field, kind, default in SOCKET_OPTIONS:
+				if parser.has_option(section, field):
+					profile = profile._replace(**{field: parse_value(kind,
+												parser.get(section, field))})
+			profiles[name] = profile
+
+		def find_profile(name):
+			if name not in profiles:
+				raise ConfigError("unknown socket profile: %s" % name)
+			return profiles[name]
+		settings = settings._replace(socket_profile=find_profile(settings.socket_profile))
+		# Silent connections wait in the kernel, out of reach of the timeout
+		if settings.socket_profile.defer_accept > settings.handshake_timeout:
+			raise ConfigError("defer_accept of socket profile %s longer than the handshake "
+							"timeout" % settings.socket_profile.name)
+
+		def read_route(section,base):
+			values = {"name": section[6:].strip()}
+			for field, key, kind, default in ROUTE_SETTINGS:
+				if parser.has_option(section, key):
+					values[field] = parse_value(kind, parser.get(section, key))
+				else:
+					values[field] = getattr(base, field)
+			if values["relay"] not in RELAY_MODES:
+				raise ConfigError("unknown relay mode in [%s]: %s" % (section, values["relay"]))
+			if values["weight"] < 1:
+				raise ConfigError("weight in [%s] must be at least 1" % (section))
+			return Route(**values)
+
+		default = Route("default", *[s[3] for s in ROUTE_SETTINGS])
+		if parser.has_section("route default"):
+			default = read_route("route default", default)
+
+		routes = []
+		for section in parser.sections():
+			if not section.startswith("route ") or section == "route default":
+				continue
+			network = ipaddress.ip_network(section[6:].strip(), strict=False)
+			ports = None
+			if parser.has_option(section, "ports"):
+				ports = tuple(int(p) for p in parser.get(section, "ports").split(","))
+			routes.append((network, ports, read_route(section, default)))
+
+		# The profile of a route, with its rcvbuf/sndbuf (if not 0)
+		def resolve_profile(route):
+			profile = find_profile(route.socket_profile)
+			profile = profile._replace(rcvbuf=route.rcvbuf or profile.rcvbuf,
+										sndbuf=route.sndbuf or profile.sndbuf)
+			return route._replace(socket_profile=profile)
+		default = resolve_profile(default)
+		routes = [(network, ports, resolve_profile(route)) for network, ports, route in routes]
+	except ValueError as e:
+		raise ConfigError(str(e))
+
+	return settings, RoutingTable(default, routes)
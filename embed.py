@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+#_____________________________________________________________________________
+#
+# The SOCKS5 proxy inside another program: tests, sidecars
+#
+# Author:   Samdney  <contact@carolin-zoebelein.de>
+# D4A7 35E8 D47F 801F 2CF6 2BA7 927A FD3C DE47 E13B
+# License:  See LICENSE for licensing information
+#_____________________________________________________________________________
+
+"""
+***Embedded proxy***
+
+	from embed import start_server
+
+	proxy = start_server({"route default.filter": 0})
+	... connect to ("127.0.0.1", proxy.port) ...
+	proxy.stats()		{"sessions": 0, "sessions_done": 1, ...}
+	proxy.start_profiling()	a profiling window, like SIGUSR1 (see profiling.py)
+	proxy.close()
+
+=> config: keys of the config file as "section.key" -> value (like
+	./proxy.py --set). config_file: a config file (INI, see proxy.conf),
+	config overrides it.
+=> Differences to ./proxy.py:
+		[proxy] listen			127.0.0.1:0, a port chosen by the kernel
+								(without config_file)
+		[proxy] handoff_path	none, always
+		[proxy] workers			1, the only one possible
+	Everything else has the defaults of proxy.conf.
+=> Every handle is one ProxyServer, with its own event loop in its own
+	thread. No signals (only the main thread has them), no sys.exit: errors
+	are raised by start_server(). Many instances in one process are
+	independent of each other.
+=> Fast to start: the listeners are bound before start_server() returns,
+	the proxyfilter module is loaded by the first session with a filter.
+"""
+
+import asyncio
+import threading
+
+from config import *
+from proxy import ProxyServer, open_listeners
+
+EMBED_LISTEN	= "127.0.0.1:0"
+
+# The command line parser, built once: most of the time of a start otherwise
+_parser = None
+
+class ProxyHandle():
+
+	def __init__(self,server):
+		self.server		= server
+		self.thread		= None
+		self.loop		= None
+		self.error		= None
+		self.started	= threading.Event()
+		# All listening addresses, with the ports chosen by the kernel
+		self.addresses	= [listener.sockToClient.getsockname()
+							for listener in server.listeners]
+		self.port		= self.addresses[0][1]
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self,*exc):
+		self.close()
+
+	# Call from any thread but the one of the server
+	def stats(self):
+		async def stats():
+			return self.server.stats()
+		return asyncio.run_coroutine_threadsafe(stats(), self.loop).result()
+
+	# Call from any thread but the one of the server. The window runs off the
+	# main thread: sampled by a thread (see profiling.py)
+	def start_profiling(self):
+		self.loop.call_soon_threadsafe(self.server.start_profiling)
+
+	# Stops accepting, waits for the running sessions (at most [proxy]
+	# drain_timeout seconds)
+	def close(self):
+		if self.thread.is_alive():
+			self.loop.call_soon_threadsafe(self.server.stop)
+			self.thread.join()
+
+def start_server(config=None,config_file=None):
+	argv = ["--handoff-path", "none"]
+	if config_file:
+		argv += ["--config", config_file]
+	else:
+		argv += ["--listen", EMBED_LISTEN]
+	for key, value in (config or {}).items():
+		argv += ["--set", "%s=%s" % (key, "none" if value is None else value)]
+	global _parser
+	if _parser is None:
+		_parser = argument_parser("embedded proxy")
+	args = _parser.parse_args(argv)
+	settings, routes = load_config(args)
+	if settings.workers != 1:
+		raise ConfigError("an embedded proxy has one worker only")
+
+	listeners, mux_listeners, handoff = open_listeners(settings)
+	server = ProxyServer(args,settings,routes,listeners,mux_listeners,handoff=False)
+	handle = ProxyHandle(server)
+	handle.thread = threading.Thread(target=run_server, args=(handle,), name="proxy",
+									daemon=True)
+	handle.thread.start()
+	handle.started.wait()
+	if handle.error:
+		handle.thread.join()
+		raise handle.error
+	return handle
+
+# The thread of a handle
+def run_server(handle):
+	async def serve():
+		handle.loop = asyncio.get_running_loop()
+		await handle.server.run(started=handle.started.set)
+	try:
+		asyncio.run(serve())
+	except Exception as e:
+		handle.error = e
+		for listener in handle.server.listeners + handle.server.mux_listeners:
+			listener.sockToClient.close()
+	finally:
+		handle.started.set()
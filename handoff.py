@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+#_____________________________________________________________________________
+#
+# Handoff of the listening socket between two proxy processes
+#
+# Author:   Samdney  <contact@carolin-zoebelein.de>
+# D4A7 35E8 D47F 801F 2CF6 2BA7 927A FD3C DE47 E13B
+# License:  See LICENSE for licensing information
+#_____________________________________________________________________________
+
+"""
+***Listener handoff for zero-downtime restarts***
+
+=> Opt-in: a proxy with handoff_path listens on a UNIX control socket there.
+=> The socket lives in a private directory: owned by the user of the proxy,
+	no access for group and others (created with mode 0700 if missing). The
+	socket itself is 0600. Both ends check the peer with SO_PEERCRED, only
+	a process of the same user gets or hands over listening sockets.
+=> A new proxy process first connects to it:
+	1. New to old:	HANDOFF_REQUEST
+	2. Old to new:	HANDOFF_LISTENER, with the fds of all listening sockets
+					attached as SCM_RIGHTS ancillary data
+	3. New to old:	HANDOFF_ADOPTED, if the addresses of the sockets are
+					exactly the listen addresses of the new process, else
+					HANDOFF_DECLINED (it closes the fds and binds itself)
+=> The kernel keeps ONE listen queue for both fds of a socket. Connections
+	arriving during the restart wait in this queue until one of the processes
+	accepts them, none is refused.
+=> Only on HANDOFF_ADOPTED the old process stops accepting and drains its
+	sessions, the new process takes over the control socket path. Else it
+	keeps running and waits for the next request, and the new process runs
+	without handoff (the path stays with the old one).
+=> Nobody listens on handoff_path (no file, or a stale file of a crashed
+	process): the new process binds the listening socket itself.
+"""
+
+import asyncio
+import os
+import socket
+import stat
+import struct
+
+HANDOFF_REQUEST		= b"HANDOFF"
+HANDOFF_LISTENER	= b"LISTENER"
+HANDOFF_ADOPTED		= b"ADOPTED"
+HANDOFF_DECLINED	= b"DECLINED"
+MAX_LISTENERS		= 64
+
+class HandoffError(Exception):
+	pass
+
+# The directory of path: created if missing, must be private
+def check_directory(path):
+	directory = os.path.dirname(os.path.abspath(path))
+	os.makedirs(directory, mode=0o700, exist_ok=True)
+	st = os.stat(directory)
+	if st.st_uid != os.geteuid() or st.st_mode & (stat.S_IRWXG | stat.S_IRWXO):
+		raise HandoffError("handoff directory must be private (owner only): %s" % directory)
+
+# uid of the process at the other end of a UNIX socket
+def peer_uid(sock):
+	creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+	pid, uid, gid = struct.unpack("3i", creds)
+	return uid
+
+# addresses: the (family, address) of all listeners of the new process.
+# Returns (the sockets of the old process, all of them or none, True if the
+# path belongs to a running process which keeps it).
+def takeover_listeners(path,addresses,timeout=5):
+	check_directory(path)
+	try:
+		sockToOld = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		sockToOld.settimeout(timeout)
+		sockToOld.connect(path)
+	except OSError:
+		return [], False
+
+	try:
+		if peer_uid(sockToOld) != os.geteuid():
+			print("[*] Handoff Socket Of Another User, Ignored")
+			return [], True
+		sockToOld.sendall(HANDOFF_REQUEST)
+		msg, fds, flags, addr = socket.recv_fds(sockToOld, 1024, MAX_LISTENERS)
+		socks = [socket.socket(fileno=fd) for fd in fds]
+		if msg == HANDOFF_LISTENER and socks and (sorted((s.family, s.getsockname()[:2])
+				for s in socks) == sorted(addresses)):
+			sockToOld.sendall(HANDOFF_ADOPTED)
+			return socks, False
+		print("[*] Listen Addresses Differ From Running Proxy, No Handoff")
+		for sock in socks:
+			sock.close()
+		sockToOld.sendall(HANDOFF_DECLINED)
+		return [], True
+	except OSError:
+		return [], True
+	finally:
+		sockToOld.close()
+
+
+class HandoffServer():
+
+	def __init__(self,path):
+		self.path = path
+		self.sock = None
+
+	def listen(self):
+		check_directory(self.path)
+		try:
+			os.unlink(self.path)
+		except FileNotFoundError:
+			pass
+		sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		umask = os.umask(0o177)
+		try:
+			sock.bind(self.path)
+		finally:
+			os.umask(umask)
+		sock.listen(1)
+		sock.setblocking(False)
+		self.sock = sock
+
+	# Waits for a new process which adopts the listening sockets
+	async def handoff(self,listeners):
+		loop = asyncio.get_running_loop()
+		while True:
+			conn, addr = await loop.sock_accept(self.sock)
+			try:
+				if peer_uid(conn) != os.geteuid():
+					continue
+				msg = await asyncio.wait_for(loop.sock_recv(conn, 1024), 5)
+				if msg == HANDOFF_REQUEST:
+					# The message is tiny, it does not block
+					conn.setblocking(True)
+					socket.send_fds(conn, [HANDOFF_LISTENER],
+									[listener.fileno() for listener in listeners])
+					conn.setblocking(False)
+					reply = await asyncio.wait_for(loop.sock_recv(conn, 1024), 5)
+					if reply == HANDOFF_ADOPTED:
+						return
+			except (OSError, asyncio.TimeoutError):
+				pass
+			finally:
+				conn.close()
+
+	# unlink: False, if the path was already taken over by the new process
+	def close(self,unlink):
+		if self.sock:
+			self.sock.close()
+			self.sock = None
+			if unlink:
+				try:
+					os.unlink(self.path)
+				except FileNotFoundError:
+					pass
@@ -0,0 +1,460 @@
+#!/usr/bin/env python3
+
+#_____________________________________________________________________________
+#
+# HTTP/1.1 framing for the relay of the SOCKS5 proxy: the proxyfilter on
+# bodies only
+#
+# Author:   Samdney  <contact@carolin-zoebelein.de>
+# D4A7 35E8 D47F 801F 2CF6 2BA7 927A FD3C DE47 E13B
+# License:  See LICENSE for licensing information
+#_____________________________________________________________________________
+
+"""
+***HTTP relay***
+
+	[route default]
+	relay			= http		raw: every octet through the proxyfilter
+	http_max_body	= 1048576
+
+=> For HTTP/1.x through the tunnel, with a filter on the route (relay =
+	http with filter = 0 is relayed as raw). Both directions are parsed
+	incrementally, chunk by chunk of the relay, nothing waits for more than
+	it needs.
+=> Requests (client -> target): only scanned, relayed unchanged. The
+	method of each request is queued, a response belongs to the oldest one
+	(pipelining). Bodies (Content-Length, chunked) are skipped.
+=> Responses (target -> client): status line and headers pass unchanged as
+	views of the received octets (memoryview, sent with sendmsg), only a
+	Content-Length line is replaced. The proxyfilter gets the body:
+		Content-Length <= http_max_body
+				the body is filtered as a whole, Content-Length is replaced
+				by the new length
+		Content-Length > http_max_body
+				HTTP/1.1 (request and response): Content-Length is replaced
+				by Transfer-Encoding: chunked, every received piece is one
+				chunk. HTTP/1.0: not filtered
+		Transfer-Encoding: chunked
+				every chunk is filtered as a whole (pieces of http_max_body
+				at most) and sent with its new size. Chunk extensions are
+				dropped, trailers pass
+		neither	until the target closes, every received piece is filtered
+	Bodies in pieces: the octets after the last space of a piece wait for
+	the rest of the body (Content-Length) or chunk, a pronoun split between
+	two reads is still found.
+	No body: HEAD, 1xx, 204, 304.
+=> Not filtered, only framed: a Content-Encoding other than identity, a
+	Content-Type which is not text (text/*, *json*, *xml*, *javascript*,
+	none: text).
+=> Keep-alive: the connection to the target stays open, it carries any
+	number of filtered responses.
+=> CONNECT (2xx), Upgrade, 101 Switching Protocols: from then on raw
+	octets, unfiltered. Not HTTP (no HTTP/1.x status line, a head larger
+	than MAX_HEAD, an invalid chunk): the rest of the connection is relayed
+	as with relay = raw, the request side stops scanning.
+"""
+
+import collections
+
+HEAD_END		= b"\r\n\r\n"
+CRLF			= b"\r\n"
+LAST_CHUNK		= b"0\r\n"
+STATUS_PREFIX	= b"HTTP/1."
+MAX_HEAD		= 65536		# octets of start line and headers
+MAX_LINE		= 4096		# chunk size line, trailer line
+
+RELAY_MODES		= ("raw", "http")
+
+# State of a direction
+HEAD, LENGTH, BUFFERED, CHUNK_SIZE, CHUNK_DATA, CHUNK_END, TRAILER, UNTIL_CLOSE, TUNNEL = range(9)
+
+NO_BODY_STATUS	= (204, 304)
+TEXT_TYPES		= (b"json", b"xml", b"javascript")
+HEADERS			= frozenset((b"content-length", b"transfer-encoding", b"content-encoding",
+							b"content-type", b"upgrade"))
+
+class HttpError(Exception):
+	pass
+
+# The first line of the head data[start:end] (end: after CRLFCRLF), and the
+# headers of HEADERS: lower case name -> (value, offset of the line, offset
+# after its CRLF)
+def parse_head(data,start,end):
+	line_end = data.find(CRLF, start, end)
+	first = data[start:line_end]
+	headers = {}
+	pos = line_end + 2
+	while pos < end - 2:
+		line_end = data.find(CRLF, pos, end)
+		colon = data.find(b":", pos, line_end)
+		if colon < 0:
+			raise HttpError("invalid header line")
+		name = data[pos:colon].strip().lower()
+		if name in HEADERS:
+			headers[name] = (data[colon + 1:line_end].strip(), pos, line_end + 2)
+		pos = line_end + 2
+	return first, headers
+
+def parse_length(value):
+	try:
+		length = int(value)
+	except ValueError:
+		raise HttpError("invalid Content-Length")
+	if length < 0:
+		raise HttpError("invalid Content-Length")
+	return length
+
+# The size line of a chunk at data[pos:]: (size, offset after the line),
+# None: not complete
+def parse_chunk_size(data,pos):
+	end = data.find(CRLF, pos, pos + MAX_LINE)
+	if end < 0:
+		if len(data) - pos >= MAX_LINE:
+			raise HttpError("chunk size line too long")
+		return None
+	try:
+		size = int(data[pos:end].split(b";", 1)[0], 16)
+	except ValueError:
+		raise HttpError("invalid chunk size")
+	if size < 0:
+		raise HttpError("invalid chunk size")
+	return size, end + 2
+
+# Transfer-Encoding: the body is chunked if chunked is the last coding
+def is_chunked(value):
+	return value.lower().rsplit(b",", 1)[-1].strip() == b"chunked"
+
+def is_text(headers):
+	encoding = headers.get(b"content-encoding")
+	if encoding and encoding[0].lower() != b"identity":
+		return False
+	ctype = headers.get(b"content-type")
+	if not ctype:
+		return True
+	ctype = ctype[0].lower()
+	return ctype.startswith(b"text/") or any(t in ctype for t in TEXT_TYPES)
+
+
+# Client -> target: the methods of the requests, for HttpResponses
+class HttpRequests():
+	__slots__ = ("methods", "state", "remaining", "pending")
+
+	def __init__(self):
+		self.methods	= collections.deque()	# (method, HTTP/1.1) per request
+		self.state		= HEAD
+		self.remaining	= 0
+		self.pending	= b""		# an incomplete head or line
+
+	def feed(self,data):
+		if self.state == TUNNEL:
+			return
+		if self.pending:
+			data = self.pending + data
+			self.pending = b""
+		try:
+			self.scan(data)
+		except HttpError as e:
+			print("[*] HTTP Relay: Request Not Scanned Anymore: %s" % (e))
+			self.state = TUNNEL
+
+	def keep(self,data,pos,limit):
+		if len(data) - pos >= limit:
+			raise HttpError("head too long")
+		self.pending = data[pos:]
+
+	def scan(self,data):
+		pos, size = 0, len(data)
+		while pos < size:
+			state = self.state
+			if state == HEAD:
+				# Empty lines before a request are allowed (rfc7230 3.5)
+				if data.startswith(CRLF, pos):
+					pos += 2
+					continue
+				end = data.find(HEAD_END, pos)
+				if end < 0:
+					return self.keep(data, pos, MAX_HEAD)
+				end += 4
+				first, headers = parse_head(data, pos, end)
+				method, sep, rest = first.partition(b" ")
+				self.methods.append((method, rest.endswith(b"HTTP/1.1")))
+				pos = end
+				if method == b"CONNECT" or b"upgrade" in headers:
+					# Whatever follows is no HTTP of this connection
+					self.state = TUNNEL
+					return
+				if b"transfer-encoding" in headers:
+					self.state = CHUNK_SIZE
+				elif b"content-length" in headers:
+					self.remaining = parse_length(headers[b"content-length"][0])
+					if self.remaining:
+						self.state = LENGTH
+			elif state == LENGTH or state == CHUNK_DATA:
+				take = min(self.remaining, size - pos)
+				pos += take
+				self.remaining -= take
+				if not self.remaining:
+					self.state = HEAD if state == LENGTH else CHUNK_END
+			elif state == CHUNK_SIZE:
+				chunk = parse_chunk_size(data, pos)
+				if chunk is None:
+					return self.keep(data, pos, MAX_LINE)
+				self.remaining, pos = chunk
+				self.state = CHUNK_DATA if self.remaining else TRAILER
+			elif state == CHUNK_END:
+				if size - pos < 2:
+					return self.keep(data, pos, 2)
+				if not data.startswith(CRLF, pos):
+					raise HttpError("chunk without CRLF")
+				pos += 2
+				self.state = CHUNK_SIZE
+			elif state == TRAILER:
+				end = data.find(CRLF, pos, pos + MAX_LINE)
+				if end < 0:
+					return self.keep(data, pos, MAX_LINE)
+				if end == pos:
+					self.state = HEAD
+				pos = end + 2
+			else:
+				return
+
+
+# Target -> client: feed() returns the buffers to send to the client
+class HttpResponses():
+	__slots__ = ("requests", "filter", "max_body", "state", "remaining", "pending",
+				"filtering", "head", "length_line", "body", "body_size", "tail")
+
+	# requests: HttpRequests of the client, filter: octets -> octets
+	def __init__(self,requests,filter,max_body):
+		self.requests		= requests
+		self.filter			= filter
+		self.max_body		= max_body
+		self.state			= HEAD
+		self.remaining		= 0
+		self.pending		= b""
+		self.filtering		= False		# the body of this response
+		self.head			= None		# BUFFERED: the head, its Content-Length line
+		self.length_line	= None
+		self.body			= []
+		self.body_size		= 0
+		self.tail			= b""		# see filter_piece
+
+	def feed(self,data):
+		if self.pending:
+			data = self.pending + data
+			self.pending = b""
+		out = []
+		self.scan(data, memoryview(data), out)
+		return out
+
+	# The target closed: what is left, as it was received
+	def flush(self):
+		out = []
+		if self.head is not None:
+			out.append(self.head)
+			self.head = None
+		out.extend(self.body)
+		self.body = []
+		if self.tail:
+			out.append(self.tail)
+			self.tail = b""
+		if self.pending:
+			out.append(self.pending)
+			self.pending = b""
+		return out
+
+	def keep(self,data,pos,limit):
+		if len(data) - pos >= limit:
+			raise HttpError("head or line too long")
+		self.pending = data[pos:]
+
+	def send_chunk(self,data,out):
+		if data:
+			out += (b"%x\r\n" % len(data), data, CRLF)
+
+	def join_body(self):
+		data = b"".join(self.body)
+		self.body = []
+		self.body_size = 0
+		return data
+
+	# The proxyfilter on a body which is sent in pieces. more: more octets of
+	# the body (or chunk) follow for sure, then the octets from the last
+	# space on wait for them, a pronoun is never split. The space itself is
+	# filtered with both pieces, and cut from the first.
+	def filter_piece(self,data,more):
+		data = self.tail + data
+		if not more:
+			self.tail = b""
+			return self.filter(data)
+		cut = data.rfind(b" ")
+		if cut <= 0:
+			if len(data) < self.max_body:
+				self.tail = data
+				return b""
+			cut = len(data) - 1
+		self.tail = data[cut:]
+		return self.filter(data[:cut + 1])[:-1]
+
+
+	def scan(self,data,view,out):
+		pos, size = 0, len(data)
+		while pos < size:
+			state = self.state
+			try:
+				if state == HEAD:
+					# Not HTTP: known from the first octets, not after MAX_HEAD
+					if not STATUS_PREFIX.startswith(data[pos:pos + len(STATUS_PREFIX)]):
+						raise HttpError("no HTTP/1.x status line")
+					end = data.find(HEAD_END, pos)
+					if end < 0:
+						return self.keep(data, pos, MAX_HEAD)
+					end += 4
+					self.start(data, view, pos, end, out)
+					pos = end
+				elif state == BUFFERED:
+					take = min(self.remaining, size - pos)
+					self.body.append(view[pos:pos + take])
+					pos += take
+					self.remaining -= take
+					if not self.remaining:
+						head, (line_start, line_end) = self.head, self.length_line
+						self.head = None
+						body = self.filter(self.join_body())
+						out += (head[:line_start], b"Content-Length: %d\r\n" % len(body),
+								head[line_end:], body)
+						self.state = HEAD
+				elif state == LENGTH:
+					take = min(self.remaining, size - pos)
+					pos += take
+					self.remaining -= take
+					if self.filtering:
+						self.send_chunk(self.filter_piece(view[pos - take:pos],
+										self.remaining > 0), out)
+					else:
+						out.append(view[pos - take:pos])
+					if not self.remaining:
+						if self.filtering:
+							out += (LAST_CHUNK, CRLF)
+						self.state = HEAD
+				elif state == CHUNK_SIZE:
+					chunk = parse_chunk_size(data, pos)
+					if chunk is None:
+						return self.keep(data, pos, MAX_LINE)
+					self.remaining, end = chunk
+					if self.filtering:
+						if not self.remaining:
+							out.append(LAST_CHUNK)
+					else:
+						out.append(view[pos:end])
+					pos = end
+					self.state = CHUNK_DATA if self.remaining else TRAILER
+				elif state == CHUNK_DATA:
+					take = min(self.remaining, size - pos)
+					if self.filtering:
+						self.body.append(view[pos:pos + take])
+						self.body_size += take
+					else:
+						out.append(view[pos:pos + take])
+					pos += take
+					self.remaining -= take
+					if self.filtering and (not self.remaining or self.body_size >= self.max_body):
+						self.send_chunk(self.filter_piece(self.join_body(), self.remaining > 0), out)
+					if not self.remaining:
+						self.state = CHUNK_END
+				elif state == CHUNK_END:
+					if size - pos < 2:
+						return self.keep(data, pos, 2)
+					if not data.startswith(CRLF, pos):
+						raise HttpError("chunk without CRLF")
+					if not self.filtering:
+						out.append(CRLF)
+					pos += 2
+					self.state = CHUNK_SIZE
+				elif state == TRAILER:
+					end = data.find(CRLF, pos, pos + MAX_LINE)
+					if end < 0:
+						return self.keep(data, pos, MAX_LINE)
+					out.append(view[pos:end + 2])
+					if end == pos:
+						self.state = HEAD
+					pos = end + 2
+				elif state == UNTIL_CLOSE:
+					if self.filtering:
+						out.append(self.filter(bytes(view[pos:])))
+					else:
+						out.append(view[pos:])
+					pos = size
+				else:
+					out.append(view[pos:])
+					pos = size
+			except HttpError as e:
+				# From here on as relay = raw
+				print("[*] HTTP Relay: Not HTTP, Relayed As Raw: %s" % (e))
+				out.extend(self.flush())
+				self.requests.state = TUNNEL
+				self.state = UNTIL_CLOSE
+				self.filtering = True
+
+	# The head of a response, data[pos:end]
+	def start(self,data,view,pos,end,out):
+		first, headers = parse_head(data, pos, end)
+		try:
+			status = int(first[9:12])
+		except ValueError:
+			raise HttpError("invalid status line")
+		head = view[pos:end]
+		methods = self.requests.methods
+		method, http11 = methods.popleft() if methods else (b"GET", False)
+		self.state = HEAD
+		self.filtering = False
+		if status < 200:
+			out.append(head)
+			if status == 101:
+				self.state = TUNNEL
+			else:
+				# 100 Continue: the response follows
+				methods.appendleft((method, http11))
+			return
+		if method == b"HEAD" or status in NO_BODY_STATUS:
+			out.append(head)
+			return
+		if method == b"CONNECT" and status < 300:
+			out.append(head)
+			self.state = TUNNEL
+			return
+
+		self.filtering = self.filter is not None and is_text(headers)
+		encoding = headers.get(b"transfer-encoding")
+		length = headers.get(b"content-length")
+		if encoding:
+			if is_chunked(encoding[0]):
+				self.state = CHUNK_SIZE
+			else:
+				self.state = UNTIL_CLOSE
+				self.filtering = False
+			if encoding[0].lower().strip() != b"chunked":
+				# gzip, chunked: the chunks are no text
+				self.filtering = False
+			out.append(head)
+		elif length:
+			self.remaining = parse_length(length[0])
+			line = (length[1] - pos, length[2] - pos)
+			if not self.remaining:
+				out.append(head)
+			elif not self.filtering:
+				out.append(head)
+				self.state = LENGTH
+			elif self.remaining <= self.max_body:
+				self.head, self.length_line = head, line
+				self.state = BUFFERED
+			elif http11 and first.startswith(b"HTTP/1.1"):
+				out += (head[:line[0]], b"Transfer-Encoding: chunked\r\n", head[line[1]:])
+				self.state = LENGTH
+			else:
+				self.filtering = False
+				out.append(head)
+				self.state = LENGTH
+		else:
+			out.append(head)
+			self.state = UNTIL_CLOSE
@@ -0,0 +1,520 @@
+#!/usr/bin/env python3
+
+#_____________________________________________________________________________
+#
+# Multiplexed tunnel between proxy instances
+#
+# Author:   Samdney  <contact@carolin-zoebelein.de>
+# D4A7 35E8 D47F 801F 2CF6 2BA7 927A FD3C DE47 E13B
+# License:  See LICENSE for licensing information
+#_____________________________________________________________________________
+
+"""
+***Mux: many streams over one TCP connection***
+
+	client -> edge proxy ==(one TCP connection, many streams)==> core proxy -> target server
+
+=> The edge proxy does SOCKS5 with the clients as usual, but instead of a
+	socket to the target server it opens a stream on the mux connection to
+	the core proxy ([mux] peer). The core proxy ([mux] listen) connects to
+	the target server and relays between stream and target socket.
+	No TCP handshake per session between edge and core, one connection,
+	one reader and one writer for all sessions.
+=> The edge relay (and the proxyfilter) runs on the edge, the core only
+	connects and relays.
+
+---
+Frames
+---
+	TYPE (1) + STREAM (4) + LENGTH (2) + payload (LENGTH octets)
+
+	OPEN		edge -> core	payload: ATYP + DST.ADDR + DST.PORT as in the
+								request (see socks5codec.py), the core
+								resolves domain names
+	OPEN_OK		core -> edge	connected to the target server
+	OPEN_FAIL	core -> edge	not connected, the stream is gone. payload:
+								REP (1 octet, rfc1928), the edge answers
+								the client with it
+	DATA		both			payload: data, at most frame_size octets
+	WINDOW		both			payload: increment (4 octets), see below
+	FIN			both			no more DATA in this direction
+	RST			both			stream closed, discard everything
+
+=> Streams are opened by the edge only, with odd numbers.
+=> An edge which gives an OPEN up (connect timeout, drain) sends RST, the
+	core drops the connect or the target connection.
+=> A stream reset before its FIN is aborted, not ended: recv raises, the
+	edge closes its SOCKS client with RST.
+=> The core dials any target for its peers: only edge proxies from the
+	allowed networks ([mux] allow) may connect.
+=> DATA, FIN and RST of a stream are sent in order. OPEN, OPEN_OK, OPEN_FAIL
+	and WINDOW are sent before all DATA.
+
+---
+Flow control
+---
+=> Every stream may send at most `window` octets of DATA, which the other
+	side has not read yet. The reading side returns the window with WINDOW
+	frames, each time half of it is read.
+=> A slow client (or target server) only stops its own stream, the other
+	streams of the connection go on.
+
+---
+Fair scheduling
+---
+=> One writer per connection. Each round it sends all control frames, then
+	ONE frame of each stream with queued DATA, round robin, until
+	WRITE_BATCH octets are collected, which go out with a single send.
+	A bulk stream can not starve the others for more than one frame.
+"""
+
+import asyncio
+import collections
+import ipaddress
+import socket
+import struct
+
+from socks5 import *
+
+Socks5_Protocol = Protocol()
+
+OPEN_PREFIX		= Socks5_Protocol.VER + Socks5_Protocol.CMD_CONNECT + Socks5_Protocol.RSV
+
+FRAME_HEADER	= struct.Struct("!BIH")		# type, stream, length
+WINDOW_INC		= struct.Struct("!I")
+
+OPEN, OPEN_OK, OPEN_FAIL, DATA, WINDOW, FIN, RST = range(1, 8)
+
+WRITE_BATCH		= 65536		# octets per send of the writer
+READ_SIZE		= 262144	# octets per recv of the reader
+
+
+class MuxStream():
+
+	def __init__(self,mux,stream_id):
+		self.mux			= mux
+		self.id				= stream_id
+		self.inbox			= collections.deque()	# received DATA
+		self.offset			= 0						# read of inbox[0]
+		self.consumed		= 0						# read, not yet returned by WINDOW
+		self.eof			= False
+		self.reset			= False
+		self.readable		= None					# future of a waiting recv
+		self.send_window	= mux.window
+		self.writable		= None					# future of a waiting sendall
+		self.pending		= collections.deque()	# frames to send, in order
+		self.queued			= False					# in the writer's round robin
+		self.opened			= None					# edge: future, REP of the core
+		self.task			= None					# core: relay, cancelled on RST
+		self.closed			= False
+
+	# Like loop.sock_recv: at most n octets, b'' at the end of the stream
+	# (FIN). Reset by the peer (or the mux connection lost) before the end:
+	# Socks5Error, an aborted stream is no clean end.
+	async def recv(self,n):
+		while not self.inbox:
+			if self.eof:
+				return b''
+			if self.reset:
+				raise Socks5Error("mux stream reset")
+			self.readable = self.mux.loop.create_future()
+			try:
+				await self.readable
+			finally:
+				self.readable = None
+
+		data = self.inbox[0]
+		if self.offset or len(data) > n:
+			chunk = data[self.offset:self.offset + n]
+			self.offset += len(chunk)
+			if self.offset == len(data):
+				self.inbox.popleft()
+				self.offset = 0
+			data = chunk
+		else:
+			self.inbox.popleft()
+
+		self.consumed += len(data)
+		if self.consumed >= self.mux.window // 2 and not self.eof:
+			self.mux.send_control(WINDOW, self.id, WINDOW_INC.pack(self.consumed))
+			self.consumed = 0
+		return data
+
+	# Like loop.sock_sendall, waits for the window of the other side
+	async def sendall(self,data):
+		mux = self.mux
+		pos = 0
+		while pos < len(data):
+			if self.reset:
+				raise Socks5Error("mux stream reset")
+			if self.send_window <= 0:
+				self.writable = mux.loop.create_future()
+				try:
+					await self.writable
+				finally:
+					self.writable = None
+				continue
+			take = min(len(data) - pos, self.send_window, mux.frame_size)
+			self.send_window -= take
+			mux.send_frame(self, DATA, data[pos:pos + take])
+			pos += take
+
+	def shutdown_write(self):
+		if not self.reset and not self.closed:
+			self.mux.send_frame(self, FIN, b'')
+
+	def close(self):
+		if self.closed:
+			return
+		self.closed = True
+		if not self.reset:
+			self.mux.send_frame(self, RST, b'')
+		self.mux.streams.pop(self.id, None)
+
+	def wake(self):
+		if self.readable and not self.readable.done():
+			self.readable.set_result(None)
+		if self.writable and not self.writable.done():
+			self.writable.set_result(None)
+
+
+class MuxConnection():
+
+	# on_open(stream, payload): core side, called for every OPEN
+	def __init__(self,sock,window,frame_size,on_open=None):
+		self.sock			= sock
+		self.window			= window
+		self.frame_size		= frame_size
+		self.on_open		= on_open
+		self.loop			= None
+		self.streams		= {}
+		self.next_id		= 1
+		self.control		= collections.deque()	# frames before all DATA
+		self.ready			= collections.deque()	# streams with pending frames
+		self.wakeup			= None					# future of the idle writer
+		self.closed			= False
+
+	async def run(self):
+		self.loop = asyncio.get_running_loop()
+		tasks = [self.loop.create_task(self.reader()), self.loop.create_task(self.writer())]
+		try:
+			await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+		finally:
+			for task in tasks:
+				task.cancel()
+			await asyncio.gather(*tasks, return_exceptions=True)
+			self.close()
+
+	def close(self):
+		if self.closed:
+			return
+		self.closed = True
+		self.sock.close()
+		for stream in list(self.streams.values()):
+			self.reset_stream(stream)
+		self.streams.clear()
+
+	# Edge side
+	async def open_stream(self,payload):
+		stream = MuxStream(self, self.next_id)
+		self.next_id += 2
+		stream.opened = self.loop.create_future()
+		self.streams[stream.id] = stream
+		self.send_control(OPEN, stream.id, payload)
+		try:
+			rep = await stream.opened
+		except asyncio.CancelledError:
+			stream.close()
+			raise
+		if rep != Socks5_Protocol.REP_SUCCESSED:
+			stream.closed = True
+			self.streams.pop(stream.id, None)
+			raise ConnectError(rep, "mux peer unable to connect to target server")
+		return stream
+
+	# Core side. rep: REP of a failed connect
+	def open_reply(self,stream,ok,rep=b''):
+		self.send_control(OPEN_OK if ok else OPEN_FAIL, stream.id, b'' if ok else rep)
+		if not ok:
+			stream.closed = True
+			self.streams.pop(stream.id, None)
+
+	def send_control(self,type,stream_id,payload):
+		if self.closed:
+			return
+		self.control.append((FRAME_HEADER.pack(type, stream_id, len(payload)), payload))
+		self.wake_writer()
+
+	def send_frame(self,stream,type,payload):
+		if self.closed:
+			return
+		stream.pending.append((FRAME_HEADER.pack(type, stream.id, len(payload)), payload))
+		if not stream.queued:
+			stream.queued = True
+			self.ready.append(stream)
+		self.wake_writer()
+
+	def wake_writer(self):
+		if self.wakeup and not self.wakeup.done():
+			self.wakeup.set_result(None)
+
+	def reset_stream(self,stream):
+		stream.reset = True
+		stream.pending.clear()
+		if stream.opened and not stream.opened.done():
+			stream.opened.set_result(Socks5_Protocol.REP_SERVERFAIL)
+		stream.wake()
+		if stream.task:
+			stream.task.cancel()
+
+	async def writer(self):
+		loop, sock = self.loop, self.sock
+		control, ready = self.control, self.ready
+		while True:
+			if not control and not ready:
+				self.wakeup = loop.create_future()
+				await self.wakeup
+				self.wakeup = None
+
+			parts = []
+			size = 0
+			while control:
+				header, payload = control.popleft()
+				parts.append(header)
+				parts.append(payload)
+				size += len(payload)
+			# Round robin, one frame per stream and turn
+			while ready and size < WRITE_BATCH:
+				stream = ready.popleft()
+				if not stream.pending:
+					stream.queued = False
+					continue
+				header, payload = stream.pending.popleft()
+				parts.append(header)
+				parts.append(payload)
+				size += len(payload)
+				if stream.pending:
+					ready.append(stream)
+				else:
+					stream.queued = False
+			await loop.sock_sendall(sock, b''.join(parts))
+
+	async def reader(self):
+		loop, sock = self.loop, self.sock
+		header_size = FRAME_HEADER.size
+		buf = bytearray()
+		while True:
+			data = await loop.sock_recv(sock, READ_SIZE)
+			if not data:
+				return
+			buf += data
+			pos = 0
+			while len(buf) - pos >= header_size:
+				type, stream_id, length = FRAME_HEADER.unpack_from(buf, pos)
+				end = pos + header_size + length
+				if end > len(buf):
+					break
+				self.dispatch(type, stream_id, bytes(buf[pos + header_size:end]))
+				pos = end
+			del buf[:pos]
+
+	def dispatch(self,type,stream_id,payload):
+		stream = self.streams.get(stream_id)
+		if type == OPEN:
+			if self.on_open and stream is None:
+				stream = MuxStream(self, stream_id)
+				self.streams[stream_id] = stream
+				self.on_open(self, stream, payload)
+			return
+		if stream is None:
+			# Closed on our side, frames still on the way
+			return
+		if type == DATA:
+			stream.inbox.append(payload)
+			stream.wake()
+		elif type == WINDOW:
+			stream.send_window += WINDOW_INC.unpack(payload)[0]
+			stream.wake()
+		elif type == FIN:
+			stream.eof = True
+			stream.wake()
+		elif type == RST:
+			self.streams.pop(stream_id, None)
+			self.reset_stream(stream)
+		elif type in (OPEN_OK, OPEN_FAIL):
+			if stream.opened and not stream.opened.done():
+				if type == OPEN_OK:
+					stream.opened.set_result(Socks5_Protocol.REP_SUCCESSED)
+				else:
+					stream.opened.set_result(payload[:1] or Socks5_Protocol.REP_SERVERFAIL)
+
+
+# ATYP + DST.ADDR + DST.PORT of an OPEN: the request without VER+CMD+RSV
+def open_payload(atyp,packed,port):
+	return encode_request(Socks5_Protocol.CMD_CONNECT, atyp, packed, port)[3:]
+
+# Returns (family, (host, port)), family None: domain name
+def parse_open_payload(payload):
+	cmd, atyp, addr, port = decode_request(OPEN_PREFIX + payload)
+	if atyp == Socks5_Protocol.ATYP_IPV4:
+		return socket.AF_INET, (host_of(atyp, addr), port)
+	if atyp == Socks5_Protocol.ATYP_IPV6:
+		return socket.AF_INET6, (host_of(atyp, addr), port)
+	return None, (host_of(atyp, addr), port)
+
+
+# Edge side: one connection to the core proxy, opened on the first stream and
+# again after it is lost
+class MuxClient():
+
+	def __init__(self,peer,window=262144,frame_size=16384,connect_timeout=10):
+		self.family, self.addr	= peer
+		self.window				= window
+		self.frame_size			= frame_size
+		self.connect_timeout	= connect_timeout
+		self.mux				= None
+		self.task				= None
+		self.lock				= asyncio.Lock()
+
+	async def connection(self):
+		async with self.lock:
+			if self.mux is None or self.mux.closed:
+				loop = asyncio.get_running_loop()
+				sock = socket.socket(self.family, socket.SOCK_STREAM)
+				sock.setblocking(False)
+				sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+				try:
+					await asyncio.wait_for(loop.sock_connect(sock, self.addr),
+											self.connect_timeout)
+				except BaseException:
+					sock.close()
+					raise
+				print("[*] Mux Connection To %s:%d ... Done" % (self.addr[0], self.addr[1]))
+				self.mux = MuxConnection(sock, self.window, self.frame_size)
+				self.mux.loop = loop
+				self.task = loop.create_task(self.mux.run())
+			return self.mux
+
+	async def open(self,atyp,packed,port):
+		mux = await self.connection()
+		return await mux.open_stream(open_payload(atyp, packed, port))
+
+	def close(self):
+		if self.task:
+			self.task.cancel()
+			self.task = None
+
+
+# Core side: accepts mux connections, connects to the target servers
+class MuxServer():
+
+	# allow: networks (ipaddress) of the edge proxies which may connect
+	def __init__(self,listeners,sessions,window=262144,frame_size=16384,connect_timeout=10,
+				allow=()):
+		self.listeners			= listeners		# Proxy objects with sockToClient
+		self.sessions			= sessions		# relay tasks, drained with the sessions
+		self.allow				= allow
+		self.window				= window
+		self.frame_size			= frame_size
+		self.connect_timeout	= connect_timeout
+		self.connections		= set()
+
+	def start(self,loop):
+		for listener in self.listeners:
+			loop.add_reader(listener.sockToClient.fileno(), self.accept, listener)
+
+	def stop(self,loop):
+		for listener in self.listeners:
+			loop.remove_reader(listener.sockToClient.fileno())
+
+	def close(self):
+		for task in self.connections:
+			task.cancel()
+
+	def accept(self,listener):
+		loop = asyncio.get_running_loop()
+		try:
+			conn, addr = listener.sockToClient.accept()
+		except (BlockingIOError, InterruptedError):
+			return
+		except OSError as e:
+			print("[*] Unable To Accept Mux Connection: %s" % (e))
+			return
+		if not self.allowed(addr[0]):
+			print("[*] Mux Connection From %s:%d Refused: Not Allowed" % (addr[0], addr[1]))
+			conn.close()
+			return
+		print("[*] Mux Connection From %s:%d" % (addr[0], addr[1]))
+		conn.setblocking(False)
+		conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		mux = MuxConnection(conn, self.window, self.frame_size, on_open=self.on_open)
+		task = loop.create_task(mux.run())
+		self.connections.add(task)
+		task.add_done_callback(self.connections.discard)
+
+	def allowed(self,host):
+		ip = ipaddress.ip_address(host.split("%")[0])
+		if ip.version == 6 and ip.ipv4_mapped:
+			ip = ip.ipv4_mapped
+		return any(ip in network for network in self.allow)
+
+	def on_open(self,mux,stream,payload):
+		stream.task = mux.loop.create_task(self.relay(mux, stream, payload))
+		self.sessions.add(stream.task)
+		stream.task.add_done_callback(self.sessions.discard)
+
+	async def relay(self,mux,stream,payload):
+		loop = mux.loop
+		sockToTarget = None
+		try:
+			family, target_addr = parse_open_payload(payload)
+			if family is None:
+				try:
+					addrinfo = await loop.getaddrinfo(*target_addr, type=socket.SOCK_STREAM)
+				except socket.gaierror as e:
+					raise ConnectError(Socks5_Protocol.REP_HOSTUNREACH,
+										"unable to resolve %s" % (target_addr[0])) from e
+				family, socktype, proto, canonname, target_addr = addrinfo[0]
+			sockToTarget = socket.socket(family, socket.SOCK_STREAM)
+			sockToTarget.setblocking(False)
+			await asyncio.wait_for(loop.sock_connect(sockToTarget, target_addr),
+									self.connect_timeout)
+		except Exception as e:
+			mux.open_reply(stream, False, connect_error_rep(e))
+			if sockToTarget:
+				sockToTarget.close()
+			return
+		except asyncio.CancelledError:
+			# RST of the edge, or drain
+			if sockToTarget:
+				sockToTarget.close()
+			raise
+		mux.open_reply(stream, True)
+
+		async def to_target():
+			while True:
+				data = await stream.recv(self.frame_size)
+				if not data:
+					break
+				await loop.sock_sendall(sockToTarget, data)
+			sockToTarget.shutdown(socket.SHUT_WR)
+
+		async def from_target():
+			while True:
+				data = await loop.sock_recv(sockToTarget, self.frame_size)
+				if not data:
+					break
+				await stream.sendall(data)
+			stream.shutdown_write()
+
+		tasks = [loop.create_task(to_target()), loop.create_task(from_target())]
+		try:
+			await asyncio.gather(*tasks)
+		except Exception as e:
+			pass
+		finally:
+			for task in tasks:
+				task.cancel()
+			await asyncio.gather(*tasks, return_exceptions=True)
+			sockToTarget.close()
+			stream.close()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+#_____________________________________________________________________________
+#
+# Negative cache of the SOCKS5 proxy: destinations which failed to connect
+#
+# Author:   Samdney  <contact@carolin-zoebelein.de>
+# D4A7 35E8 D47F 801F 2CF6 2BA7 927A FD3C DE47 E13B
+# License:  See LICENSE for licensing information
+#_____________________________________________________________________________
+
+"""
+***Negative cache***
+
+	[timeouts]
+	negative		= 5			seconds, 0: off
+	negative_max	= 10000
+
+=> A connect to a destination (DST.ADDR, DST.PORT) which was refused, is
+	unreachable or timed out is remembered with its REP for "negative"
+	seconds. CONNECTs to it within this time are answered at once with the
+	same REP: no SYN, no socket, no session waiting connect_timeout seconds
+	for a backend which is down.
+=> Only these REPs are cached: CONNREFUSED, HOSTUNREACH, NETUNREACH and
+	TTLEXPIRED. A SERVERFAIL is a problem of the proxy, not of the
+	destination.
+=> A successful connect removes the destination.
+
+---
+Expiry
+---
+=> Like the buckets of admission.py: two generations (dicts), rotated every
+	ttl seconds. Entries carry their own expiry time, on lookup an old one is
+	dropped. At rotation the old generation is dropped as a whole, no scans.
+=> A generation with max_entries entries is rotated early, memory is bounded
+	by 2 * max_entries destinations.
+"""
+
+import time
+
+from socks5 import Protocol
+
+Socks5_Protocol = Protocol()
+
+# REPs which say something about the destination
+CACHED_REPS = (Socks5_Protocol.REP_CONNREFUSED, Socks5_Protocol.REP_HOSTUNREACH,
+				Socks5_Protocol.REP_NETUNREACH, Socks5_Protocol.REP_TTLEXPIRED)
+
+class NegativeCache():
+
+	def __init__(self,ttl=5,max_entries=10000):
+		self.ttl			= ttl
+		self.max_entries	= max_entries
+		self.entries		= {}	# destination -> (expires, REP)
+		self.entries_old	= {}
+		self.rotate_at		= time.monotonic() + ttl
+
+		self.hits			= 0
+		self.added			= 0
+
+	def rotate(self,now):
+		if now >= self.rotate_at + self.ttl:
+			# Nothing added for more than a period, all entries are expired
+			self.entries_old = {}
+		else:
+			self.entries_old = self.entries
+		self.entries = {}
+		self.rotate_at = now + self.ttl
+
+	# Returns the REP of a recent failed connect to destination, else None
+	def get(self,destination):
+		if not self.ttl:
+			return None
+		entry = self.entries.get(destination)
+		if entry is None:
+			entry = self.entries_old.get(destination)
+			if entry is None:
+				return None
+		expires, rep = entry
+		if expires <= time.monotonic():
+			return None
+		self.hits += 1
+		return rep
+
+	def add(self,destination,rep):
+		if not self.ttl or rep not in CACHED_REPS:
+			return
+		now = time.monotonic()
+		if now >= self.rotate_at or len(self.entries) >= self.max_entries:
+			self.rotate(now)
+		self.entries_old.pop(destination, None)
+		self.entries[destination] = (now + self.ttl, rep)
+		self.added += 1
+
+	def remove(self,destination):
+		if self.entries:
+			self.entries.pop(destination, None)
+		if self.entries_old:
+			self.entries_old.pop(destination, None)
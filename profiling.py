@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+
+#_____________________________________________________________________________
+#
+# On-demand profiling of a running proxy process
+#
+# Author:   Samdney  <contact@carolin-zoebelein.de>
+# D4A7 35E8 D47F 801F 2CF6 2BA7 927A FD3C DE47 E13B
+# License:  See LICENSE for licensing information
+#_____________________________________________________________________________
+
+"""
+***Profiling window***
+
+	kill -USR1 <pid of the proxy>		(workers: the parent forwards it)
+	proxy.start_profiling()				embedded, see embed.py
+
+=> Starts a profiling window of [profile] duration seconds in the running
+	process, without a restart. Afterwards the results are written to
+	[profile] dir, one set of files per process:
+
+	mode = sample	The stack of the event loop is sampled every `interval`
+					seconds of CPU time (SIGPROF timer, the handler runs in
+					the event loop thread, between two bytecodes). Waiting
+					in epoll costs no CPU time and is not sampled.
+					Event loop not in the main thread (embedded, SIGPROF
+					is for the main thread only): a thread samples, which
+					only sees the loop thread when it releases the GIL,
+					the shares are biased to syscalls.
+					pysocks5sys-<pid>-<time>.collapsed
+						one line per stack: "frame;frame;... count", root
+						first, input for flamegraph.pl / speedscope
+					pysocks5sys-<pid>-<time>.txt
+						share of the samples in the hot paths (HOT_PATHS):
+						handshake of socks5.Proxy, relay, gender_filter.
+						Frames are named Class.method (co_qualname, before
+						Python 3.11 the class of self which defines it)
+	mode = cprofile	cProfile on the event loop thread
+					pysocks5sys-<pid>-<time>.pstats		(python -m pstats)
+					pysocks5sys-<pid>-<time>.txt		top functions
+
+	tracemalloc = 1	Allocations during the window, still alive at its end
+					pysocks5sys-<pid>-<time>.alloc.txt	top allocators
+
+=> Idle (no window running): no profiler, no thread, no tracemalloc, the
+	proxy runs exactly as without this module.
+=> The event loop keeps running during the window, the sessions are served.
+"""
+
+import cProfile
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+
+# Functions of the hot paths, reported in the summary of mode = sample
+HOT_PATHS = [
+	("handshake",	("Proxy.hallo_recv", "Proxy.hallo_send", "Proxy.auth_recv",
+					"Proxy.auth_reply", "Proxy.connect_recv", "Proxy.connect_reply")),
+	("relay",		("ProxyToServer.SendDataToTargetServer",
+					"ProxyToServer.ReceiveDataFromTargetServer")),
+	("filter",		("gender_filter.change_msg",)),
+]
+
+TRACEMALLOC_FRAMES	= 10
+
+# code -> "file:Class.method"
+_frame_names = {}
+
+def frame_name(frame):
+	code = frame.f_code
+	name = _frame_names.get(code)
+	if name is None:
+		# co_qualname: Python 3.11+
+		qualname = getattr(code, "co_qualname", None) or method_name(frame)
+		name = _frame_names[code] = "%s:%s" % (os.path.basename(code.co_filename),
+												qualname)
+	return name
+
+# Class.method of a method frame: the class in the MRO of self which has
+# this code, else the bare function name
+def method_name(frame):
+	code = frame.f_code
+	if code.co_argcount and code.co_varnames[0] == "self":
+		self = frame.f_locals.get("self")
+		for cls in type(self).__mro__:
+			function = cls.__dict__.get(code.co_name)
+			if getattr(function, "__code__", None) is code:
+				return "%s.%s" % (cls.__qualname__, code.co_name)
+	return code.co_name
+
+
+# Samples the stack of the calling thread: SIGPROF in the main thread, else
+# a second thread
+class StackSampler():
+
+	def __init__(self,interval):
+		self.thread_id	= threading.get_ident()
+		self.interval	= interval
+		self.stacks		= {}		# collapsed stack -> samples
+		self.samples	= 0
+		self.running	= False
+		self.thread		= None
+		self.handler	= None		# SIGPROF handler before start()
+
+	def start(self):
+		self.running = True
+		if threading.current_thread() is threading.main_thread():
+			self.handler = signal.signal(signal.SIGPROF, self.on_signal)
+			signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+		else:
+			self.thread = threading.Thread(target=self.run, name="profiling", daemon=True)
+			self.thread.start()
+
+	def stop(self):
+		self.running = False
+		if self.thread:
+			self.thread.join()
+		else:
+			signal.setitimer(signal.ITIMER_PROF, 0, 0)
+			signal.signal(signal.SIGPROF, self.handler)
+
+	def on_signal(self,signum,frame):
+		self.sample(frame)
+
+	def run(self):
+		while self.running:
+			time.sleep(self.interval)
+			self.sample(sys._current_frames().get(self.thread_id))
+
+	def sample(self,frame):
+		names = []
+		while frame is not None:
+			names.append(frame_name(frame))
+			frame = frame.f_back
+		stack = ";".join(reversed(names))
+		self.stacks[stack] = self.stacks.get(stack, 0) + 1
+		self.samples += 1
+
+	def write_collapsed(self,f):
+		for stack, count in sorted(self.stacks.items(), key=lambda item: -item[1]):
+			f.write("%s %d\n" % (stack, count))
+
+	def write_summary(self,f):
+		f.write("Samples: %d, every %.1f ms %s\n\n" % (self.samples, self.interval * 1000,
+				"(thread, biased)" if self.thread else "of CPU time"))
+		f.write("Hot paths (share of all samples):\n")
+		for name, functions in HOT_PATHS:
+			count = 0
+			for stack, samples in self.stacks.items():
+				if any(function in stack for function in functions):
+					count += samples
+			f.write("  %-10s %6d  %5.1f %%\n" % (name, count,
+						100.0 * count / max(self.samples, 1)))
+
+		# Leaf frames: where the time is actually spent
+		leafs = {}
+		for stack, samples in self.stacks.items():
+			leaf = stack.rpartition(";")[2]
+			leafs[leaf] = leafs.get(leaf, 0) + samples
+		f.write("\nTop frames (self):\n")
+		for leaf, count in sorted(leafs.items(), key=lambda item: -item[1])[:25]:
+			f.write("  %6d  %5.1f %%  %s\n" % (count, 100.0 * count / max(self.samples, 1),
+											leaf))
+
+
+class ProfilingWindow():
+
+	# Call from the event loop thread
+	def __init__(self,settings):
+		self.dir			= settings.profile_dir
+		self.duration		= settings.profile_duration
+		self.mode			= settings.profile_mode
+		self.interval		= settings.profile_interval
+		self.tracemalloc	= settings.profile_tracemalloc
+		self.top			= settings.profile_top
+		self.profile		= None
+		self.sampler		= None
+		self.started_tracemalloc = False
+		self.running		= False
+
+	def start(self,loop):
+		print("[*] Profiling For %.1f Seconds (%s) ..." % (self.duration, self.mode))
+		self.running = True
+		if self.tracemalloc and not tracemalloc.is_tracing():
+			tracemalloc.start(TRACEMALLOC_FRAMES)
+			self.started_tracemalloc = True
+		if self.mode == "cprofile":
+			self.profile = cProfile.Profile()
+			self.profile.enable()
+		else:
+			self.sampler = StackSampler(self.interval)
+			self.sampler.start()
+		loop.call_later(self.duration, self.finish)
+
+	def finish(self):
+		self.running = False
+		snapshot = None
+		if self.profile:
+			self.profile.disable()
+		if self.sampler:
+			self.sampler.stop()
+		if self.started_tracemalloc:
+			snapshot = tracemalloc.take_snapshot()
+			tracemalloc.stop()
+
+		prefix = os.path.join(self.dir, "pysocks5sys-%d-%s" % (os.getpid(),
+								time.strftime("%Y%m%d-%H%M%S")))
+		try:
+			files = self.write(prefix, snapshot)
+			print("[*] Profiling Finished: %s" % (", ".join(files)))
+		except OSError as e:
+			print("[*] Unable To Write Profiling Results: %s" % (e))
+
+	def write(self,prefix,snapshot):
+		files = []
+		if self.profile:
+			self.profile.dump_stats(prefix + ".pstats")
+			files.append(prefix + ".pstats")
+			with open(prefix + ".txt", "w") as f:
+				stats = pstats.Stats(self.profile, stream=f)
+				stats.sort_stats("cumulative").print_stats(self.top)
+				stats.sort_stats("tottime").print_stats(self.top)
+			files.append(prefix + ".txt")
+		if self.sampler:
+			with open(prefix + ".collapsed", "w") as f:
+				self.sampler.write_collapsed(f)
+			files.append(prefix + ".collapsed")
+			with open(prefix + ".txt", "w") as f:
+				self.sampler.write_summary(f)
+			files.append(prefix + ".txt")
+		if snapshot:
+			snapshot = snapshot.filter_traces([
+				tracemalloc.Filter(False, tracemalloc.__file__),
+				tracemalloc.Filter(False, __file__)])
+			with open(prefix + ".alloc.txt", "w") as f:
+				statistics = snapshot.statistics("lineno")
+				total = sum(stat.size for stat in statistics)
+				f.write("Allocated during the window, still alive: %d KiB in %d blocks\n\n"
+						% (total // 1024, sum(stat.count for stat in statistics)))
+				f.write("Top allocators:\n")
+				for stat in statistics[:self.top]:
+					f.write("  %s\n" % (stat))
+				f.write("\nTop allocators, with traceback:\n")
+				for stat in snapshot.statistics("traceback")[:3]:
+					f.write("  %d KiB in %d blocks\n" % (stat.size // 1024, stat.count))
+					for line in stat.traceback.format():
+						f.write("    %s\n" % (line))
+			files.append(prefix + ".alloc.txt")
+		return files
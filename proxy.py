@@ -10,7 +10,6 @@
 # License:  See LICENSE for licensing information
 #_____________________________________________________________________________
 
-# TODO: configfile/argparsing
 # TODO: logging
 # TODO: bufferhandling is very bad! A lot of bugs! Values have NO fixed size!
 # TODO: connections run in troubles if data > buffer_size
@@ -19,183 +18,903 @@
 # TODO: check steps of SOCKS5 connection implementation for details of protocol
 # specification, see section: Addressing
 
+import asyncio
+import functools
+import os
+import signal
 import socket
 import string
+import struct
+import subprocess
 import sys
+import threading
 
 from socks5 import *
-from myproxyfilter import *
+from socks5auth import *
+from admission import *
+from upstream import *
+from mux import *
+from sockopts import *
+from capture import *
+from negcache import *
+from httprelay import *
+from shaper import *
+from session import *
+from timerwheel import *
+from handoff import *
+from config import *
 
 Socks5_Protocol = Protocol()
 
 # **********
-# Config
+# Config: see config.py, all keys with their defaults are in proxy.conf
 # **********
-proxy_host	= "127.0.0.1"
-proxy_port	= 1080
-proxy_addr	= (proxy_host, proxy_port)
-
-max_conn 	= 5
-
 # SOCKS5 - Hallo
 VER 				= Socks5_Protocol.VER
 METHOD				= Socks5_Protocol.METHOD_NOAUTH
+
+ACCEPT_BATCH		= 64	# connections accepted per wakeup of the listener
+IOV_MAX				= 1024	# buffers per sendmsg
 # **********
 
 class ProxyToServer():
+	__slots__ = ("sockToTarget", "stream", "upstream", "parent", "route", "idle_timeout",
+				"session", "capture", "http", "flow_to_target", "flow_to_client")
 
-	def __init__(self):
-		self.msg_from_target	= ""
+	# shapers: (to target, to client), see shaper.py
+	def __init__(self,route,idle_timeout,session,capture=None,shapers=None):
 		self.sockToTarget 		= None
-		self.data_client		= None
+		self.stream				= None		# instead of sockToTarget, see mux.py
+		self.upstream			= None
+		self.parent				= None
+		self.route				= route
+		self.idle_timeout		= idle_timeout
+		self.session			= session	# the counters, see session.py
+		self.capture			= capture	# CaptureWriter or None
+		# relay = http: the requests of the client (see httprelay.py)
+		self.http				= None
+		if route.relay == "http" and route.filter_switch:
+			self.http			= HttpRequests()
+		# None: not shaped
+		self.flow_to_target		= shapers[0].flow(route) if shapers else None
+		self.flow_to_client		= shapers[1].flow(route) if shapers else None
 
-	def ConnectToTargetServer(self,target_addr):
+	# atyp: ATYP of the request, a domain name is resolved first
+	async def ConnectToTargetServer(self,target_addr,atyp=Socks5_Protocol.ATYP_IPV4):
 		# Socket Init
+		loop = asyncio.get_running_loop()
 		try:
-			sockToTarget = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-			sockToTarget.connect(target_addr)
+			if atyp == Socks5_Protocol.ATYP_IPV4:
+				family = socket.AF_INET
+			elif atyp == Socks5_Protocol.ATYP_IPV6:
+				family = socket.AF_INET6
+			else:
+				try:
+					addrinfo = await loop.getaddrinfo(target_addr[0], target_addr[1],
+													type=socket.SOCK_STREAM)
+				except socket.gaierror as e:
+					raise ConnectError(Socks5_Protocol.REP_HOSTUNREACH,
+										"unable to resolve %s" % (target_addr[0])) from e
+				family, socktype, proto, canonname, target_addr = addrinfo[0]
+			sockToTarget = socket.socket(family, socket.SOCK_STREAM)
+			sockToTarget.setblocking(False)
+			apply_profile(sockToTarget,self.route.socket_profile)
+			# Set before connecting, so a timed out connect is closed, too
 			self.sockToTarget = sockToTarget
+			await loop.sock_connect(sockToTarget, target_addr)
 			print("[*] Initializing Sockets To Target Server... Done")
 		except Exception as e:
-			print("[*] Unable To Initialize Socket To Target Server")
-			sys.exit(2)	# Error number?
+			print("[*] Unable To Initialize Socket To Target Server: %s" % (e))
+			raise ConnectError(connect_error_rep(e)) from e
 
-	def recv_data(self,conn):
-		buf_client		= 1024
-		self.data_client 	= conn.recv(buf_client)
+	# Through a parent SOCKS5 server, with DST.ADDR/DST.PORT of the client's
+	# request (see upstream.py)
+	async def ConnectToParentServer(self,upstream,Socks5_Proxy):
+		try:
+			self.parent, self.sockToTarget = await upstream.connect(Socks5_Proxy.atyp,
+						Socks5_Proxy.target_packed, Socks5_Proxy.target_port,
+						self.route.socket_profile)
+			self.upstream = upstream
+			print("[*] Initializing Sockets To Target Server Through Parent %r ... Done"
+				% (self.parent))
+		except Socks5Error as e:
+			print("[*] Unable To Initialize Socket To Target Server Through A Parent")
+			raise
 
-	# TODO: This Should be parted in SendDataToTargetServer(...) and
-	# ReceiveDataFromTargetServer(...)
-	def CommunicationWithTargetServer(self,msg_for_target):
-		buffer_size = 1024
+	# As a stream on the mux connection to the core proxy (see mux.py)
+	async def ConnectThroughMux(self,mux_client,Socks5_Proxy):
 		try:
-			# Forward msg from Client to Target Server
-			self.sockToTarget.sendall(msg_for_target.encode())
-			print("[*] Forward Message from Client to Target Server ... Done")
-			
-			# Receive response msg target_rp_msg from Target Server
-			data_target = self.sockToTarget.recv(buffer_size)
-			if data_target:
-				print("[*] Received Message from Target Server")
-				self.msg_from_target = data_target.decode()
-				#print(data_target.decode())
+			self.stream = await mux_client.open(Socks5_Proxy.atyp,
+						Socks5_Proxy.target_packed, Socks5_Proxy.target_port)
+			print("[*] Initializing Mux Stream To Target Server ... Done")
+		except Socks5Error as e:
+			print("[*] Unable To Initialize Mux Stream To Target Server")
+			raise
+		except (OSError, asyncio.TimeoutError) as e:
+			# The connection to the core proxy failed, not the target server
+			print("[*] Unable To Connect To Mux Peer")
+			raise Socks5Error("mux peer unavailable") from e
+
+	# Relay: Client -> Target Server, until the client closes. pending: sent
+	# by the client after its request, without waiting for the reply.
+	async def SendDataToTargetServer(self,conn,wheel,timer,pending=b""):
+		loop = asyncio.get_running_loop()
+		session, capture, http = self.session, self.capture, self.http
+		flow = self.flow_to_target
+		chunk_size, idle_timeout = self.route.chunk_size, self.idle_timeout
+		if self.stream:
+			send = self.stream.sendall
+		else:
+			send = functools.partial(loop.sock_sendall, self.sockToTarget)
+		while True:
+			if pending:
+				data, pending = pending, None
 			else:
-				print("[*] Received No Valid Data from Target Server")
-				sys.exit(2)	# Error number?
-			
-		except Exception as e:
-			print("[*] Unable To Communicate with Target Server")
-			sys.exit(2)	# Error number?
-		#finally:
-			# Close socket 
-			#sockToTarget.close()
-			#print("SOCK")
-	
+				data = await sock_recv(loop,conn,chunk_size)
+			if not data:
+				break
+			wheel.bump(timer, idle_timeout)
+			if capture:
+				capture.frame(session.id, TO_TARGET, data)
+			if http:
+				http.feed(data)
+			if flow:
+				await flow.acquire(len(data))
+			await send(data)
+			session.bytes_to_target += len(data)
+		if self.stream:
+			self.stream.shutdown_write()
+		else:
+			shutdown_write(self.sockToTarget)
+
+	# Relay: Target Server -> Client, through the proxyfilter, until the
+	# target server closes. relay = http: only the bodies of the responses.
+	async def ReceiveDataFromTargetServer(self,conn,wheel,timer):
+		loop = asyncio.get_running_loop()
+		filter_switch = self.route.filter_switch
+		myfilter = load_filter() if filter_switch else None
+		session, capture = self.session, self.capture
+		flow = self.flow_to_client
+		chunk_size, idle_timeout = self.route.chunk_size, self.idle_timeout
+		http = None
+		if self.http:
+			http = HttpResponses(self.http,
+								functools.partial(filter_data, myfilter, filter_switch),
+								self.route.http_max_body)
+		if self.stream:
+			recv = self.stream.recv
+		else:
+			recv = functools.partial(sock_recv, loop, self.sockToTarget)
+		while True:
+			data = await recv(chunk_size)
+			if not data:
+				break
+			wheel.bump(timer, idle_timeout)
+			if capture:
+				capture.frame(session.id, TO_CLIENT, data)
+			if http:
+				buffers = http.feed(data)
+				if flow:
+					await flow.acquire(sum(map(len, buffers)))
+				session.bytes_to_client += await sock_sendmsg(loop,conn,buffers)
+				continue
+			if myfilter:
+				data = filter_data(myfilter,filter_switch,data)
+			if flow:
+				await flow.acquire(len(data))
+			await loop.sock_sendall(conn, data)
+			session.bytes_to_client += len(data)
+		if http:
+			session.bytes_to_client += await sock_sendmsg(loop,conn,http.flush())
+		shutdown_write(conn)
+
 	def close(self):
-		self.sockToTarget.close()
+		if self.stream:
+			self.stream.close()
+		if self.sockToTarget:
+			self.sockToTarget.close()
+		if self.parent:
+			self.upstream.release(self.parent)
 
-def main():
-	print("[*] Starting Proxy Server ...")
+# The proxyfilter module is imported by the first session with a filter,
+# a proxy with filter 0 on all routes never loads it
+def load_filter():
+	from myproxyfilter import gender_filter
+	return gender_filter()
+
+# The proxyfilter on one chunk of the relay (also used by replay.py).
+# surrogateescape: bytes which are no valid UTF-8 pass unchanged.
+def filter_data(myfilter,filter_switch,data):
+	myfilter.change_msg(filter_switch, data.decode(errors="surrogateescape"))
+	return myfilter.msg_new.encode(errors="surrogateescape")
+
+def shutdown_write(sock):
+	try:
+		sock.shutdown(socket.SHUT_WR)
+	except OSError:
+		pass
 
-	# *****
-	# SOCKS5
-	# *****
-	Socks5_Proxy = Proxy()
-	Socks5_Proxy.init_socketToClient(socket.AF_INET, socket.SOCK_STREAM, proxy_addr,max_conn)
-	
-	while True:	
+# As loop.sock_recv, for the relay. While a session is idle only a future
+# and the reader handle are pending, no done callback and partial per read.
+async def sock_recv(loop,sock,n):
+	while True:
 		try:
-			conn, client_addr = Socks5_Proxy.sockToClient.accept()
-			
-			print("[*] Start Initialization of SOCKS5 Connection To Client")
-			#s = 0
-			
-			print("[*] *** Hallo ***")
-			# Step 1: Receive "Hallo" from Client
-			# VER+NMETHODS+METHODS
-			#s = 1
-			Socks5_Proxy.hallo_recv(conn)
-			
-			# Step 2: Send answer Hallo to Client
-			# VER+METHOD
-			#s = 2
-			Socks5_Proxy.hallo_send(VER,METHOD,conn)
-			
-			print("[*] *** Connecting ***")	
-			# Step 3: Receive request details from Client
-			# VER+CMD+RSV+ATYP+DST.ADDR+DST.PORT
-			#s = 3
-			Socks5_Proxy.connect_recv(conn)
+			return sock.recv(n)
+		except (BlockingIOError, InterruptedError):
+			pass
+		fd = sock.fileno()
+		readable = loop.create_future()
+		loop.add_reader(fd, set_readable, readable)
+		try:
+			await readable
+		finally:
+			loop.remove_reader(fd)
+
+def set_readable(readable):
+	# The reader can run again before the waiting task does
+	if not readable.done():
+		readable.set_result(None)
+
+# As loop.sock_sendall, for a list of buffers (bytes, memoryview): one
+# sendmsg (writev) for all, they are not joined first. Returns the octets.
+async def sock_sendmsg(loop,sock,buffers):
+	total = sum(map(len, buffers))
+	first = 0
+	while first < len(buffers):
+		try:
+			sent = sock.sendmsg(buffers[first:first + IOV_MAX])
+		except (BlockingIOError, InterruptedError):
+			fd = sock.fileno()
+			writable = loop.create_future()
+			loop.add_writer(fd, set_readable, writable)
+			try:
+				await writable
+			finally:
+				loop.remove_writer(fd)
+			continue
+		while first < len(buffers) and sent >= len(buffers[first]):
+			sent -= len(buffers[first])
+			first += 1
+		if sent:
+			buffers[first] = memoryview(buffers[first])[sent:]
+	return total
+
+# One session per client, running as a task on the event loop. The session
+# record is in server.table from accept until the end of this task.
+# Returns (route, ATYP, address) for the direct connect. A domain name is
+# resolved first and routed by its first address, which is then connected
+# to without a second lookup. Names which do not resolve here, and all names
+# of a table without routes, take the default route unresolved (a parent
+# may know them).
+async def find_route(routes,Socks5_Proxy):
+	atyp, port = Socks5_Proxy.atyp, Socks5_Proxy.target_port
+	target_addr = (Socks5_Proxy.target_host,port)
+	if atyp != Socks5_Protocol.ATYP_DOMAINNAME:
+		return routes.lookup(Socks5_Proxy.target_packed,port), atyp, target_addr
+	if len(routes.by_name) == 1:
+		return routes.default, atyp, target_addr
+	loop = asyncio.get_running_loop()
+	try:
+		addrinfo = await loop.getaddrinfo(target_addr[0], port, type=socket.SOCK_STREAM)
+	except socket.gaierror:
+		return routes.default, atyp, target_addr
+	family, socktype, proto, canonname, sockaddr = addrinfo[0]
+	if family == socket.AF_INET6:
+		atyp = Socks5_Protocol.ATYP_IPV6
+	else:
+		atyp = Socks5_Protocol.ATYP_IPV4
+	packed = socket.inet_pton(family, sockaddr[0].partition("%")[0])
+	return routes.lookup(packed,port), atyp, sockaddr
+
+async def handle_client(session,server):
+	# The settings at the start of the session, a reload does not change them
+	settings, routes	= server.settings, server.routes
+	upstream			= server.upstream
+	mux_client			= server.mux_client
+	capture				= server.capture
+	negative			= server.negative
+	shapers				= server.shapers
+	wheel				= server.wheel
+	conn, timer			= session.client, session.timer
+	Socks5_Proxy 		= Proxy()
+	ProxyTargetConn 	= None
+	try:
+		print("[*] Start Initialization of SOCKS5 Connection To Client")
+		#s = 0
+		
+		print("[*] *** Hallo ***")
+		# Step 1: Receive "Hallo" from Client
+		# VER+NMETHODS+METHODS
+		#s = 1
+		await Socks5_Proxy.hallo_recv(conn,server.methods)
+		
+		# Step 2: Send answer Hallo to Client
+		# VER+METHOD
+		#s = 2
+		await Socks5_Proxy.hallo_send(VER,Socks5_Proxy.method,conn)
+		if Socks5_Proxy.method == Socks5_Protocol.METHOD_NOACCEPT:
+			return
+
+		if Socks5_Proxy.method == Socks5_Protocol.METHOD_USERNAME:
+			session.state = AUTH
+			# Step 2a: Receive Username/Password from Client
+			# VER+ULEN+UNAME+PLEN+PASSWD
+			valid = await Socks5_Proxy.auth_recv(conn,server.credentials)
+
+			# Step 2b: Send status back to Client
+			# VER+STATUS
+			if not valid:
+				print("[*] Authentication Failed")
+				await Socks5_Proxy.auth_reply(Socks5_Protocol.AUTH_FAILURE,conn)
+				return
+			await Socks5_Proxy.auth_reply(Socks5_Protocol.AUTH_SUCCESS,conn)
+		
+		print("[*] *** Connecting ***")	
+		# Step 3: Receive request details from Client
+		# VER+CMD+RSV+ATYP+DST.ADDR+DST.PORT
+		#s = 3
+		await Socks5_Proxy.connect_recv(conn)
+		
+		if Socks5_Proxy.cmd == Socks5_Protocol.CMD_CONNECT[0]:
+			#CONNECT
+			print("[*] Step 3: Start To Connect To Target Server ...")
 			
-			if Socks5_Proxy.cmd == Socks5_Protocol.CMD_CONNECT[0]:
-				#CONNECT
-				print("[*] Step 3: Start To Connect To Target Server ...")
-				
-				target_addr = (Socks5_Proxy.target_host,Socks5_Proxy.target_port)
-
-				ProxyTargetConn = ProxyToServer()
-				ProxyTargetConn.ConnectToTargetServer(target_addr)
-				
-				# Step 4: Send reply back to client
-				# VER+REP+RSV+ATYP+BND.ADDR+BND.PORT
-				#s = 4
-				Socks5_Proxy.connect_reply(conn)
-				print("[*] Initializing Socket To Target Server... Done")
-
-				print("[*] *** Connecting: Finished ***")
-								
-				# *****
-				# Communication with Target Server
-				# *****
-				print("[*] *** Start Communication With Target Server ***")
-				
-				ProxyTargetConn.recv_data(conn)
-				if ProxyTargetConn.data_client:
-					msg_for_target = ProxyTargetConn.data_client.decode()
-					ProxyTargetConn.CommunicationWithTargetServer(msg_for_target)
-					
-					print("[*] Forwarding Response From Target Server to Client ...")
-								
-					rp_msg_from_target = ProxyTargetConn.msg_from_target
-					print("\t\t=> " + rp_msg_from_target)
-										
-					# ********************
-					# MyProxyFilter
-					# ********************
-					# Choose Kind of Filter
-					print("[*] Proxyfilter")
-
-					# 0: Filter of
-					# 1: Filter on - simple_switch,
-					# 2: Filter on - lingu_switch (not implemented until now)
-					filter_switch 			= 1
-
-					myfilter 				= gender_filter()
-					myfilter.change_msg(filter_switch,rp_msg_from_target)
-					
-					New_rp_msg_from_target 	= myfilter.msg_new
-					print("\t\t=> " + New_rp_msg_from_target)
-					# ********************
-					conn.sendall(New_rp_msg_from_target.encode())
-					print("[*] ... Done")
+			target_addr = (Socks5_Proxy.target_host,Socks5_Proxy.target_port)
+			destination = (Socks5_Proxy.target_packed,Socks5_Proxy.target_port)
+			# Failed a moment ago: the same answer, without a new connect
+			REP = negative.get(destination)
+			if REP is not None:
+				print("[*] Target Server Failed Recently: REP %d" % (REP[0]))
+				await Socks5_Proxy.connect_reply(conn,REP)
+				return
+			session.state = CONNECTING
+			session.target_addr = target_addr
+			wheel.bump(timer, settings.connect_timeout)
+			route, connect_atyp, connect_addr = await find_route(routes,Socks5_Proxy)
+			# The client socket has the options of the listener (inherited)
+			if route.socket_profile != settings.socket_profile:
+				apply_profile(conn,route.socket_profile)
+
+			ProxyTargetConn = ProxyToServer(route,settings.idle_timeout,session,capture,shapers)
+			try:
+				if route.upstream and mux_client:
+					await ProxyTargetConn.ConnectThroughMux(mux_client,Socks5_Proxy)
+				elif route.upstream and upstream:
+					await ProxyTargetConn.ConnectToParentServer(upstream,Socks5_Proxy)
 				else:
-					print("[*] Received No Valid Data from Client")
-					sys.exit(2)	# Error number?	
-				
-			#if Socks5_Proxy.cmd == str(Socks5_Protocol.CMD_BIND):
-				# BIND
-				# TODO
-
-			#if Socks5_Proxy.cmd == str(Socks5_Protocol.CMD_UDP):
-				# UDP ASSOCIATE
-				# TODO
+					await ProxyTargetConn.ConnectToTargetServer(connect_addr,connect_atyp)
+			except Socks5Error as e:
+				# Step 4 (failed): VER+REP+RSV+ATYP+BND.ADDR+BND.PORT
+				REP = connect_error_rep(e)
+				negative.add(destination,REP)
+				await Socks5_Proxy.connect_reply(conn,REP)
+				return
+			except asyncio.CancelledError:
+				# Expired timer: connect_timeout. Answered without waiting, the
+				# task is cancelled.
+				if timer.slot is None:
+					REP = Socks5_Protocol.REP_TTLEXPIRED
+					negative.add(destination,REP)
+					try:
+						conn.send(Socks5_Proxy.connect_reply_msg(REP))
+					except OSError:
+						pass
+				raise
+			negative.remove(destination)
+			
+			# Step 4: Send reply back to client
+			# VER+REP+RSV+ATYP+BND.ADDR+BND.PORT
+			#s = 4
+			await Socks5_Proxy.connect_reply(conn)
+			print("[*] Initializing Socket To Target Server... Done")
+			session.target = ProxyTargetConn.stream or ProxyTargetConn.sockToTarget
+			session.state = RELAY
+			if capture:
+				capture.frame(session.id, OPEN, Socks5_Proxy.connect_data)
+			pending = Socks5_Proxy.pending
+			# Not needed anymore, an idle session keeps only its record
+			Socks5_Proxy = None
+
+			print("[*] *** Connecting: Finished ***")
+							
+			# *****
+			# Communication with Target Server
+			# *****
+			print("[*] *** Start Communication With Target Server ***")
+			wheel.bump(timer, settings.idle_timeout)
+
+			# ********************
+			# MyProxyFilter: see ReceiveDataFromTargetServer
+			# ********************
+			# Client -> Target Server in a second task, Target Server -> Client
+			# in this one. An error of the second task cancels this one.
+			loop = asyncio.get_running_loop()
+			sending = loop.create_task(ProxyTargetConn.SendDataToTargetServer(conn,wheel,timer,
+										pending))
+			sending.add_done_callback(session.relay_done)
+			try:
+				await ProxyTargetConn.ReceiveDataFromTargetServer(conn,wheel,timer)
+				await sending
+			except asyncio.CancelledError:
+				# Cancelled by relay_done: the error of the other direction
+				if (timer.slot is not None and sending.done() and not sending.cancelled()
+						and sending.exception() is not None):
+					raise sending.exception()
+				raise
+			finally:
+				sending.remove_done_callback(session.relay_done)
+				sending.cancel()
+				await asyncio.gather(sending, return_exceptions=True)
+			print("[*] Relay Finished: %d Bytes To Target Server, %d Bytes To Client"
+				% (session.bytes_to_target, session.bytes_to_client))
 			
+		#if Socks5_Proxy.cmd == str(Socks5_Protocol.CMD_BIND):
+			# BIND
+			# TODO
+
+		#if Socks5_Proxy.cmd == str(Socks5_Protocol.CMD_UDP):
+			# UDP ASSOCIATE
+			# TODO
+
+		else:
+			print("[*] Command not Supported: %d" % (Socks5_Proxy.cmd))
+			await Socks5_Proxy.connect_reply(conn,Socks5_Protocol.REP_NOTSUPPORTED)
+		
+	except asyncio.CancelledError:
+		# Only an expired timer is a timeout (counted by the wheel), else the
+		# server is stopping
+		if timer.slot is None:
+			print("[*] Session Timed Out")
+		else:
+			print("[*] Session Cancelled")
+			raise
+	except Exception as e:
+		print("[*] Unable To Communicate With Client")
+		# An aborted relay: the client gets an RST, not the FIN of a clean end
+		if session.state == RELAY:
+			reset_on_close(conn)
+	finally:
+		conn.close()
+		if ProxyTargetConn:
+			ProxyTargetConn.close()
+		if capture and session.state == RELAY:
+			capture.frame(session.id, CLOSE)
+		server.end_session(session)
+
+# Over the admission limit: costs one send() at most, nothing is read
+def reject_client(conn,reject_msg,admission_reject):
+	try:
+		if admission_reject == "reply":
+			conn.send(reject_msg)
+	except OSError:
+		pass
+	if admission_reject != "reply":
+		reset_on_close(conn)
+	conn.close()
+
+# close() sends RST (SO_LINGER 0), no TIME_WAIT
+def reset_on_close(sock):
+	try:
+		sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+	except OSError:
+		pass
+
+class ProxyServer():
+
+	def __init__(self,args,settings,routes,listeners,mux_listeners=(),handoff=True):
+		self.args			= args
+		self.settings		= settings
+		self.routes			= routes
+		self.listeners		= listeners		# Proxy objects with sockToClient
+		self.mux_listeners	= list(mux_listeners)	# the same, for mux connections
+		self.table			= SessionTable()
+		self.mux_streams	= set()		# relay tasks of the mux streams
+		self.methods		= None
+		self.credentials	= None
+		self.admission		= None
+		self.admission_settings = None
+		self.upstream		= None
+		self.upstream_settings = None
+		self.mux_client		= None
+		self.mux_settings	= None
+		self.mux_server		= None
+		self.capture		= None
+		self.capture_settings = None
+		self.negative		= None
+		self.shapers		= None
+		self.shaping_settings = None
+		self.wheel			= None
+		self.handoff		= None
+		self.handoff_enabled = handoff and settings.handoff_path
+		self.stopped		= None
+		self.handed_over	= False
+		self.profiling		= None
+		self.sessions_done	= 0		# totals of the ended sessions
+		self.bytes_to_target = 0
+		self.bytes_to_client = 0
+
+	# At start and on SIGHUP. Sessions which are already running keep the
+	# settings they were started with.
+	def configure(self):
+		settings = self.settings
+		# Methods we accept, in order of preference
+		methods = [METHOD]
+		if settings.auth_file:
+			if not self.credentials:
+				self.credentials = CredentialStore(cache_ttl=settings.auth_cache_ttl)
+			self.credentials.cache_ttl = settings.auth_cache_ttl
+			self.credentials.load(settings.auth_file)
+			methods = [Socks5_Protocol.METHOD_USERNAME]
+		self.methods = methods
+
+		# Kept over a reload if unchanged, else the new one takes the counts
+		# of the running sessions over
+		admission = [settings.conn_rate, settings.conn_burst, settings.max_sessions,
+					settings.source_prefix_v4, settings.source_prefix_v6]
+		if admission != self.admission_settings:
+			self.admission_settings = admission
+			old = self.admission
+			self.admission = AdmissionControl(*admission)
+			if old:
+				rekey = self.admission.take_over(old)
+				for session in self.table:
+					session.admission = self.admission
+					session.source = rekey(session.source)
+
+		# Kept over a reload if unchanged, with the latencies and health
+		# of the parents
+		upstream = [getattr(settings, s[0]) for s in SETTINGS if s[1] == "upstream"]
+		upstream.append(settings.connect_timeout)
+		if upstream != self.upstream_settings:
+			self.upstream_settings = upstream
+			if self.upstream:
+				self.upstream.close()
+			self.upstream = None
+			if settings.upstream_parents:
+				username, password = settings.upstream_username, settings.upstream_password
+				self.upstream = UpstreamPool(settings.upstream_parents,
+							policy=settings.upstream_policy,
+							username=username.encode() if username is not None else None,
+							password=(password or "").encode(),
+							connect_timeout=settings.connect_timeout,
+							check_interval=settings.upstream_check_interval,
+							check_timeout=settings.upstream_check_timeout,
+							max_latency=settings.upstream_max_latency,
+							max_fails=settings.upstream_max_fails,
+							alpha=settings.upstream_ewma_alpha)
+				self.upstream.start(asyncio.get_running_loop())
+
+		# A changed peer closes the mux sessions which are running
+		mux = [settings.mux_peer, settings.mux_window, settings.mux_frame_size,
+				settings.connect_timeout]
+		if mux != self.mux_settings:
+			self.mux_settings = mux
+			if self.mux_client:
+				self.mux_client.close()
+			self.mux_client = None
+			if settings.mux_peer:
+				self.mux_client = MuxClient(settings.mux_peer,window=settings.mux_window,
+							frame_size=settings.mux_frame_size,
+							connect_timeout=settings.connect_timeout)
+
+		# Core proxy: checked for new mux connections, running ones stay
+		if self.mux_server:
+			self.mux_server.allow = settings.mux_allow
+
+		# A new file for new sessions, the running ones keep the old one (its
+		# frames are dropped after the close)
+		capture = [settings.capture_file, settings.capture_max_pending,
+					settings.capture_flush_interval]
+		if capture != self.capture_settings:
+			self.capture_settings = capture
+			if self.capture:
+				self.capture.close()
+			self.capture = None
+			if settings.capture_file:
+				self.capture = CaptureWriter(settings.capture_file,
+							max_pending=settings.capture_max_pending,
+							flush_interval=settings.capture_flush_interval)
+				self.capture.start()
+
+		# Emptied by a changed ttl
+		if (not self.negative or self.negative.ttl != settings.negative_ttl
+				or self.negative.max_entries != settings.negative_max):
+			self.negative = NegativeCache(settings.negative_ttl,settings.negative_max)
+
+		# The same shapers for the life of the server: a reload changes rates
+		# and weights in place, running sessions included
+		if self.shapers is None:
+			self.shapers = (Shaper(settings.shaping_rate,settings.shaping_burst),
+							Shaper(settings.shaping_rate,settings.shaping_burst))
+		elif self.shaping_settings != (settings.shaping_rate, settings.shaping_burst,
+										self.routes.by_name):
+			for shaper in self.shapers:
+				shaper.update(settings.shaping_rate, settings.shaping_burst, self.routes.by_name)
+		self.shaping_settings = (settings.shaping_rate, settings.shaping_burst, self.routes.by_name)
+
+	def reload(self):
+		print("[*] Reloading Configuration ...")
+		try:
+			settings, routes = load_config(self.args)
+			for field in ("listen", "backlog", "workers", "handoff_path", "mux_listen",
+							"socket_profile"):
+				if getattr(settings, field) != getattr(self.settings, field):
+					print("[*] Changed '%s' Needs A Restart (SIGUSR2)" % (field))
+			old = self.settings, self.routes
+			self.settings, self.routes = settings, routes
+			try:
+				self.configure()
+			except Exception as e:
+				self.settings, self.routes = old
+				raise
+			print("[*] Reloading Configuration ... Done")
 		except Exception as e:
-			print("[*] Unable To Communicate With Client")
-			sys.exit(2)	# Error number?		
+			print("[*] Unable To Reload Configuration, Keeping The Old One: %s" % (e))
+
+	# Counters of the running server, call from its event loop (see embed.py)
+	def stats(self):
+		return {
+			"sessions":			len(self.table),
+			"states":			self.table.count_states(),
+			"sessions_done":	self.sessions_done,
+			"admitted":			self.admission.admitted,
+			"rejected":			self.admission.rejected,
+			"bytes_to_target":	self.bytes_to_target + sum(s.bytes_to_target for s in self.table),
+			"bytes_to_client":	self.bytes_to_client + sum(s.bytes_to_client for s in self.table),
+			"negative_hits":	self.negative.hits,
+			"timeouts":			self.wheel.expired,
+			"shaped":			self.shapers[0].waits + self.shapers[1].waits,
+		}
+
+	# SIGUSR1. Imported on the first use, idle it costs nothing.
+	def start_profiling(self):
+		print("[*] Sessions: %d (%s)" % (len(self.table), ", ".join("%s %d" % item
+				for item in self.table.count_states().items())))
+		if self.profiling and self.profiling.running:
+			print("[*] Profiling Is Running Already")
+			return
+		from profiling import ProfilingWindow
+		self.profiling = ProfilingWindow(self.settings)
+		self.profiling.start(asyncio.get_running_loop())
+
+	# Synchronous: not a single connection is accepted after stop()
+	def stop(self):
+		if self.stopped.is_set():
+			return
+		print("[*] Stop Accepting New Connections ...")
+		loop = asyncio.get_running_loop()
+		for listener in self.listeners:
+			loop.remove_reader(listener.sockToClient.fileno())
+		if self.mux_server:
+			self.mux_server.stop(loop)
+		self.stopped.set()
+
+	# started: called once the listeners accept (see embed.py)
+	async def run(self,started=None):
+		loop = asyncio.get_running_loop()
+		self.stopped = asyncio.Event()
+		self.configure()
+
+		self.wheel = TimerWheel(self.settings.timer_tick)
+		self.wheel.start(loop)
+
+		# Signals can only be handled by the main thread
+		if threading.current_thread() is threading.main_thread():
+			loop.add_signal_handler(signal.SIGHUP, self.reload)
+			loop.add_signal_handler(signal.SIGTERM, self.stop)
+			loop.add_signal_handler(signal.SIGUSR1, self.start_profiling)
+			if self.handoff_enabled:
+				loop.add_signal_handler(signal.SIGUSR2, upgrade)
+
+		handoff_task = None
+		if self.handoff_enabled:
+			self.handoff = HandoffServer(self.settings.handoff_path)
+			self.handoff.listen()
+			handoff_task = loop.create_task(self.handoff_listener())
+
+		for listener in self.listeners:
+			loop.add_reader(listener.sockToClient.fileno(), self.accept_clients, listener)
+		# Core proxy: the streams are drained like sessions
+		if self.mux_listeners:
+			settings = self.settings
+			self.mux_server = MuxServer(self.mux_listeners,self.mux_streams,
+							window=settings.mux_window,frame_size=settings.mux_frame_size,
+							connect_timeout=settings.connect_timeout,allow=settings.mux_allow)
+			self.mux_server.start(loop)
+		if started:
+			started()
+		try:
+			await self.stopped.wait()
+		finally:
+			if handoff_task:
+				handoff_task.cancel()
+				self.handoff.close(unlink=not self.handed_over)
+			for listener in self.listeners + self.mux_listeners:
+				listener.sockToClient.close()
+
+		await self.drain()
+		self.wheel.stop()
+		if self.mux_server:
+			self.mux_server.close()
+		if self.mux_client:
+			self.mux_client.close()
+		if self.upstream:
+			self.upstream.close()
+		if self.capture:
+			self.capture.close()
+		if self.credentials:
+			self.credentials.close()
+
+	async def handoff_listener(self):
+		await self.handoff.handoff([l.sockToClient
+									for l in self.listeners + self.mux_listeners])
+		print("[*] Listening Sockets Handed Over To New Proxy Process")
+		self.handed_over = True
+		self.stop()
+
+	async def drain(self):
+		tasks = self.table.tasks() + list(self.mux_streams)
+		if not tasks:
+			return
+		print("[*] Draining %d Sessions ..." % (len(tasks)))
+		done, pending = await asyncio.wait(tasks, timeout=self.settings.drain_timeout)
+		for task in pending:
+			task.cancel()
+		await asyncio.gather(*pending, return_exceptions=True)
+		print("[*] Draining Sessions ... Done")
+
+	# Called by the loop when the listening socket is readable. Accepts up to
+	# ACCEPT_BATCH connections per call, without a future per accept.
+	def accept_clients(self,listener):
+		loop 		= asyncio.get_running_loop()
+		reject_msg	= VER + Socks5_Protocol.METHOD_NOACCEPT
+		wheel		= self.wheel
+		admission	= self.admission
 
-	Socks5_Proxy.sockToClient.close()
-	ProxyTargetConn.close()
+		for i in range(ACCEPT_BATCH):
+			try:
+				conn, client_addr = listener.sockToClient.accept()
+			except (BlockingIOError, InterruptedError):
+				return
+			except OSError as e:
+				# E.g. out of file descriptors, try again on the next call
+				print("[*] Unable To Accept Connection: %s" % (e))
+				return
+			conn.setblocking(False)
+
+			source = admission.admit(client_addr)
+			if source is None:
+				reject_client(conn,reject_msg,self.settings.admission_reject)
+				continue
+
+			timer = wheel.add(self.settings.handshake_timeout, None)
+			# The table keeps the references of running sessions, the loop
+			# only keeps weak ones
+			session = self.table.add(conn,client_addr,admission,source,timer)
+			session.task = loop.create_task(handle_client(session,self))
+			timer.callback = session.task.cancel
+
+	# At the end of handle_client: no done callback per session
+	def end_session(self,session):
+		session.admission.release(session.source)
+		self.wheel.cancel(session.timer)
+		self.table.remove(session)
+		self.sessions_done += 1
+		self.bytes_to_target += session.bytes_to_target
+		self.bytes_to_client += session.bytes_to_client
+
+# Binary upgrade: the new process takes the listening sockets over
+def upgrade():
+	print("[*] Starting New Proxy Process ...")
+	subprocess.Popen([sys.executable] + sys.argv)
+
+# Listening sockets: taken over from a running proxy, the rest is bound.
+# Returns the SOCKS5 listeners, the mux listeners and whether this process
+# does handoff (not if a running proxy keeps handoff_path).
+def open_listeners(settings):
+	taken_over, in_use = [], False
+	if settings.handoff_path:
+		addresses = [(family, tuple(addr)) for family, addr in settings.listen + settings.mux_listen]
+		taken_over, in_use = takeover_listeners(settings.handoff_path,addresses)
+		if in_use:
+			print("[*] Handoff Path In Use By Another Proxy, No Handoff")
+
+	def open_listener(family,addr):
+		Socks5_Proxy = Proxy()
+		for sock in taken_over:
+			if sock.family == family and sock.getsockname()[:2] == addr:
+				taken_over.remove(sock)
+				sock.setblocking(False)
+				apply_listener_profile(sock,settings.socket_profile)
+				Socks5_Proxy.sockToClient = sock
+				print("[*] Took Over Listening Socket [ %d ] ... Done" % (addr[1]))
+				break
+		else:
+			Socks5_Proxy.init_socketToClient(family, socket.SOCK_STREAM, addr,
+											settings.backlog, settings.socket_profile)
+		return Socks5_Proxy
+
+	listeners = [open_listener(family, addr) for family, addr in settings.listen]
+	mux_listeners = [open_listener(family, addr) for family, addr in settings.mux_listen]
+
+	return listeners, mux_listeners, bool(settings.handoff_path) and not in_use
+
+# *****
+# Worker processes
+# *****
+# The parent binds (or takes over) the listening sockets and forks the workers,
+# which all accept on them. The parent only does the handoff and forwards
+# SIGHUP, SIGTERM and SIGUSR1 to the workers.
+def run_workers(args,settings,routes,listeners,mux_listeners,handoff):
+	pids = []
+	for i in range(settings.workers):
+		pid = os.fork()
+		if pid == 0:
+			server = ProxyServer(args,settings,routes,listeners,mux_listeners,handoff=False)
+			try:
+				asyncio.run(server.run())
+			finally:
+				os._exit(0)
+		pids.append(pid)
+	print("[*] Started %d Worker Processes ... Done" % (len(pids)))
+	asyncio.run(supervise_workers(settings,listeners + mux_listeners,pids,handoff))
+
+async def supervise_workers(settings,listeners,pids,handoff_enabled):
+	loop = asyncio.get_running_loop()
+
+	def forward(signum):
+		for pid in pids:
+			try:
+				os.kill(pid, signum)
+			except ProcessLookupError:
+				pass
+	loop.add_signal_handler(signal.SIGHUP, forward, signal.SIGHUP)
+	loop.add_signal_handler(signal.SIGTERM, forward, signal.SIGTERM)
+	loop.add_signal_handler(signal.SIGUSR1, forward, signal.SIGUSR1)
+
+	handoff = None
+	handoff_task = None
+	if handoff_enabled:
+		loop.add_signal_handler(signal.SIGUSR2, upgrade)
+		handoff = HandoffServer(settings.handoff_path)
+		handoff.listen()
+		async def handoff_listener():
+			await handoff.handoff([l.sockToClient for l in listeners])
+			print("[*] Listening Sockets Handed Over To New Proxy Process")
+			forward(signal.SIGTERM)
+			return True
+		handoff_task = loop.create_task(handoff_listener())
+
+	def wait_workers():
+		for pid in pids:
+			os.waitpid(pid, 0)
+	await loop.run_in_executor(None, wait_workers)
+
+	if handoff_task:
+		handed_over = handoff_task.done() and not handoff_task.cancelled()
+		handoff_task.cancel()
+		handoff.close(unlink=not handed_over)
+	for listener in listeners:
+		listener.sockToClient.close()
+
+def main(argv=None):
+	args = argument_parser("A very simple SOCKS5 (RFC 1928) proxy server").parse_args(argv)
+	try:
+		settings, routes = load_config(args)
+	except ConfigError as e:
+		print("[*] Invalid Configuration: %s" % (e))
+		sys.exit(2)	# Error number?
+
+	print("[*] Starting Proxy Server ...")
+	try:
+		listeners, mux_listeners, handoff = open_listeners(settings)
+	except HandoffError as e:
+		print("[*] Invalid Configuration: %s" % (e))
+		sys.exit(2)	# Error number?
+	if settings.workers > 1:
+		run_workers(args,settings,routes,listeners,mux_listeners,handoff)
+	else:
+		asyncio.run(ProxyServer(args,settings,routes,listeners,mux_listeners,handoff).run())
 
 
 if __name__=='__main__':
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+
+#_____________________________________________________________________________
+#
+# Replay of a capture log (see capture.py) for repeatable benchmarks
+#
+# Author:   Samdney  <contact@carolin-zoebelein.de>
+#			D4A7 35E8 D47F 801F 2CF6 2BA7 927A FD3C DE47 E13B
+# License:  See LICENSE for licensing information
+#_____________________________________________________________________________
+
+# The log is memory-mapped, never read as a whole. See ./replay.py --help:
+#
+#	info CAPTURE:		sessions, frames and octets of the log
+#	filter CAPTURE:		every target -> client chunk through the proxyfilter
+#						(proxy.filter_data), without sockets: throughput of
+#						the filter alone
+#	proxy CAPTURE --proxy HOST:PORT:
+#						every session through a running proxy again. A
+#						playback target (in this process) answers with the
+#						recorded target -> client data, each chunk after the
+#						client -> target octets which came before it. The
+#						CONNECT goes to the playback target, the client sends
+#						the session key (8 octets) as its first data, so the
+#						target knows which session to play.
+#						--target HOST:PORT: a real target instead (e.g.
+#						./target.py --mode echo), without the session key
+#		--speed recorded:	sessions start and send at the recorded times
+#		--speed max:		as fast as possible, --concurrency sessions at once
+#
+# Sessions with a GAP frame lost frames at capture (capture.py, max_pending):
+# they are reported as incomplete, and replayed with what is left of them.
+
+import argparse
+import asyncio
+import socket
+import struct
+import sys
+import time
+
+from socks5 import *
+from capture import *
+from config import parse_addr
+from myproxyfilter import *
+from proxy import filter_data
+
+Socks5_Protocol = Protocol()
+
+SESSION_KEY		= struct.Struct("!Q")
+
+def percentile(values,p):
+	if not values:
+		return 0
+	values = sorted(values)
+	return values[min(int(p / 100 * len(values)), len(values) - 1)]
+
+# Sessions which lost frames at capture (GAP)
+def incomplete(sessions):
+	return [key for key, frames in sessions.items()
+			if any(kind == GAP for t, kind, offset, length in frames)]
+
+def replay_info(log,args):
+	frames, octets = [0] * len(KIND_NAMES), [0] * len(KIND_NAMES)
+	first = last = None
+	gaps = set()
+	for t, session, kind, offset, length in log.frames():
+		frames[kind] += 1
+		octets[kind] += length
+		first = t if first is None else first
+		last = t
+		if kind == GAP:
+			gaps.add(session)
+	sessions = log.sessions()
+	print("[*] Sessions: %d, Frames: %d, Duration: %.1f s" % (len(sessions),
+			sum(frames), (last - first) if frames[START] else 0))
+	for kind, name in enumerate(KIND_NAMES):
+		print("[*]   %-10s %8d frames %12d octets" % (name, frames[kind], octets[kind]))
+	if gaps:
+		print("[*] Incomplete Sessions (Frames Dropped At Capture): %d, %d Without OPEN"
+				% (len(gaps), len(gaps - set(sessions))))
+
+def replay_filter(log,args):
+	chunks = [(offset, length) for t, session, kind, offset, length in log.frames()
+				if kind == TO_CLIENT]
+	octets = sum(length for offset, length in chunks)
+	data = log.map
+	myfilter = gender_filter()
+	start = time.perf_counter()
+	for i in range(args.repeat):
+		for offset, length in chunks:
+			filter_data(myfilter, args.filter, data[offset:offset + length])
+	elapsed = max(time.perf_counter() - start, 1e-9)
+	count = len(chunks) * args.repeat
+	print("[*] Filter %d: %d chunks, %d octets, %d times" % (args.filter, len(chunks),
+			octets, args.repeat))
+	print("[*]   %.1f MB/s, %.1f us per chunk" % (octets * args.repeat / elapsed / 1e6,
+			elapsed / max(count, 1) * 1e6))
+
+
+class Replay():
+
+	def __init__(self,log,args):
+		self.log		= log
+		self.args		= args
+		self.sessions	= log.sessions()
+		self.ok			= 0
+		self.failed		= 0
+		self.to_target	= 0
+		self.to_client	= 0
+		self.durations	= []
+
+	async def recv_exact(self,sock,n):
+		loop = asyncio.get_running_loop()
+		data = b""
+		while len(data) < n:
+			tmp = await loop.sock_recv(sock, n - len(data))
+			if not tmp:
+				raise Socks5Error("connection closed")
+			data += tmp
+		return data
+
+	async def sleep_until(self,deadline):
+		delay = deadline - time.monotonic()
+		if delay > 0:
+			await asyncio.sleep(delay)
+
+	async def run(self):
+		loop = asyncio.get_running_loop()
+		args = self.args
+		listener = None
+		self.proxy_family, self.proxy_addr = parse_addr(args.proxy)
+		if args.target:
+			family, target_addr = parse_addr(args.target)
+		else:
+			listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+			listener.bind(("127.0.0.1", 0))
+			listener.listen(1024)
+			listener.setblocking(False)
+			target_addr = listener.getsockname()
+			playback = loop.create_task(self.playback_target(listener))
+		atyp, addr = pack_host(target_addr[0])
+		self.request = encode_request(Socks5_Protocol.CMD_CONNECT, atyp, addr, target_addr[1])
+
+		start = time.monotonic()
+		limit = asyncio.Semaphore(args.concurrency if args.speed == "max"
+									else max(len(self.sessions), 1))
+		first = min((frames[0][0] for frames in self.sessions.values()), default=0)
+		tasks = []
+		for key, frames in self.sessions.items():
+			if args.speed == "recorded":
+				begin = start + frames[0][0] - first
+			else:
+				begin = None
+			tasks.append(loop.create_task(self.client_session(key, frames, begin, limit)))
+		await asyncio.gather(*tasks)
+		self.elapsed = time.monotonic() - start
+		if listener:
+			playback.cancel()
+			listener.close()
+
+	async def client_session(self,key,frames,begin,limit):
+		loop = asyncio.get_running_loop()
+		args = self.args
+		if begin is not None:
+			await self.sleep_until(begin)
+		async with limit:
+			start = time.monotonic()
+			sock = socket.socket(self.proxy_family, socket.SOCK_STREAM)
+			sock.setblocking(False)
+			reading = None
+			try:
+				await loop.sock_connect(sock, self.proxy_addr)
+				await loop.sock_sendall(sock, Socks5_Protocol.VER + b'\x01' +
+										Socks5_Protocol.METHOD_NOAUTH)
+				await self.recv_exact(sock, 2)
+				await loop.sock_sendall(sock, self.request)
+				# The reply of the proxy, BND.ADDR is IPv4 (see socks5codec.py)
+				reply = await self.recv_exact(sock, len(CONNECT_REPLIES[Socks5_Protocol.REP_SUCCESSED]))
+				if reply[1] != 0:
+					raise ConnectError(reply[1:2])
+				reading = loop.create_task(self.read_all(sock))
+				if not args.target:
+					await loop.sock_sendall(sock, SESSION_KEY.pack(key))
+				t_open = frames[0][0]
+				for t, kind, offset, length in frames:
+					if kind != TO_TARGET:
+						continue
+					if begin is not None:
+						await self.sleep_until(start + t - t_open)
+					await loop.sock_sendall(sock, self.log.payload(offset, length))
+					self.to_target += length
+				sock.shutdown(socket.SHUT_WR)
+				octets = await reading
+				self.to_client += octets
+				self.ok += 1
+				self.durations.append(time.monotonic() - start)
+			except (OSError, Socks5Error) as e:
+				self.failed += 1
+				if reading:
+					reading.cancel()
+			finally:
+				sock.close()
+
+	async def read_all(self,sock):
+		loop = asyncio.get_running_loop()
+		octets = 0
+		while True:
+			data = await loop.sock_recv(sock, 65536)
+			if not data:
+				return octets
+			octets += len(data)
+
+	async def playback_target(self,listener):
+		loop = asyncio.get_running_loop()
+		sessions = set()
+		try:
+			while True:
+				conn, addr = await loop.sock_accept(listener)
+				conn.setblocking(False)
+				task = loop.create_task(self.playback_session(conn))
+				sessions.add(task)
+				task.add_done_callback(sessions.discard)
+		finally:
+			for task in sessions:
+				task.cancel()
+
+	async def playback_session(self,conn):
+		loop = asyncio.get_running_loop()
+		try:
+			key, = SESSION_KEY.unpack(await self.recv_exact(conn, SESSION_KEY.size))
+			frames = self.sessions[key]
+			start, t_open = time.monotonic(), frames[0][0]
+			expected = received = 0
+			for t, kind, offset, length in frames:
+				if kind == TO_TARGET:
+					expected += length
+				elif kind == TO_CLIENT:
+					# Answers only after the requests they answered
+					while received < expected:
+						data = await loop.sock_recv(conn, 65536)
+						if not data:
+							break
+						received += len(data)
+					if self.args.speed == "recorded":
+						await self.sleep_until(start + t - t_open)
+					await loop.sock_sendall(conn, self.log.payload(offset, length))
+			conn.shutdown(socket.SHUT_WR)
+			while await loop.sock_recv(conn, 65536):
+				pass
+		except (OSError, KeyError, Socks5Error) as e:
+			pass
+		finally:
+			conn.close()
+
+	def report(self,recorded_to_client):
+		print("[*] Sessions ok/failed: %d/%d in %.2f s (%.1f/s)" % (self.ok, self.failed,
+				self.elapsed, self.ok / max(self.elapsed, 1e-9)))
+		print("[*] Octets To Target: %d, To Client: %d (recorded: %d)" % (self.to_target,
+				self.to_client, recorded_to_client))
+		print("[*] Session Duration: p50 %.2f ms, p99 %.2f ms" % (
+				percentile(self.durations, 50) * 1000, percentile(self.durations, 99) * 1000))
+		gaps = incomplete(self.sessions)
+		if gaps:
+			print("[*] Incomplete Sessions (Frames Dropped At Capture): %d, Replayed Without "
+				"The Dropped Frames" % (len(gaps)))
+
+def replay_proxy(log,args):
+	replay = Replay(log,args)
+	recorded = sum(length for frames in replay.sessions.values()
+					for t, kind, offset, length in frames if kind == TO_CLIENT)
+	print("[*] Replaying %d Sessions Through %s (%s speed) ..." % (len(replay.sessions),
+			args.proxy, args.speed))
+	asyncio.run(replay.run())
+	replay.report(recorded)
+
+def parse_args(argv):
+	parser = argparse.ArgumentParser(description="Replay of a capture log")
+	modes = parser.add_subparsers(dest="mode", required=True)
+	info = modes.add_parser("info", help="summary of the log")
+	info.add_argument("capture")
+	filtering = modes.add_parser("filter", help="target -> client data through the proxyfilter")
+	filtering.add_argument("capture")
+	filtering.add_argument("--filter", type=int, default=1,
+						help="0 off, 1 simple_switch, 2 lingu_switch")
+	filtering.add_argument("--repeat", type=int, default=1, help="passes over the log")
+	proxy = modes.add_parser("proxy", help="sessions through a running proxy")
+	proxy.add_argument("capture")
+	proxy.add_argument("--proxy", required=True, metavar="HOST:PORT")
+	proxy.add_argument("--target", metavar="HOST:PORT",
+						help="real target server instead of the playback target")
+	proxy.add_argument("--speed", default="max", choices=["recorded", "max"])
+	proxy.add_argument("--concurrency", type=int, default=64,
+						help="sessions at once with --speed max")
+	return parser.parse_args(argv)
+
+def main(argv=None):
+	args = parse_args(argv)
+	log = CaptureLog(args.capture)
+	try:
+		if args.mode == "info":
+			replay_info(log,args)
+		elif args.mode == "filter":
+			replay_filter(log,args)
+		else:
+			replay_proxy(log,args)
+	finally:
+		log.close()
+
+if __name__=='__main__':
+	try:
+		main()
+	except KeyboardInterrupt:
+		print("\n[*] User Requested An Interrupt")
+		print("[*] Application Exiting ...")
+		sys.exit()	# Error number?
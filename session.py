@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+#_____________________________________________________________________________
+#
+# Session table of the SOCKS5 proxy
+#
+# Author:   Samdney  <contact@carolin-zoebelein.de>
+# D4A7 35E8 D47F 801F 2CF6 2BA7 927A FD3C DE47 E13B
+# License:  See LICENSE for licensing information
+#_____________________________________________________________________________
+
+"""
+***Session table***
+
+=> One Session record per client connection, from accept until close. A
+	slotted object: no __dict__ per session, only the fields below.
+		state			HANDSHAKE, AUTH, CONNECTING, RELAY, CLOSED
+		client, target	the two sockets (target: socket or mux stream)
+		client_addr, target_addr
+		timer			deadline of the session (timerwheel.Timer)
+		bytes_to_target, bytes_to_client
+=> The handshake objects (socks5.Proxy, ProxyToServer) are only referenced
+	by the task of the session. An idle session in the relay is this record,
+	its task and the pending reads of the two directions.
+=> SessionTable: id -> Session, add, remove and lookup O(1). Iterating it
+	gives the running sessions for admin and metrics (count_states()).
+"""
+
+import time
+
+# States of a session
+HANDSHAKE, AUTH, CONNECTING, RELAY, CLOSED = range(5)
+STATE_NAMES = ("handshake", "auth", "connecting", "relay", "closed")
+
+class Session():
+	__slots__ = ("id", "state", "client", "target", "client_addr", "target_addr",
+				"admission", "source", "timer", "task", "started",
+				"bytes_to_target", "bytes_to_client")
+
+	def __init__(self,id,client,client_addr,admission,source,timer):
+		self.id					= id
+		self.state				= HANDSHAKE
+		self.client				= client
+		self.target				= None
+		self.client_addr		= client_addr
+		self.target_addr		= None
+		# Released at the end, to the AdmissionControl of the start (SIGHUP
+		# replaces it)
+		self.admission			= admission
+		self.source				= source
+		self.timer				= timer
+		self.task				= None
+		self.started			= time.monotonic()
+		self.bytes_to_target	= 0
+		self.bytes_to_client	= 0
+
+	def __repr__(self):
+		return "<Session %d %s %r -> %r>" % (self.id, STATE_NAMES[self.state],
+											self.client_addr, self.target_addr)
+
+	# Done callback of a relay direction which runs as its own task: an error
+	# ends the whole session
+	def relay_done(self,task):
+		if not task.cancelled() and task.exception() is not None:
+			self.task.cancel()
+
+
+class SessionTable():
+
+	def __init__(self):
+		self.sessions	= {}		# id -> Session
+		self.next_id	= 0
+
+	def __len__(self):
+		return len(self.sessions)
+
+	def __iter__(self):
+		return iter(list(self.sessions.values()))
+
+	def add(self,client,client_addr,admission,source,timer):
+		self.next_id += 1
+		session = Session(self.next_id,client,client_addr,admission,source,timer)
+		self.sessions[session.id] = session
+		return session
+
+	def remove(self,session):
+		session.state = CLOSED
+		self.sessions.pop(session.id, None)
+
+	def get(self,id):
+		return self.sessions.get(id)
+
+	def tasks(self):
+		return [session.task for session in self.sessions.values()]
+
+	def count_states(self):
+		counts = dict.fromkeys(STATE_NAMES, 0)
+		for session in self.sessions.values():
+			counts[STATE_NAMES[session.state]] += 1
+		return counts
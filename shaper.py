@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+
+#_____________________________________________________________________________
+#
+# Bandwidth shaping of the relay: token buckets, weighted fair queueing
+#
+# Author:   Samdney  <contact@carolin-zoebelein.de>
+# D4A7 35E8 D47F 801F 2CF6 2BA7 927A FD3C DE47 E13B
+# License:  See LICENSE for licensing information
+#_____________________________________________________________________________
+
+"""
+***Shaper***
+
+	[shaping]
+	rate			= none		octets/sec of all sessions, each direction
+	burst			= 65536
+
+	[route default]
+	rate			= none		octets/sec of all sessions of the route
+	session_rate	= none		octets/sec of one session
+	weight			= 1			share of rate, see below
+
+=> One Shaper per direction of the relay (to target, to client). Every
+	chunk of the relay asks it for len(chunk) tokens before it is sent.
+	Without any rate (the default) a session has no Flow and the relay
+	does not ask at all.
+=> Token buckets with debt: a chunk is sent if none of its buckets is in
+	debt, and takes its tokens even if that makes one negative. No chunk is
+	ever split or waits for more than burst tokens, the rate is exact over
+	time.
+=> Limits: a session waits while its session bucket or the bucket of its
+	route is in debt (not work conserving: a limited session does not get
+	more if the rest is idle).
+=> [shaping] rate, the capacity of the link: shared between all flows by
+	weighted fair queueing (start-time fair queueing). A waiting chunk gets
+	the start tag max(virtual time, finish tag of its flow), the finish tag
+	of its flow becomes start + len / weight. Chunks are sent in the order
+	of their start tags (equal start tags: smaller finish tag first), the
+	virtual time is the start tag of the last one.
+	A flow with weight 8 gets 8 times the share of a flow with weight 1, if
+	both are busy. A flow with little traffic (interactive) has an old
+	finish tag and is sent first. Work conserving: capacity which nobody
+	else wants goes to the busy flows (bulk).
+=> One timer for all: a single call_at handle of the event loop, at the
+	earliest time a waiting chunk can go (own buckets out of debt, link
+	bucket out of debt). No sleep per session. Waiting for its own limits a
+	chunk is in a heap by time, waiting for the link in a heap by start tag.
+	The timer of the event loop is late by up to a millisecond: while chunks
+	wait for the link, the tokens of that time are kept beyond burst.
+=> Fast path: nothing waits and no bucket is in debt: the tokens are taken,
+	no future, no timer.
+=> Reload (update): the same two Shapers for the life of the proxy. Rates,
+	burst and weights change in place, on the buckets of running sessions
+	too (route buckets by the name of the route, not the Route object). A
+	route or session limit added by a reload applies to new sessions, one
+	removed is dropped from new sessions and kept by running ones.
+"""
+
+import asyncio
+import heapq
+import time
+import weakref
+
+class TokenBucket():
+	__slots__ = ("rate", "burst", "tokens", "stamp")
+
+	def __init__(self,rate,burst,now):
+		self.rate	= rate
+		self.burst	= burst
+		self.tokens	= burst
+		self.stamp	= now
+
+	def refill(self,now):
+		tokens = self.tokens + (now - self.stamp) * self.rate
+		self.tokens = tokens if tokens < self.burst else self.burst
+		self.stamp = now
+
+	# Refill of a bucket with chunks waiting all the time: what a late timer
+	# missed is not cut to burst
+	def catch_up(self,now):
+		self.tokens += (now - self.stamp) * self.rate
+		self.stamp = now
+
+	# Seconds until out of debt
+	def wait(self):
+		return -self.tokens / self.rate if self.tokens < 0 else 0
+
+# One direction of one session
+class Flow():
+	__slots__ = ("shaper", "route", "session", "buckets", "weight", "finish", "__weakref__")
+
+	def __init__(self,shaper,route,session,buckets,weight):
+		self.shaper		= shaper
+		self.route		= route			# name of the route
+		self.session	= session		# session bucket or None
+		self.buckets	= buckets		# session and route bucket, if any
+		self.weight		= weight
+		self.finish		= 0.0			# finish tag of the last chunk
+
+	# Returns when octets may be sent
+	def acquire(self,octets):
+		return self.shaper.acquire(self, octets)
+
+class Shaper():
+
+	def __init__(self,rate=None,burst=65536):
+		self.burst			= burst
+		self.link			= TokenBucket(rate, burst, time.monotonic()) if rate else None
+		self.routes			= {}		# route name -> TokenBucket
+		self.flows			= weakref.WeakSet()
+		self.vtime			= 0.0		# virtual time
+		self.limited		= []		# heap: (time, seq, flow, octets, future)
+		self.queue			= []		# heap: (start tag, finish tag, seq, flow, octets, future)
+		self.seq			= 0
+		self.handle			= None		# the timer
+		self.when			= None
+		self.waits			= 0			# chunks which waited
+
+	# The Flow of a session on route, None: not shaped
+	def flow(self,route):
+		now = time.monotonic()
+		buckets = []
+		session = None
+		if route.session_rate:
+			session = TokenBucket(route.session_rate, self.burst, now)
+			buckets.append(session)
+		if route.rate:
+			bucket = self.routes.get(route.name)
+			if bucket is None:
+				bucket = self.routes[route.name] = TokenBucket(route.rate, self.burst, now)
+			buckets.append(bucket)
+		if not buckets and not self.link:
+			return None
+		flow = Flow(self, route.name, session, tuple(buckets), route.weight)
+		self.flows.add(flow)
+		return flow
+
+	# New settings: link rate and burst of [shaping], routes: {name: Route}
+	def update(self,rate,burst,routes):
+		now = time.monotonic()
+		buckets = [self.link] if self.link else []
+		buckets.extend(self.routes.values())
+		for bucket in buckets:
+			bucket.refill(now)
+			bucket.burst = burst
+		self.burst = burst
+
+		if not rate:
+			self.link = None
+		elif self.link:
+			self.link.rate = rate
+		else:
+			self.link = TokenBucket(rate, burst, now)
+
+		for name, bucket in list(self.routes.items()):
+			route = routes.get(name)
+			if route and route.rate:
+				bucket.rate = route.rate
+			else:
+				del self.routes[name]
+
+		for flow in list(self.flows):
+			if flow.session:
+				flow.session.refill(now)
+				flow.session.burst = burst
+			route = routes.get(flow.route)
+			if route is None:
+				continue
+			flow.weight = route.weight
+			if flow.session and route.session_rate:
+				flow.session.rate = route.session_rate
+
+		# Without a link the queue goes at once, the rest waits for the new
+		# rates
+		if self.queue and not self.link:
+			for start, finish, seq, flow, octets, future in self.queue:
+				if not future.done():
+					self.send(flow, octets, start)
+					future.set_result(None)
+			self.queue = []
+		if self.handle:
+			self.handle.cancel()
+			self.handle = None
+			self.run()
+
+	# Returns when octets of flow may be sent
+	async def acquire(self,flow,octets):
+		now = time.monotonic()
+		wait = self.own_wait(flow, now)
+		link = self.link
+		if not wait and not self.queue and (not link or self.link_ready(now)):
+			self.send(flow, octets, max(self.vtime, flow.finish))
+			return
+		loop = asyncio.get_running_loop()
+		future = loop.create_future()
+		self.seq += 1
+		self.waits += 1
+		if wait:
+			heapq.heappush(self.limited, (now + wait, self.seq, flow, octets, future))
+		else:
+			self.enqueue(flow, octets, future, self.seq)
+		self.schedule(loop, now)
+		await future
+
+	# Seconds until the buckets of flow are out of debt
+	def own_wait(self,flow,now):
+		wait = 0
+		for bucket in flow.buckets:
+			bucket.refill(now)
+			if bucket.tokens < 0:
+				wait = max(wait, bucket.wait())
+		return wait
+
+	def link_ready(self,now):
+		self.link.refill(now)
+		return self.link.tokens >= 0
+
+	def enqueue(self,flow,octets,future,seq):
+		start = max(self.vtime, flow.finish)
+		flow.finish = start + octets / flow.weight
+		heapq.heappush(self.queue, (start, flow.finish, seq, flow, octets, future))
+
+	# Takes the tokens
+	def send(self,flow,octets,start):
+		if start > self.vtime:
+			self.vtime = start
+		if flow.finish < start + octets / flow.weight:
+			flow.finish = start + octets / flow.weight
+		for bucket in flow.buckets:
+			bucket.tokens -= octets
+		if self.link:
+			self.link.tokens -= octets
+
+	def schedule(self,loop,now):
+		when = None
+		if self.limited:
+			when = self.limited[0][0]
+		if self.queue:
+			ready = now + self.link.wait()
+			if when is None or ready < when:
+				when = ready
+		if when is None or (self.handle and self.when <= when):
+			return
+		if self.handle:
+			self.handle.cancel()
+		self.when = when
+		self.handle = loop.call_at(loop.time() + (when - now), self.run)
+
+	# The timer
+	def run(self):
+		self.handle = None
+		now = time.monotonic()
+		limited, queue = self.limited, self.queue
+		link = self.link
+		if queue:
+			link.catch_up(now)
+		elif link:
+			link.refill(now)
+		while limited and limited[0][0] <= now:
+			when, seq, flow, octets, future = heapq.heappop(limited)
+			if future.done():
+				continue
+			wait = self.own_wait(flow, now)
+			if wait:
+				# Other sessions of the route were first
+				heapq.heappush(limited, (now + wait, seq, flow, octets, future))
+			elif link:
+				self.enqueue(flow, octets, future, seq)
+			else:
+				self.send(flow, octets, max(self.vtime, flow.finish))
+				future.set_result(None)
+		while queue and link.tokens >= 0:
+			start, finish, seq, flow, octets, future = heapq.heappop(queue)
+			if future.done():
+				continue
+			self.send(flow, octets, start)
+			future.set_result(None)
+		self.schedule(asyncio.get_running_loop(), now)
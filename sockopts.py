@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+#_____________________________________________________________________________
+#
+# Socket profiles of the SOCKS5 proxy: kernel options by name
+#
+# Author:   Samdney  <contact@carolin-zoebelein.de>
+# D4A7 35E8 D47F 801F 2CF6 2BA7 927A FD3C DE47 E13B
+# License:  See LICENSE for licensing information
+#_____________________________________________________________________________
+
+"""
+***Socket profiles***
+
+	[socket NAME]			a new profile, or changes of a built-in one
+	nodelay			= 1		TCP_NODELAY: small writes (handshake) at once,
+							no wait for the ACK of the previous one (Nagle)
+	quickack		= 1		TCP_QUICKACK: no delayed ACK at the start. Linux
+							resets it by itself, it is set once per socket.
+	rcvbuf, sndbuf	= 0		SO_RCVBUF/SO_SNDBUF, 0: system default (autotuning)
+	keepalive		= 1		SO_KEEPALIVE, dead peers of idle sessions are found
+	keepidle, keepintvl, keepcnt
+							seconds idle until the first probe, seconds
+							between probes, probes until the peer is dead,
+							0: system default
+	notsent_lowat	= 0		TCP_NOTSENT_LOWAT: octets not yet sent, above them
+							the socket is not writable, 0: system default
+	defer_accept	= 0		TCP_DEFER_ACCEPT (listener only): accept only
+							after the first data of the client, seconds.
+							Opt-in: a client which sends nothing is not
+							accepted, [timeouts] handshake does not apply
+							until the kernel gives up. Must not be longer
+							than the handshake timeout.
+
+=> Built-in profiles (PROFILES): default (nothing is set), interactive, bulk
+=> Used by:
+	[proxy] socket_profile	the listeners. Accepted sockets inherit all
+							options from their listener, the handshake costs
+							no setsockopt().
+	[route ...] socket_profile
+							client and target socket of the sessions of the
+							route, set after the CONNECT request. Parents of
+							[upstream] are targets, too.
+	The rcvbuf/sndbuf of a route (if not 0) replace the ones of its profile.
+"""
+
+import collections
+import socket
+
+# field, type, default (all options of the "default" profile are unset)
+SOCKET_OPTIONS = [
+	("nodelay",			int,	0),
+	("quickack",		int,	0),
+	("rcvbuf",			int,	0),
+	("sndbuf",			int,	0),
+	("keepalive",		int,	0),
+	("keepidle",		int,	0),
+	("keepintvl",		int,	0),
+	("keepcnt",			int,	0),
+	("notsent_lowat",	int,	0),
+	("defer_accept",	int,	0),
+]
+
+SocketProfile = collections.namedtuple("SocketProfile",
+							["name"] + [o[0] for o in SOCKET_OPTIONS])
+
+DEFAULT_PROFILE = SocketProfile("default", *[o[2] for o in SOCKET_OPTIONS])
+
+PROFILES = {
+	"default":		DEFAULT_PROFILE,
+	# Handshakes and request/response: no Nagle, no delayed ACK, little
+	# unsent data in the kernel (latency of the next write)
+	"interactive":	DEFAULT_PROFILE._replace(name="interactive", nodelay=1, quickack=1,
+						keepalive=1, keepidle=60, keepintvl=10, keepcnt=5,
+						notsent_lowat=16384),
+	# Tunnels of large transfers: big buffers, everything the kernel can take
+	"bulk":			DEFAULT_PROFILE._replace(name="bulk", nodelay=1,
+						rcvbuf=4194304, sndbuf=4194304,
+						keepalive=1, keepidle=60, keepintvl=10, keepcnt=5),
+}
+
+# Options which are set if not 0: (field, level, option)
+_OPTIONS = [
+	("nodelay",			socket.IPPROTO_TCP,	socket.TCP_NODELAY),
+	("rcvbuf",			socket.SOL_SOCKET,	socket.SO_RCVBUF),
+	("sndbuf",			socket.SOL_SOCKET,	socket.SO_SNDBUF),
+	("keepalive",		socket.SOL_SOCKET,	socket.SO_KEEPALIVE),
+	("keepidle",		socket.IPPROTO_TCP,	getattr(socket, "TCP_KEEPIDLE", None)),
+	("keepintvl",		socket.IPPROTO_TCP,	getattr(socket, "TCP_KEEPINTVL", None)),
+	("keepcnt",			socket.IPPROTO_TCP,	getattr(socket, "TCP_KEEPCNT", None)),
+	("quickack",		socket.IPPROTO_TCP,	getattr(socket, "TCP_QUICKACK", None)),
+	("notsent_lowat",	socket.IPPROTO_TCP,	getattr(socket, "TCP_NOTSENT_LOWAT", None)),
+]
+
+# (level, option, value) of a profile, computed once per profile
+_settings = {}
+
+def profile_settings(profile):
+	settings = _settings.get(profile)
+	if settings is None:
+		settings = tuple((level, option, getattr(profile, field))
+						for field, level, option in _OPTIONS
+						if option is not None and getattr(profile, field))
+		_settings[profile] = settings
+	return settings
+
+# Client, target and parent sockets. Errors are ignored: an option the
+# kernel does not know must not end the session.
+def apply_profile(sock,profile):
+	for level, option, value in profile_settings(profile):
+		try:
+			sock.setsockopt(level, option, value)
+		except OSError:
+			pass
+
+# Listening sockets: the options for the accepted sockets, and defer_accept
+def apply_listener_profile(sock,profile):
+	apply_profile(sock,profile)
+	if profile.defer_accept and hasattr(socket, "TCP_DEFER_ACCEPT"):
+		try:
+			sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_DEFER_ACCEPT, profile.defer_accept)
+		except OSError:
+			pass
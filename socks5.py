@@ -192,61 +192,61 @@
 # TODO: Check steps of SOCKS5 connection implementation for details of protocol
 # specification/see section: Addressing
 
+import asyncio
+import errno
 import socket
 import string
 import sys
 
-class Protocol():
-
-	def __init__(self):
-		self.VER	= b'\x05'
-		self.RSV	= b'\x00'
-	
-		# Hallo
-		self.METHOD_NOAUTH 		= b'\x00'
-    	#self.METHOD_GSSAPI 	= b'\x01'		# TODO, not supported until now
-    	#self.METHOD_USERNAME   = b'\x02'		# TODO, not supoorted until now
-    	##self.METHOD_IANAASS   = b'\x03'		# TODO, not supported until now
-    	##self.METHOD_PRIV 		= b'\x80'		# TODO, not supported until now
-		self.METHOD_NOACCEPT	= b'\xFF'
-
-		# Connecting
-		self.CMD_CONNECT 		= b'\x01'
-   		#self.CMD_BIND 			= b'\x02'		# TODO, not supported until now
-   		#self.CMD_UDP 			= b'\x03'		# TODO, not supported until now
-
-		self.ATYP_IPV4			= b'\x01'		
-   		#self.ATYP_DOMAINNAME   = b'\x03'		# TODO, not supported until now
-   		#self.ATYP_IPV6 		= b'\x04'		# TODO, not supported until now
-
-		self.REP_SUCCESSED 		= b'\x00'
-    	#self.REP_SERVERFAIL	= b'\x01'		# TODO, not supported until now	
-    	#self.REP_NOTALLOWED 	= b'\x02'		# TODO, not supported until now
-    	#self.REP_NETUNREACH	= b'\x03'		# TODO, not supported until now
-    	#self.REP_HOSTUNREACH	= b'\x04'		# TODO, not supported until now
-    	#self.REP_CONNREFUSED	= b'\x05'		# TODO, not supported until now
-    	#self.REP_TTLEXPIRED 	= b'\x06'		# TODO, not supported until now
-    	#self.REP_NOTSUPPORTED  = b'\x07'		# TODO, not supported until now
-    	#self.REP_ADDRESSNOTSUP = b'\x08'		# TODO, not supported until now
-
-
+from sockopts import apply_profile, apply_listener_profile
+from socks5codec import *
+
+# One instance for all (socks5codec.py), not one per message
+Socks5_Protocol = Protocol()
+
+# REP for the error of a failed connect to the target server
+def connect_error_rep(e):
+	if isinstance(e, ConnectError):
+		return e.rep
+	code = getattr(e, "errno", None)
+	if isinstance(e, TimeoutError) or code == errno.ETIMEDOUT:
+		return Socks5_Protocol.REP_TTLEXPIRED
+	if code == errno.ECONNREFUSED:
+		return Socks5_Protocol.REP_CONNREFUSED
+	if code in (errno.EHOSTUNREACH, errno.EHOSTDOWN):
+		return Socks5_Protocol.REP_HOSTUNREACH
+	if code in (errno.ENETUNREACH, errno.ENETDOWN):
+		return Socks5_Protocol.REP_NETUNREACH
+	return Socks5_Protocol.REP_SERVERFAIL
+
+
+# Errors raise Socks5Error, so the client can be used inside the proxy, too
+# (upstream parents, see upstream.py)
 class Client():
 	
 	def __init__(self):
 		self.sockToProxy = None
+		self.method		 = None
 
-	def init_socketToProxy(self,protocol_family, socket_type,proxy_addr):
+	# timeout: seconds for connecting and for each recv/send, None: no timeout
+	# profile: socket options (see sockopts.py), none: system defaults
+	def init_socketToProxy(self,protocol_family, socket_type,proxy_addr,timeout=None,
+							profile=None):
 		try:
 			sockToProxy = socket.socket(protocol_family, socket_type)
+			if profile:
+				apply_profile(sockToProxy,profile)
+			sockToProxy.settimeout(timeout)
 			sockToProxy.connect(proxy_addr)
 			self.sockToProxy = sockToProxy
 			print("[*] Initializing Socket ... Done")
 		except Exception as e:
 			print("[*] Unable To Initialize Socket")
-			sys.exit(2)	# Error number?		
+			raise Socks5Error("unable to connect to proxy server: %s" % (e))
 
+	# VER and NMETHODS follow from METHODS, they are there for the callers
 	def hallo_send(self,VER,NMETHODS,METHODS):
-		msg_s1				= VER + NMETHODS + METHODS
+		msg_s1				= encode_hallo(METHODS)
 		self.sockToProxy.sendall(msg_s1)
 		#print(msg_s1)
 		print("[*] Step 1: Send Greeting To Proxy Server ... Done")
@@ -257,147 +257,203 @@ class Client():
 		#print(data_s2)
 
 		Socks5_Protocol = Protocol()
-		if data_s2[0] != Socks5_Protocol.VER[0]:
+		if data_s2[:1] != Socks5_Protocol.VER:
 			print("[*] SOCKS Version not Supported.")
-			sys.exit(2) # Error number?
+			raise Socks5Error("SOCKS version not supported")
 			
-		data_s2_method = data_s2[1:len(data_s2)]
-		if data_s2_method.decode() == Socks5_Protocol.METHOD_NOACCEPT[0]:
+		data_s2_method = data_s2[1:2]
+		if data_s2_method == Socks5_Protocol.METHOD_NOACCEPT:
 			print("[*] No Acceptable Method")
-			sys.exit(2) # Error number?
+			raise Socks5Error("no acceptable method")
+		self.method = data_s2_method
 		
 		print("[*] Step 2: Received Valid Answer From Proxy Server ... Done")
+
+	def auth_send(self,UNAME,PASSWD):
+		# VER+ULEN+UNAME+PLEN+PASSWD (rfc1929)
+		msg_a1				= encode_auth(UNAME, PASSWD)
+		self.sockToProxy.sendall(msg_a1)
+		print("[*] Step 2a: Send Username/Password To Proxy Server ... Done")
+
+	def auth_recv(self):
+		buf_a2		= 1024
+		data_a2 = self.sockToProxy.recv(buf_a2)
+
+		Socks5_Protocol = Protocol()
+		if data_a2[1:2] != Socks5_Protocol.AUTH_SUCCESS:
+			print("[*] Authentication Failed")
+			raise Socks5Error("authentication failed")
+
+		print("[*] Step 2b: Authenticated By Proxy Server ... Done")
 		
+	# DST_ADDR: packed address (ATYP_IPV4/ATYP_IPV6) or domain name (octets),
+	# DST_PORT: int. VER and RSV are there for the callers.
 	def connect_send(self,VER,CMD,RSV,ATYP,DST_ADDR,DST_PORT):
-		msg_s3				= VER + CMD + RSV + ATYP + DST_ADDR + DST_PORT
-		#print(msg_s3)
+		msg_s3				= encode_request(CMD, ATYP, DST_ADDR, DST_PORT)
 		self.sockToProxy.sendall(msg_s3)
 		print("[*] Step 3: Send Request Details To Proxy Server ... Done")
 
 	def connect_recv(self):
-		buf_s4		= 1024
-		data_s4 = self.sockToProxy.recv(buf_s4)
-		if data_s4:
-			# TODO Check data if it is valid!!!
-			print("[*] Step 4: Received Valid Answer From Proxy Server ... Done")
-		else:
+		# Read exactly the reply (its length follows from the first 5 octets),
+		# data of the target server may directly follow it
+		data_s4 = self.recv_exact(5)
+		try:
+			data_s4 += self.recv_exact(message_length(data_s4) - len(data_s4))
+			REP, ATYP, BND_ADDR, BND_PORT = decode_reply(data_s4)
+		except Socks5Error as e:
 			print("[*] Received No Valid Data From Proxy Server")
-			sys.exit(2)	# Error number?
-
-
+			raise Socks5Error("no valid answer from proxy server: %s" % (e))
+		if REP:
+			print("[*] Proxy Server Unable To Connect To Target Server: REP %d" % (REP))
+			raise ConnectError(data_s4[1:2])
+		print("[*] Step 4: Received Valid Answer From Proxy Server ... Done")
+
+	def recv_exact(self,n):
+		data = b''
+		while len(data) < n:
+			tmp = self.sockToProxy.recv(n - len(data))
+			if not tmp:
+				break
+			data += tmp
+		return data
+
+
+# The proxy side runs on an asyncio event loop, one task per client. All 
+# sockets are non-blocking and driven by the loop's sock_* calls. Errors of a 
+# single client raise Socks5Error, which only ends this client's session.
 class Proxy():
-	
+	__slots__ = ("sockToClient", "atyp", "target_host", "target_port", "target_packed",
+				"cmd", "connect_data", "method", "username", "pending")
+
 	def __init__(self):
 		self.sockToClient	= None
 		self.atyp 			= ""
 		self.target_host 	= ""
 		self.target_port	= None
+		self.target_packed	= None
 		self.cmd			= None
 		self.connect_data	= None
-
-	def init_socketToClient(self,protocol_family, socket_type,proxy_addr,max_conn):
+		self.method			= None
+		self.username		= None
+		self.pending		= b""	# received after the last message
+
+	# profile: socket options of the listener, inherited by the accepted
+	# sockets (see sockopts.py), none: system defaults
+	def init_socketToClient(self,protocol_family, socket_type,proxy_addr,max_conn,
+							profile=None):
+		sockToClient = None
 		try:
 			sockToClient = socket.socket(protocol_family, socket_type)
+			if profile:
+				apply_listener_profile(sockToClient,profile)
 			sockToClient.bind(proxy_addr)
 			sockToClient.listen(max_conn)
+			sockToClient.setblocking(False)
 			self.sockToClient = sockToClient
 			#print("[*] Initializing Sockets ... Done")
 			#print("[*] Sockets Binded Successfully ... Done")
-			print("[*] Server Started Successfully [ %d ] ... Done" % (proxy_addr[1]))
-		except Exception as e:
+			# Port 0: the one the kernel has chosen
+			print("[*] Server Started Successfully [ %d ] ... Done" % (sockToClient.getsockname()[1]))
+		except OSError as e:
 			print("[*] Unable To Initialize Socket")
-			sys.exit(2)	# Error number?
-
-	def hallo_recv(self,conn):
-		buf_s1		= 1024
-		data_s1 	= conn.recv(buf_s1)
-		#print(data_s1)
-
-		Socks5_Protocol = Protocol()
-		if data_s1[0] != Socks5_Protocol.VER[0]:
-			print("[*] SOCKS Version not Supported.")
-			sys.exit(2)	# Error number?	
-		
-		NO_METHODS = b'\x00'
-		if data_s1[1] == NO_METHODS[0]:
-			print("[*] No Methods Supported by Client")
-			sys.exit(2)	# Error number?	
-		
-		data_s1_method = data_s1[2:len(data_s1)]
-		# TODO: At the moment only one method supported, hence no problem
-		# If more methods are support, we need an loop over all methods and have
-		# to compare
-		if data_s1_method.decode() == Socks5_Protocol.METHOD_NOACCEPT[0]:
+			if sockToClient:
+				sockToClient.close()
+			raise Socks5Error("unable to listen on %r: %s" % (proxy_addr, e)) from e
+
+	# One message of the client, in as many segments as it comes. length:
+	# hallo_length, auth_length or message_length (socks5codec.py). Octets
+	# after it (sent by the client without waiting for our answer) are kept
+	# in pending, for the next message or the relay.
+	async def recv_message(self,conn,length):
+		loop 		= asyncio.get_running_loop()
+		buf			= 1024
+		data		= self.pending
+		while len(data) < (length(data) or len(data) + 1):
+			tmp = await loop.sock_recv(conn, buf)
+			if not tmp:
+				break
+			data += tmp
+		end = length(data) or len(data)
+		self.pending = data[end:]
+		return data[:end]
+
+	async def hallo_recv(self,conn,methods):
+		try:
+			data_s1 = await self.recv_message(conn,hallo_length)
+			#print(data_s1)
+			data_s1_method = decode_hallo(data_s1)
+		except Socks5Error as e:
+			print("[*] Invalid Greeting From Client: %s" % (e))
+			raise
+
+		# Select the first of our methods (in order of preference) which is
+		# offered anywhere in the METHODS list of the client
+		self.method = Socks5_Protocol.METHOD_NOACCEPT
+		for method in methods:
+			if method[0] in data_s1_method:
+				self.method = method
+				break
+
+		if self.method == Socks5_Protocol.METHOD_NOACCEPT:
 			print("[*] No Acceptable Method")
-			sys.exit(2)	# Error number?	
+			return
 		
 		print("[*] Step 1: Receive Valid Greeting From Client ... Done")
 
-	def hallo_send(self,VER,METHOD,conn):
-		msg_s2				= VER + METHOD
-		conn.sendall(msg_s2)
+	# VER is there for the callers, the answers are built once (socks5codec.py)
+	async def hallo_send(self,VER,METHOD,conn):
+		loop 				= asyncio.get_running_loop()
+		await loop.sock_sendall(conn, HALLO_REPLIES[METHOD])
 		print("[*] Step 2: Send Answer To Client ... Done")
 
-	def connect_recv(self,conn):
-		buf_s3				= 1024
-		data_s3 			= conn.recv(buf_s3)
+	# Username/Password sub-negotiation (rfc1929), returns True if the
+	# credentials are valid for the given CredentialStore
+	async def auth_recv(self,conn,credentials):
+		# VER+ULEN+UNAME+PLEN+PASSWD
+		try:
+			data_a1 = await self.recv_message(conn,auth_length)
+			uname, passwd = decode_auth(data_a1)
+		except Socks5Error as e:
+			print("[*] Invalid Username/Password Request: %s" % (e))
+			raise
+
+		self.username = uname
+		valid = await credentials.verify(uname, passwd)
+		print("[*] Step 2a: Receive Username/Password From Client ... Done")
+		return valid
+
+	async def auth_reply(self,STATUS,conn):
+		loop 				= asyncio.get_running_loop()
+		await loop.sock_sendall(conn, AUTH_REPLIES[STATUS])
+		print("[*] Step 2b: Send Authentication Status To Client ... Done")
+
+	# VER+CMD+RSV+ATYP+DST.ADDR+DST.PORT, all ATYPs (see socks5codec.py).
+	# An unknown ATYP is answered with REP_ADDRESSNOTSUP.
+	async def connect_recv(self,conn):
+		loop 				= asyncio.get_running_loop()
+		try:
+			data_s3 = await self.recv_message(conn,message_length)
+			#print(data_s3)
+			self.cmd, self.atyp, self.target_packed, self.target_port = \
+				decode_request(data_s3)
+			self.target_host = host_of(self.atyp, self.target_packed)
+		except ConnectError as e:
+			print("[*] Address Type not Supported.")
+			await loop.sock_sendall(conn, CONNECT_REPLIES[e.rep])
+			raise
+		except Socks5Error as e:
+			print("[*] Invalid Request From Client: %s" % (e))
+			raise
 		self.connect_data	= data_s3
-		#print(data_s3)
-		
-		Socks5_Protocol = Protocol()
-		if data_s3[0] != Socks5_Protocol.VER[0]:
-			print("[*] SOCKS Version not Supported.")
-			sys.exit(2)	# Error number?	
-		
-		# atyp, target_host, target_port
-		# CORRECTION OF BUFFER STRING ECT STUFF EVERYWHERE!
-		if data_s3[3] == Socks5_Protocol.ATYP_IPV4[0]:
-			# ATYP_IPV4: TODO: That's dirty!
-			self.atyp = b'\x01'
-			
-			i = 8
-			tmp_host = data_s3[4:i]
-			target_host_as = socket.inet_ntoa(tmp_host)
-			self.target_host = target_host_as
-			
-			_target_port = ""
-			tmp_port = data_s3[i:]
-			for val in range(0,len(tmp_port)):
-				tmp = tmp_port[val]
-				_target_port = _target_port + str(tmp)
-			
-			self.target_port = int(_target_port)
 
-		#if data_s3[3] == Socks5_Protocol.ATYP_DOMAINNAME[0]:
-    		# ATYP_DOMAINNAME
-			# TODO
-			# self.atyp = b'\x03'
-		
-		#if data_s3[3] == Socks5_Protocol.ATYP_IPV6[0]:
-			# ATYP_IPV6
-			# TODO
-			# self.atyp = b'\x04'
-		
-		# cmd
-		if data_s3[1] == Socks5_Protocol.CMD_CONNECT[0]:
-			#CONNECT
-			self.cmd = Socks5_Protocol.CMD_CONNECT[0]
-		
-		#if data_s3[1] == Socks5_Protocol.CMD_BIND[0]:
-			# BIND
-			# self.cmd = Socks5_Protocol.CMD_BIND[0]
-		
-		#if data_s3[1] == Socks5_Protocol.CMD_UDP[0]:
-			# UDP ASSOCIATE
-			# self.cmd = Socks5_Protocol.CMD_UDP[0]
-		
-	def connect_reply(self,conn):
-		# TODO: That's dirty! Can be done nicer!
-		Socks5_Protocol = Protocol()
-		REP = Socks5_Protocol.REP_SUCCESSED[0]
-		msg_tmp = self.connect_data.decode()
-		msg_s4 = str(msg_tmp[0])+str(REP)+str(msg_tmp[2:])
-		#print(msg_s4.encode())
-		conn.sendall(msg_s4.encode())
+	# VER+REP+RSV+ATYP+BND.ADDR+BND.PORT, BND: 0.0.0.0:0, built once
+	def connect_reply_msg(self,REP):
+		return CONNECT_REPLIES[REP]
+
+	async def connect_reply(self,conn,REP=None):
+		loop = asyncio.get_running_loop()
+		if REP is None:
+			REP = Socks5_Protocol.REP_SUCCESSED
+		await loop.sock_sendall(conn, CONNECT_REPLIES[REP])
 		print("[*] Step 4: Send Answer To Client ... Done")
 
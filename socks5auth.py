@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+#_____________________________________________________________________________
+#
+# Username/Password authentication for SOCKS5 (RFC 1929)
+#
+# Author:   Samdney  <contact@carolin-zoebelein.de>
+# D4A7 35E8 D47F 801F 2CF6 2BA7 927A FD3C DE47 E13B
+# License:  See LICENSE for licensing information
+#_____________________________________________________________________________
+
+"""
+***Username/Password Authentication - rfc1929***
+	(From: https://tools.ietf.org/html/rfc1929)
+
+	1. Client to Server:
+           +----+------+----------+------+----------+
+           |VER | ULEN |  UNAME   | PLEN |  PASSWD  |
+           +----+------+----------+------+----------+
+           | 1  |  1   | 1 to 255 |  1   | 1 to 255 |
+           +----+------+----------+------+----------+
+	VER = 0x01	Current version of the subnegotiation
+
+	2. Server to Client:
+                        +----+--------+
+                        |VER | STATUS |
+                        +----+--------+
+                        | 1  |   1    |
+                        +----+--------+
+	STATUS = 0x00	success, everything else is a failure and the server MUST
+	close the connection.
+
+---
+Password file
+---
+One user per line, lines starting with '#' are ignored:
+
+	<username>:pbkdf2_sha256$<iterations>$<salt, hex>$<hash, hex>
+
+A line for a new user is printed by: ./socks5auth.py <username>
+
+---
+Verification
+---
+=> The KDF is slow by intention. It runs in a thread pool, never on the event
+	loop of the proxy.
+=> Successful verifications are remembered for cache_ttl seconds. Reconnecting
+	clients are then checked without hashing again.
+	The cache is keyed by a keyed hash (HMAC with a random per process key) of
+	username and password, no plaintext password is kept in memory.
+=> Concurrent verifications of the same credentials wait for one single KDF
+	run. A handshake timeout of one of them does not cancel it for the
+	others.
+"""
+
+import asyncio
+import concurrent.futures
+import functools
+import getpass
+import hashlib
+import hmac
+import os
+import sys
+import time
+from collections import OrderedDict
+
+KDF_NAME		= "pbkdf2_sha256"
+KDF_ITERATIONS	= 100000
+SALT_SIZE		= 16
+
+def hash_password(passwd,iterations=KDF_ITERATIONS,salt=None):
+	if salt is None:
+		salt = os.urandom(SALT_SIZE)
+	dk = hashlib.pbkdf2_hmac("sha256", passwd, salt, iterations)
+	return "%s$%d$%s$%s" % (KDF_NAME, iterations, salt.hex(), dk.hex())
+
+
+class CredentialStore():
+
+	def __init__(self,cache_ttl=30,cache_size=4096,workers=None):
+		self.users 			= {}
+		self.cache_ttl		= cache_ttl
+		self.cache_size		= cache_size
+		self.cache			= OrderedDict()
+		self.inflight		= {}
+		self.cache_key		= os.urandom(32)
+		self.executor		= concurrent.futures.ThreadPoolExecutor(
+								max_workers=workers or os.cpu_count() or 1)
+		# Used for unknown users, so they cost the same time as known ones
+		self.dummy_hash		= self.parse_hash(hash_password(b""))
+
+	def parse_hash(self,entry):
+		kdf, iterations, salt, dk = entry.split("$")
+		if kdf != KDF_NAME:
+			raise ValueError("unsupported password hash: %s" % kdf)
+		return (int(iterations), bytes.fromhex(salt), bytes.fromhex(dk))
+
+	def load(self,path):
+		users = {}
+		with open(path) as f:
+			for line in f:
+				line = line.strip()
+				if not line or line.startswith("#"):
+					continue
+				username, entry = line.split(":", 1)
+				users[username.encode()] = self.parse_hash(entry)
+		self.users = users
+		self.cache.clear()
+		print("[*] Loaded %d Users From %s ... Done" % (len(users), path))
+
+	# Slow path, called in the thread pool
+	def verify_hash(self,uname,passwd):
+		iterations, salt, dk = self.users.get(uname, self.dummy_hash)
+		_dk = hashlib.pbkdf2_hmac("sha256", passwd, salt, iterations)
+		return hmac.compare_digest(_dk, dk) and uname in self.users
+
+	async def verify(self,uname,passwd):
+		key = hmac.new(self.cache_key, bytes([len(uname)]) + uname + passwd,
+					hashlib.sha256).digest()
+		now = time.monotonic()
+
+		# Fast path: verified a short time ago
+		expires = self.cache.get(key)
+		if expires is not None:
+			if expires > now:
+				return True
+			del self.cache[key]
+
+		# Slow path: one KDF run for all concurrent requests of a client. A
+		# cancelled request (handshake timeout) does not cancel the run, the
+		# others still wait for it.
+		future = self.inflight.get(key)
+		if future is None:
+			loop = asyncio.get_running_loop()
+			future = loop.run_in_executor(self.executor, self.verify_hash,
+										uname, passwd)
+			self.inflight[key] = future
+			future.add_done_callback(functools.partial(self.verified, key))
+		return await asyncio.shield(future)
+
+	# Done callback of a KDF run, also without anybody waiting for it
+	def verified(self,key,future):
+		del self.inflight[key]
+		if not future.cancelled() and future.exception() is None and future.result():
+			self.cache[key] = time.monotonic() + self.cache_ttl
+			if len(self.cache) > self.cache_size:
+				self.cache.popitem(last=False)
+
+	def close(self):
+		self.executor.shutdown(wait=False)
+
+
+def main():
+	if len(sys.argv) != 2:
+		print("Usage: %s <username>" % sys.argv[0])
+		sys.exit(2)	# Error number?
+	passwd = getpass.getpass("Password: ")
+	print("%s:%s" % (sys.argv[1], hash_password(passwd.encode())))
+
+if __name__=='__main__':
+	main()
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+
+#_____________________________________________________________________________
+#
+# socks5 codec: the messages of rfc1928/rfc1929 as octets
+#
+# Author:   Samdney  <contact@carolin-zoebelein.de>
+# D4A7 35E8 D47F 801F 2CF6 2BA7 927A FD3C DE47 E13B
+# License:  See LICENSE for licensing information
+#_____________________________________________________________________________
+
+"""
+***SOCKS5 codec***
+
+Encoding and decoding of the messages, no sockets (see socks5.py for the
+client and proxy side, which use it).
+
+	Hallo				VER+NMETHODS+METHODS	encode_hallo, decode_hallo
+	Answer Hallo		VER+METHOD				HALLO_REPLIES
+	Username/Password	VER+ULEN+UNAME+PLEN+PASSWD
+												encode_auth, decode_auth
+	Auth status			VER+STATUS				AUTH_REPLIES
+	Request				VER+CMD+RSV+ATYP+DST.ADDR+DST.PORT
+												encode_request, decode_request
+	Reply				VER+REP+RSV+ATYP+BND.ADDR+BND.PORT
+												CONNECT_REPLIES, encode_reply,
+												decode_reply
+
+=> Request and reply have the same layout, one struct per ATYP:
+		ATYP_IPV4		DST.ADDR 4 octets
+		ATYP_IPV6		DST.ADDR 16 octets
+		ATYP_DOMAINNAME	DST.ADDR 1 octet length + name
+	DST.PORT: 2 octets, network order (struct "!H")
+=> addr is the packed address (4 or 16 octets) or the name (octets, without
+	its length). port is an int.
+=> The answers of the proxy have no variable part: they are built once, at
+	import, a reply is one dict lookup. BND.ADDR/BND.PORT of CONNECT_REPLIES
+	are 0.0.0.0:0 (the address of the proxy towards the target is of no use
+	to the client, rfc1928 does not require it).
+=> message_length(): the length of a request/reply from its first 5 octets,
+	for reading exactly one message. hallo_length(), auth_length(): the
+	same for the hallo and the username/password request.
+"""
+
+import socket
+import struct
+
+class Protocol():
+
+	def __init__(self):
+		self.VER	= b'\x05'
+		self.RSV	= b'\x00'
+
+		# Hallo
+		self.METHOD_NOAUTH 		= b'\x00'
+    	#self.METHOD_GSSAPI 	= b'\x01'		# TODO, not supported until now
+		self.METHOD_USERNAME	= b'\x02'
+    	##self.METHOD_IANAASS   = b'\x03'		# TODO, not supported until now
+    	##self.METHOD_PRIV 		= b'\x80'		# TODO, not supported until now
+		self.METHOD_NOACCEPT	= b'\xFF'
+
+		# Username/Password sub-negotiation (rfc1929)
+		self.AUTH_VER			= b'\x01'
+		self.AUTH_SUCCESS		= b'\x00'
+		self.AUTH_FAILURE		= b'\x01'
+
+		# Connecting
+		self.CMD_CONNECT 		= b'\x01'
+   		#self.CMD_BIND 			= b'\x02'		# TODO, not supported until now
+   		#self.CMD_UDP 			= b'\x03'		# TODO, not supported until now
+
+		self.ATYP_IPV4			= b'\x01'
+		self.ATYP_DOMAINNAME	= b'\x03'
+		self.ATYP_IPV6			= b'\x04'
+
+		self.REP_SUCCESSED 		= b'\x00'
+		self.REP_SERVERFAIL		= b'\x01'
+		self.REP_NOTALLOWED 	= b'\x02'
+		self.REP_NETUNREACH		= b'\x03'
+		self.REP_HOSTUNREACH	= b'\x04'
+		self.REP_CONNREFUSED	= b'\x05'
+		self.REP_TTLEXPIRED 	= b'\x06'
+		self.REP_NOTSUPPORTED	= b'\x07'
+		self.REP_ADDRESSNOTSUP	= b'\x08'
+
+
+class Socks5Error(Exception):
+	pass
+
+# The CONNECT failed, rep: REP of the reply (rfc1928)
+class ConnectError(Socks5Error):
+
+	def __init__(self,rep,msg="unable to connect to target server"):
+		Socks5Error.__init__(self, "%s (REP %d)" % (msg, rep[0]))
+		self.rep = rep
+
+
+Socks5_Protocol = Protocol()
+
+_VER			= Socks5_Protocol.VER[0]
+_IPV4, _DOMAINNAME, _IPV6 = 1, 3, 4		# ATYP octets
+PORT			= struct.Struct("!H")
+IPV4_MESSAGE	= struct.Struct("!BBBB4sH")		# VER, CMD/REP, RSV, ATYP, ADDR, PORT
+IPV6_MESSAGE	= struct.Struct("!BBBB16sH")
+DOMAIN_HEADER	= struct.Struct("!BBBBB")		# VER, CMD/REP, RSV, ATYP, length
+
+ANY_ADDR		= bytes(4)
+
+# ATYP octet -> ATYP as in Protocol
+ATYPS = {
+	Socks5_Protocol.ATYP_IPV4[0]:		Socks5_Protocol.ATYP_IPV4,
+	Socks5_Protocol.ATYP_DOMAINNAME[0]:	Socks5_Protocol.ATYP_DOMAINNAME,
+	Socks5_Protocol.ATYP_IPV6[0]:		Socks5_Protocol.ATYP_IPV6,
+}
+
+# *****
+# Hallo, Username/Password
+# *****
+def encode_hallo(methods):
+	return bytes((_VER, len(methods))) + methods
+
+# Length of the hallo which starts with data, 0: not known yet
+def hallo_length(data):
+	if data and data[0] != _VER:
+		raise Socks5Error("SOCKS version not supported")
+	if len(data) < 2:
+		return 0
+	return 2 + data[1]
+
+# Returns the METHODS offered by the client
+def decode_hallo(data):
+	if not data or data[0] != _VER:
+		raise Socks5Error("SOCKS version not supported")
+	if len(data) < 2 or not data[1]:
+		raise Socks5Error("no methods supported by client")
+	if len(data) < 2 + data[1]:
+		raise Socks5Error("truncated greeting")
+	return data[2:2 + data[1]]
+
+# ULEN and PLEN: 1 to 255 (rfc1929)
+def encode_auth(username,password):
+	if not 0 < len(username) <= 255 or not 0 < len(password) <= 255:
+		raise Socks5Error("username/password must be 1 to 255 octets")
+	return (bytes((Socks5_Protocol.AUTH_VER[0], len(username))) + username
+			+ bytes((len(password),)) + password)
+
+# Length of the username/password request which starts with data, 0: not
+# known yet. ULEN 0 is invalid: its two octets are enough for decode_auth.
+def auth_length(data):
+	if data and data[0] != Socks5_Protocol.AUTH_VER[0]:
+		raise Socks5Error("username/password version not supported")
+	if len(data) < 2:
+		return 0
+	ulen = data[1]
+	if not ulen:
+		return 2
+	if len(data) < 3 + ulen:
+		return 0
+	return 3 + ulen + data[2 + ulen]
+
+# Returns (UNAME, PASSWD)
+def decode_auth(data):
+	if not data or data[0] != Socks5_Protocol.AUTH_VER[0]:
+		raise Socks5Error("username/password version not supported")
+	ulen = data[1] if len(data) > 1 else 0
+	if not ulen or len(data) < 3 + ulen or len(data) < 3 + ulen + data[2 + ulen]:
+		raise Socks5Error("invalid username/password request")
+	plen = data[2 + ulen]
+	if not plen:
+		raise Socks5Error("invalid username/password request")
+	return data[2:2 + ulen], data[3 + ulen:3 + ulen + plen]
+
+# *****
+# Request, reply
+# *****
+# code: CMD of a request, REP of a reply
+def encode_message(code,atyp,addr,port):
+	if atyp == Socks5_Protocol.ATYP_IPV4:
+		return IPV4_MESSAGE.pack(_VER, code[0], 0, atyp[0], addr, port)
+	if atyp == Socks5_Protocol.ATYP_IPV6:
+		return IPV6_MESSAGE.pack(_VER, code[0], 0, atyp[0], addr, port)
+	if atyp == Socks5_Protocol.ATYP_DOMAINNAME:
+		if not 0 < len(addr) <= 255:
+			raise Socks5Error("invalid domain name length: %d" % len(addr))
+		return DOMAIN_HEADER.pack(_VER, code[0], 0, atyp[0], len(addr)) + addr + PORT.pack(port)
+	raise ConnectError(Socks5_Protocol.REP_ADDRESSNOTSUP, "address type not supported")
+
+# Length of the request/reply which starts with data, 0: less than 5
+# octets, not known yet
+def message_length(data):
+	if len(data) < 5:
+		return 0
+	atyp = data[3]
+	if atyp == _IPV4:
+		return IPV4_MESSAGE.size
+	if atyp == _IPV6:
+		return IPV6_MESSAGE.size
+	if atyp == _DOMAINNAME:
+		return DOMAIN_HEADER.size + data[4] + PORT.size
+	raise ConnectError(Socks5_Protocol.REP_ADDRESSNOTSUP, "address type not supported")
+
+# Returns (code, ATYP, addr, port), code: CMD/REP as int
+def decode_message(data):
+	if not data or data[0] != _VER:
+		raise Socks5Error("SOCKS version not supported")
+	length = message_length(data)
+	if not length or len(data) < length:
+		raise Socks5Error("truncated request/reply")
+	atyp = data[3]
+	if atyp == _IPV4:
+		ver, code, rsv, atyp, addr, port = IPV4_MESSAGE.unpack_from(data)
+	elif atyp == _IPV6:
+		ver, code, rsv, atyp, addr, port = IPV6_MESSAGE.unpack_from(data)
+	else:
+		if not data[4]:
+			raise Socks5Error("invalid domain name length: 0")
+		code = data[1]
+		addr = bytes(data[5:length - 2])
+		port, = PORT.unpack_from(data, length - 2)
+	return code, ATYPS[atyp], addr, port
+
+def encode_request(cmd,atyp,addr,port):
+	return encode_message(cmd,atyp,addr,port)
+
+def decode_request(data):
+	return decode_message(data)
+
+def encode_reply(rep,atyp=Socks5_Protocol.ATYP_IPV4,addr=ANY_ADDR,port=0):
+	return encode_message(rep,atyp,addr,port)
+
+def decode_reply(data):
+	return decode_message(data)
+
+# *****
+# Addresses
+# *****
+# host (str) -> (ATYP, addr)
+def pack_host(host):
+	try:
+		return Socks5_Protocol.ATYP_IPV4, socket.inet_pton(socket.AF_INET, host)
+	except OSError:
+		pass
+	try:
+		return Socks5_Protocol.ATYP_IPV6, socket.inet_pton(socket.AF_INET6, host)
+	except OSError:
+		pass
+	return Socks5_Protocol.ATYP_DOMAINNAME, host.encode("idna")
+
+# (ATYP, addr) -> host (str)
+def host_of(atyp,addr):
+	if atyp == Socks5_Protocol.ATYP_IPV4:
+		return socket.inet_ntoa(addr)
+	if atyp == Socks5_Protocol.ATYP_IPV6:
+		return socket.inet_ntop(socket.AF_INET6, addr)
+	try:
+		return addr.decode("ascii")
+	except UnicodeDecodeError:
+		raise Socks5Error("invalid domain name")
+
+# *****
+# The answers of the proxy, built once
+# *****
+HALLO_REPLIES = {method: Socks5_Protocol.VER + method for method in
+				(Socks5_Protocol.METHOD_NOAUTH, Socks5_Protocol.METHOD_USERNAME,
+				Socks5_Protocol.METHOD_NOACCEPT)}
+
+AUTH_REPLIES = {status: Socks5_Protocol.AUTH_VER + status for status in
+				(Socks5_Protocol.AUTH_SUCCESS, Socks5_Protocol.AUTH_FAILURE)}
+
+CONNECT_REPLIES = {bytes((rep,)): encode_reply(bytes((rep,))) for rep in range(9)}
@@ -1,46 +1,401 @@
 #!/usr/bin/env python3
-  
+
 #_____________________________________________________________________________
 #
 # A very simple target server for SOCKS5 (RFC 1928) proxy server
 # Only plaintext analysis. No encryption, etc. ...
 #
 # Author:   Samdney  <contact@carolin-zoebelein.de>
-#			D4A7 35E8 D47F 801F 2CF6 2BA7 927A FD3C DE47 E13B 
+#			D4A7 35E8 D47F 801F 2CF6 2BA7 927A FD3C DE47 E13B
 # License:  See LICENSE for licensing information
 #_____________________________________________________________________________
 
-# TODO: configfile/argparsing
 # TODO: logging
-# TODO: bufferhandling is very bad! A lot of bugs! Values have NO fixed size!
-# TODO: connections run in troubles if data > buffer_size
+# TODO: one recv is one request, requests > buffer_size are split
+
+# Also the backend for load tests of the proxy, see ./target.py --help:
+#
+# Modes, each recv from the client is one request:
+#	response:	the respond message (default)
+#	echo:		the request itself
+#	fixed:		--size octets
+#	stream:		--size octets, sent in blocks of --buffer-size, for bulk
+#				transfers (e.g. --size 1000000000)
+#	http:		HTTP/1.1, every request head (up to CRLFCRLF, no bodies) is
+#				answered with 200 and a text body of --size octets (the
+#				respond message, repeated), Content-Length. Keep-alive,
+#				pipelined requests are answered in order
+#	http-chunked:	as http, Transfer-Encoding: chunked
+# --delay SECONDS:	every response is sent after the delay (slow backends)
+# --no-keepalive:	close after the first response, else a connection serves
+#					requests until the client closes
+# --workers N:		processes, all accepting on the same listening socket
+#
+# Counters (connections, requests, bytes, latency from request to the last
+# octet of the response) are printed on SIGUSR1, every --stats-interval
+# seconds and at exit (SIGINT, SIGTERM), summed over all workers: with
+# --workers the workers send their counters over a pipe to the parent, which
+# prints the sum once every worker has answered.
 
+import argparse
+import asyncio
+import json
+import os
+import selectors
+import signal
 import socket
 import string
 import sys
+import time
+
+from config import parse_addr
 
 # **********
-# Config
+# Config: defaults, see ./target.py --help
 # **********
 target_host	= "127.0.0.1"
 target_port	= 8888
 target_addr	= (target_host,target_port)
 
 buffer_size	= 1024
-max_conn 	= 5
+max_conn 	= 128		# listen backlog, as [proxy] backlog of the proxy
 
 # Respond message for client
 rp_msg				= "She is a nice girl."
+
+ACCEPT_BATCH		= 64	# connections accepted per wakeup of the listener
 # **********
 
-def main():
+class TargetStats():
+
+	def __init__(self):
+		self.connections	= 0
+		self.active			= 0
+		self.requests		= 0
+		self.bytes_in		= 0
+		self.bytes_out		= 0
+		self.latency		= {}		# microseconds, rounded (see record) -> count
+
+	# Rounded to 4 significant bits (< 7% error), so workers can be summed
+	def record(self,seconds):
+		us = int(seconds * 1e6)
+		shift = us.bit_length() - 4
+		if shift > 0:
+			us = (us >> shift) << shift
+		self.latency[us] = self.latency.get(us, 0) + 1
+
+	def as_dict(self):
+		return {"connections": self.connections, "active": self.active,
+				"requests": self.requests, "bytes_in": self.bytes_in,
+				"bytes_out": self.bytes_out, "latency": self.latency}
+
+	def add(self,values):
+		self.connections	+= values["connections"]
+		self.active			+= values["active"]
+		self.requests		+= values["requests"]
+		self.bytes_in		+= values["bytes_in"]
+		self.bytes_out		+= values["bytes_out"]
+		for us, count in values["latency"].items():
+			us = int(us)
+			self.latency[us] = self.latency.get(us, 0) + count
+
+	def percentile(self,p):
+		rank = p / 100 * sum(self.latency.values())
+		seen = 0
+		for us in sorted(self.latency):
+			seen += self.latency[us]
+			if seen >= rank:
+				return us
+		return 0
+
+	def report(self,elapsed):
+		elapsed = max(elapsed, 1e-9)
+		print("[*] Connections: %d (%d active), Requests: %d (%.1f/s)"
+			% (self.connections, self.active, self.requests, self.requests / elapsed))
+		print("[*] Bytes In: %d (%.1f MB/s), Bytes Out: %d (%.1f MB/s)"
+			% (self.bytes_in, self.bytes_in / elapsed / 1e6,
+				self.bytes_out, self.bytes_out / elapsed / 1e6))
+		if self.latency:
+			print("[*] Latency: p50 %d us, p90 %d us, p99 %d us, max %d us"
+				% (self.percentile(50), self.percentile(90), self.percentile(99),
+					max(self.latency)))
+
+
+class TargetServer():
+
+	# stats_file: worker, the counters go to the parent (see run_workers)
+	def __init__(self,args,sock,stats_file=None):
+		self.args		= args
+		self.sock		= sock
+		self.stats_file	= stats_file
+		self.stats		= TargetStats()
+		self.clients	= set()
+		self.stopped	= None
+		self.start		= time.monotonic()
+		self.response	= self.build_response()
+
+	def build_response(self):
+		args = self.args
+		if args.mode == "fixed":
+			return b"x" * args.size
+		if args.mode == "stream":
+			return b"x" * args.buffer_size
+		if args.mode in ("http", "http-chunked"):
+			text = (args.response + " ").encode()
+			body = (text * (args.size // len(text) + 1))[:args.size]
+			if args.mode == "http":
+				return (b"HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\n"
+						b"Content-Length: %d\r\n\r\n" % len(body) + body)
+			return (b"HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\n"
+					b"Transfer-Encoding: chunked\r\n\r\n%x\r\n" % len(body) + body +
+					b"\r\n0\r\n\r\n")
+		return args.response.encode()
+
+	def stop(self):
+		if not self.stopped.is_set():
+			asyncio.get_running_loop().remove_reader(self.sock.fileno())
+			self.stopped.set()
+
+	async def run(self):
+		loop = asyncio.get_running_loop()
+		self.stopped = asyncio.Event()
+		loop.add_signal_handler(signal.SIGTERM, self.stop)
+		loop.add_signal_handler(signal.SIGINT, self.stop)
+		loop.add_signal_handler(signal.SIGUSR1, self.report)
+		loop.add_reader(self.sock.fileno(), self.accept_clients)
+		reporting = None
+		# Workers: the parent asks every interval
+		if self.args.stats_interval and not self.stats_file:
+			reporting = loop.create_task(self.report_every(self.args.stats_interval))
+		await self.stopped.wait()
+		if reporting:
+			reporting.cancel()
+		for task in list(self.clients):
+			task.cancel()
+		await asyncio.gather(*self.clients, return_exceptions=True)
+
+	def report(self):
+		if self.stats_file:
+			self.send_stats(False)
+		else:
+			self.stats.report(time.monotonic() - self.start)
+
+	# Worker: one line of JSON to the parent, final: at exit
+	def send_stats(self,final):
+		self.stats_file.write(json.dumps({"final": final, "stats": self.stats.as_dict()}) + "\n")
+		self.stats_file.flush()
+
+	async def report_every(self,interval):
+		while True:
+			await asyncio.sleep(interval)
+			self.report()
+
+	def accept_clients(self):
+		loop = asyncio.get_running_loop()
+		for i in range(ACCEPT_BATCH):
+			try:
+				conn, client_addr = self.sock.accept()
+			except (BlockingIOError, InterruptedError):
+				return
+			except OSError as e:
+				print("[*] Unable To Accept Connection: %s" % (e))
+				return
+			conn.setblocking(False)
+			conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+			task = loop.create_task(self.serve_client(conn))
+			self.clients.add(task)
+			task.add_done_callback(self.clients.discard)
+
+	async def serve_client(self,conn):
+		loop		= asyncio.get_running_loop()
+		args		= self.args
+		stats		= self.stats
+		mode		= args.mode
+		response	= self.response
+		verbose		= args.verbose
+		http		= mode in ("http", "http-chunked")
+		pending		= b""		# http: an incomplete request head
+
+		stats.connections += 1
+		stats.active += 1
+		if verbose:
+			print("[*] Connected Successfully With Client ...")
+		try:
+			while True:
+				data = await loop.sock_recv(conn, args.buffer_size)
+				if not data:
+					break
+				start = time.perf_counter()
+				stats.bytes_in += len(data)
+				if verbose:
+					print("[*] Received Data From Client ...")
+					print("\t\t=> " + data.decode(errors="replace"))
+
+				requests = 1
+				if http:
+					pending += data
+					requests = pending.count(b"\r\n\r\n")
+					if not requests:
+						continue
+					pending = pending[pending.rfind(b"\r\n\r\n") + 4:]
+
+				if args.delay:
+					await asyncio.sleep(args.delay)
+				if mode == "stream":
+					sent = 0
+					while sent < args.size:
+						block = response
+						if args.size - sent < len(block):
+							block = block[:args.size - sent]
+						await loop.sock_sendall(conn, block)
+						sent += len(block)
+				else:
+					if mode == "echo":
+						response = data
+					await loop.sock_sendall(conn, response * requests)
+					sent = len(response) * requests
+				stats.bytes_out += sent
+				stats.requests += requests
+				stats.record(time.perf_counter() - start)
+				if verbose:
+					print("[*] Send Response to Client ... %d Bytes" % (sent))
+
+				if not args.keepalive:
+					break
+		except OSError as e:
+			if verbose:
+				print("[*] Unable To Communicate with Client")
+		finally:
+			stats.active -= 1
+			conn.close()
+
+
+def parse_args(argv):
+	parser = argparse.ArgumentParser(description="A very simple target server")
+	parser.add_argument("--listen", default="%s:%d" % target_addr, metavar="HOST:PORT")
+	parser.add_argument("--backlog", type=int, default=max_conn)
+	parser.add_argument("--buffer-size", type=int, default=buffer_size,
+						help="octets per recv, block size of stream mode")
+	parser.add_argument("--response", default=rp_msg, help="respond message for client")
+	parser.add_argument("--mode", default="response",
+						choices=["response", "echo", "fixed", "stream", "http", "http-chunked"])
+	parser.add_argument("--size", type=int, default=1024,
+						help="octets per response of fixed and stream mode, of the body in http mode")
+	parser.add_argument("--delay", type=float, default=0,
+						help="seconds before each response")
+	parser.add_argument("--no-keepalive", dest="keepalive", action="store_false",
+						help="close after the first response")
+	parser.add_argument("--workers", type=int, default=1, help="processes")
+	parser.add_argument("--stats-interval", type=float, default=0,
+						help="seconds between printed counters, 0: only at exit")
+	parser.add_argument("-v", "--verbose", action="store_true",
+						help="print every connection and request")
+	return parser.parse_args(argv)
+
+# One process. stats_fd: worker, pipe to the parent for the counters
+def run_server(args,sock,stats_fd=None):
+	stats_file = os.fdopen(stats_fd, "w") if stats_fd is not None else None
+	server = TargetServer(args,sock,stats_file)
+	asyncio.run(server.run())
+	if stats_file is None:
+		print("[*] Target Server Stopped")
+		server.report()
+	else:
+		server.send_stats(True)
+		stats_file.close()
+
+def sum_stats(values):
+	stats = TargetStats()
+	for value in values:
+		stats.add(value)
+	return stats
+
+# SIGUSR1 and every --stats-interval seconds: the parent forwards SIGUSR1, the
+# workers answer with their counters, the sum is printed once all answered
+def run_workers(args,sock):
+	workers = {}		# read end of the pipe -> pid
+	start = time.monotonic()
+	for i in range(args.workers):
+		rfd, wfd = os.pipe()
+		pid = os.fork()
+		if pid == 0:
+			os.close(rfd)
+			try:
+				run_server(args,sock,wfd)
+			finally:
+				os._exit(0)
+		os.close(wfd)
+		workers[rfd] = pid
+	print("[*] Started %d Worker Processes ... Done" % (len(workers)))
+
+	def forward(signum,frame=None):
+		for pid in workers.values():
+			try:
+				os.kill(pid, signum)
+			except ProcessLookupError:
+				pass
+	signal.signal(signal.SIGTERM, forward)
+	signal.signal(signal.SIGINT, forward)
+	signal.signal(signal.SIGUSR1, forward)
+
+	selector = selectors.DefaultSelector()
+	for rfd in workers:
+		selector.register(rfd, selectors.EVENT_READ)
+	pending = dict.fromkeys(workers, b"")	# incomplete lines
+	latest = {}			# rfd -> counters of the last answer
+	running = set(workers)
+	answered = set()
+	interval = args.stats_interval
+	next_report = start + interval if interval else None
+	while running:
+		timeout = None if next_report is None else max(0, next_report - time.monotonic())
+		for key, events in selector.select(timeout):
+			rfd = key.fd
+			data = os.read(rfd, 65536)
+			if not data:
+				selector.unregister(rfd)
+				os.close(rfd)
+				os.waitpid(workers[rfd], 0)
+				running.discard(rfd)
+				continue
+			lines = (pending[rfd] + data).split(b"\n")
+			pending[rfd] = lines.pop()
+			for line in lines:
+				msg = json.loads(line)
+				latest[rfd] = msg["stats"]
+				if msg["final"]:
+					running.discard(rfd)
+				else:
+					answered.add(rfd)
+					if running <= answered:
+						print("[*] All Workers:")
+						sum_stats(latest.values()).report(time.monotonic() - start)
+						answered.clear()
+		if next_report is not None and time.monotonic() >= next_report:
+			forward(signal.SIGUSR1)
+			next_report += interval
+	for rfd in list(selector.get_map()):
+		selector.unregister(rfd)
+		os.close(rfd)
+		os.waitpid(workers[rfd], 0)
+	print("[*] Target Server Stopped, All Workers:")
+	sum_stats(latest.values()).report(time.monotonic() - start)
+
+def main(argv=None):
+	args = parse_args(argv)
+	family, target_addr	= parse_addr(args.listen)
+	target_port			= target_addr[1]
+	max_conn			= args.backlog
+
 	print("[*] Starting Target Server ...")
 
 	# Socket Init
 	try:
-		sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		sock = socket.socket(family, socket.SOCK_STREAM)
+		sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
 		sock.bind(target_addr)
 		sock.listen(max_conn)
+		sock.setblocking(False)
 		print("[*] Initializing Sockets ... Done")
 		print("[*] Sockets Binded Successfully ... Done")
 		print("[*] Server Started Successfully [ %d ] ... Done" % (target_port))
@@ -48,30 +403,11 @@ def main():
 		print("[*] Unable To Initialize Socket")
 		sys.exit(2)	# Error number?
 
-	# Communication	
-	while True:
-		try:
-			conn, client_addr = sock.accept()
-			print("[*] Connected Successfully With Client ...")
-
-			data = conn.recv(buffer_size)
-
-			if data:
-				print("[*] Received Data From Client ...")
-				print("\t\t=> " + data.decode())
-
-				conn.sendall(rp_msg.encode())
-				print("[*] Send Response to Client ...")
-				print("\t\t=> " + rp_msg)			
-
-			else:
-				print("[*] Received No Valid Data from Client")
-				break
-
-		except Exception as e:
-			print("[*] Unable To Communicate with Client")
-			sys.exit(2)	# Error number?
-
+	# Communication
+	if args.workers > 1:
+		run_workers(args,sock)
+	else:
+		run_server(args,sock)
 	sock.close()
 
 if __name__=='__main__':
@@ -84,4 +420,3 @@ if __name__=='__main__':
 	except Exception as e:
 		print("[*] An Unexpected Error occured.")
 		sys.exit(2)	# Error number?
-
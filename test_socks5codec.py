@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+
+#_____________________________________________________________________________
+#
+# Tests of the SOCKS5 codec (socks5codec.py)
+#
+# Author:   Samdney  <contact@carolin-zoebelein.de>
+# D4A7 35E8 D47F 801F 2CF6 2BA7 927A FD3C DE47 E13B
+# License:  See LICENSE for licensing information
+#_____________________________________________________________________________
+
+# Every handshake goes through the codec: round trips of each message type,
+# and malformed or truncated input, which must raise Socks5Error (a CONNECT
+# with an unknown ATYP: ConnectError with REP_ADDRESSNOTSUP).
+#
+#	python -m unittest test_socks5codec
+
+import socket
+import unittest
+
+from socks5codec import *
+
+P = Socks5_Protocol
+
+IPV4_ADDR	= socket.inet_aton("192.0.2.10")
+IPV6_ADDR	= socket.inet_pton(socket.AF_INET6, "2001:db8::10")
+DOMAIN_ADDR	= b"www.example.com"
+
+class HalloTest(unittest.TestCase):
+
+	def test_round_trip(self):
+		for methods in (P.METHOD_NOAUTH, P.METHOD_NOAUTH + P.METHOD_USERNAME, bytes(range(255))):
+			self.assertEqual(decode_hallo(encode_hallo(methods)), methods)
+
+	def test_wrong_version(self):
+		with self.assertRaises(Socks5Error):
+			decode_hallo(b"\x04\x01\x00")
+
+	def test_no_methods(self):
+		for data in (b"", b"\x05", b"\x05\x00"):
+			with self.assertRaises(Socks5Error):
+				decode_hallo(data)
+
+	def test_truncated(self):
+		data = encode_hallo(P.METHOD_NOAUTH + P.METHOD_USERNAME)
+		with self.assertRaises(Socks5Error):
+			decode_hallo(data[:-1])
+		with self.assertRaises(Socks5Error):
+			decode_hallo(b"\x05\xff\x00")
+
+	def test_length(self):
+		data = encode_hallo(P.METHOD_NOAUTH + P.METHOD_USERNAME)
+		self.assertEqual(hallo_length(data + b"more"), len(data))
+		for end in range(2):
+			self.assertEqual(hallo_length(data[:end]), 0)
+		with self.assertRaises(Socks5Error):
+			hallo_length(b"\x04")
+
+	def test_replies(self):
+		for method, reply in HALLO_REPLIES.items():
+			self.assertEqual(reply, P.VER + method)
+
+
+class AuthTest(unittest.TestCase):
+
+	def test_round_trip(self):
+		for username, password in ((b"user", b"secret"), (b"u", b"p"), (b"x" * 255, b"y" * 255)):
+			self.assertEqual(decode_auth(encode_auth(username, password)), (username, password))
+
+	def test_encode_lengths(self):
+		for username, password in ((b"", b"secret"), (b"user", b""), (b"x" * 256, b"p"),
+									(b"u", b"y" * 256)):
+			with self.assertRaises(Socks5Error):
+				encode_auth(username, password)
+
+	def test_wrong_version(self):
+		with self.assertRaises(Socks5Error):
+			decode_auth(b"\x05\x01u\x01p")
+
+	def test_empty_username_or_password(self):
+		for data in (b"\x01\x00\x01p", b"\x01\x01u\x00", b"\x01\x00\x00"):
+			with self.assertRaises(Socks5Error):
+				decode_auth(data)
+
+	def test_truncated(self):
+		data = encode_auth(b"user", b"secret")
+		for end in range(len(data)):
+			with self.assertRaises(Socks5Error):
+				decode_auth(data[:end])
+
+	def test_length(self):
+		data = encode_auth(b"user", b"secret")
+		self.assertEqual(auth_length(data + b"more"), len(data))
+		for end in (0, 1, 2, 6):
+			self.assertEqual(auth_length(data[:end]), 0)
+		self.assertEqual(auth_length(b"\x01\x00"), 2)
+		with self.assertRaises(Socks5Error):
+			auth_length(b"\x05")
+
+	def test_replies(self):
+		for status, reply in AUTH_REPLIES.items():
+			self.assertEqual(reply, P.AUTH_VER + status)
+
+
+class RequestTest(unittest.TestCase):
+
+	REQUESTS = [
+		(P.ATYP_IPV4, IPV4_ADDR, 8888),
+		(P.ATYP_IPV6, IPV6_ADDR, 443),
+		(P.ATYP_DOMAINNAME, DOMAIN_ADDR, 80),
+		(P.ATYP_DOMAINNAME, b"x" * 255, 65535),
+	]
+
+	def test_round_trip(self):
+		for atyp, addr, port in self.REQUESTS:
+			data = encode_request(P.CMD_CONNECT, atyp, addr, port)
+			self.assertEqual(message_length(data), len(data))
+			self.assertEqual(decode_request(data), (P.CMD_CONNECT[0], atyp, addr, port))
+
+	def test_trailing_data(self):
+		data = encode_request(P.CMD_CONNECT, P.ATYP_IPV4, IPV4_ADDR, 8888)
+		self.assertEqual(decode_request(data + b"more"),
+						(P.CMD_CONNECT[0], P.ATYP_IPV4, IPV4_ADDR, 8888))
+
+	def test_truncated(self):
+		for atyp, addr, port in self.REQUESTS:
+			data = encode_request(P.CMD_CONNECT, atyp, addr, port)
+			for end in range(len(data)):
+				with self.assertRaises(Socks5Error):
+					decode_request(data[:end])
+
+	def test_length_unknown(self):
+		self.assertEqual(message_length(b"\x05\x01\x00\x01"), 0)
+
+	def test_wrong_version(self):
+		data = encode_request(P.CMD_CONNECT, P.ATYP_IPV4, IPV4_ADDR, 8888)
+		with self.assertRaises(Socks5Error):
+			decode_request(b"\x04" + data[1:])
+
+	def test_unknown_atyp(self):
+		data = b"\x05\x01\x00\x02" + IPV4_ADDR + b"\x22\xb8"
+		with self.assertRaises(ConnectError) as cm:
+			decode_request(data)
+		self.assertEqual(cm.exception.rep, P.REP_ADDRESSNOTSUP)
+		with self.assertRaises(ConnectError):
+			encode_request(P.CMD_CONNECT, b"\x02", IPV4_ADDR, 8888)
+
+	def test_domain_length(self):
+		with self.assertRaises(Socks5Error):
+			decode_request(b"\x05\x01\x00\x03\x00\x00\x50")
+		for addr in (b"", b"x" * 256):
+			with self.assertRaises(Socks5Error):
+				encode_request(P.CMD_CONNECT, P.ATYP_DOMAINNAME, addr, 80)
+
+
+class ReplyTest(unittest.TestCase):
+
+	def test_round_trip(self):
+		for atyp, addr in ((P.ATYP_IPV4, IPV4_ADDR), (P.ATYP_IPV6, IPV6_ADDR),
+							(P.ATYP_DOMAINNAME, DOMAIN_ADDR)):
+			data = encode_reply(P.REP_SUCCESSED, atyp, addr, 1080)
+			self.assertEqual(decode_reply(data), (P.REP_SUCCESSED[0], atyp, addr, 1080))
+
+	def test_precomputed(self):
+		for rep, reply in CONNECT_REPLIES.items():
+			self.assertEqual(reply, encode_reply(rep))
+			self.assertEqual(decode_reply(reply), (rep[0], P.ATYP_IPV4, ANY_ADDR, 0))
+
+	def test_truncated(self):
+		reply = CONNECT_REPLIES[P.REP_SUCCESSED]
+		for end in range(len(reply)):
+			with self.assertRaises(Socks5Error):
+				decode_reply(reply[:end])
+
+
+class AddressTest(unittest.TestCase):
+
+	def test_round_trip(self):
+		for host, atyp in (("192.0.2.10", P.ATYP_IPV4), ("2001:db8::10", P.ATYP_IPV6),
+							("www.example.com", P.ATYP_DOMAINNAME)):
+			packed_atyp, addr = pack_host(host)
+			self.assertEqual(packed_atyp, atyp)
+			self.assertEqual(host_of(atyp, addr), host)
+
+	def test_invalid_domain(self):
+		with self.assertRaises(Socks5Error):
+			host_of(P.ATYP_DOMAINNAME, b"\xff\xfe")
+
+
+if __name__=='__main__':
+	unittest.main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+#_____________________________________________________________________________
+#
+# Hashed timer wheel for the session timeouts of the SOCKS5 proxy
+#
+# Author:   Samdney  <contact@carolin-zoebelein.de>
+# D4A7 35E8 D47F 801F 2CF6 2BA7 927A FD3C DE47 E13B
+# License:  See LICENSE for licensing information
+#_____________________________________________________________________________
+
+"""
+***Hashed timer wheel***
+
+=> One timer per session, no timer object of the event loop per connection.
+	The wheel itself runs one loop.call_later() every tick.
+=> A ring of slots, each slot is a set of timers:
+		slot = ceil(deadline / tick) % slots
+	The set of a slot exists only while it has timers: an idle wheel is
+	one list, not 2048 empty sets (embedded proxies, see embed.py).
+	=> add, cancel: O(1)
+	=> Every tick the due slot is taken out as a whole (batched expiry).
+=> Timers further away than slots * tick are found early and put back, once
+	per round.
+
+---
+Bumping a deadline
+---
+=> Activity of a session only sets timer.deadline, the timer is NOT moved.
+	When its slot comes up and the deadline lies in the future, it is put back
+	into the slot of its new deadline. An active session costs one re-insert
+	per timeout period, not one per read/write.
+=> A deadline bumped to an earlier time (e.g. connect timeout shorter than
+	the rest of the handshake timeout) is moved at once.
+=> The clock of the wheel (wheel.now) is updated once per tick. Timeouts have
+	a resolution of one tick.
+"""
+
+import math
+import time
+
+class Timer():
+	__slots__ = ("deadline", "callback", "slot")
+
+	def __init__(self,deadline,callback):
+		self.deadline	= deadline
+		self.callback	= callback
+		self.slot		= None
+
+
+class TimerWheel():
+
+	def __init__(self,tick=0.25,slots=2048):
+		self.tick		= tick
+		self.slots		= [None] * slots		# set of timers or None
+		self.now		= time.monotonic()
+		self.current	= int(self.now / tick)	# next tick to process
+		self.loop		= None
+		self.handle		= None
+		self.expired	= 0
+
+	def schedule(self,timer):
+		t = max(math.ceil(timer.deadline / self.tick), self.current)
+		i = t % len(self.slots)
+		slot = self.slots[i]
+		if slot is None:
+			slot = self.slots[i] = set()
+		timer.slot = slot
+		slot.add(timer)
+
+	def add(self,timeout,callback):
+		timer = Timer(self.now + timeout, callback)
+		self.schedule(timer)
+		return timer
+
+	def bump(self,timer,timeout):
+		deadline = self.now + timeout
+		if deadline < timer.deadline and timer.slot is not None:
+			# Earlier: its slot would come too late, moved
+			timer.slot.discard(timer)
+			timer.deadline = deadline
+			self.schedule(timer)
+		else:
+			timer.deadline = deadline
+
+	def cancel(self,timer):
+		if timer.slot is not None:
+			timer.slot.discard(timer)
+			timer.slot = None
+
+	def start(self,loop):
+		self.loop	= loop
+		self.now	= time.monotonic()
+		self.handle = loop.call_later(self.tick, self.run)
+
+	def stop(self):
+		if self.handle:
+			self.handle.cancel()
+			self.handle = None
+
+	def run(self):
+		self.now = time.monotonic()
+		last = int(self.now / self.tick)
+		nslots = len(self.slots)
+		while self.current <= last:
+			i = self.current % nslots
+			slot = self.slots[i]
+			self.slots[i] = None
+			self.current += 1
+			if slot is None:
+				continue
+			# pop(): callbacks may cancel other timers of this slot
+			while slot:
+				timer = slot.pop()
+				if timer.deadline <= self.now:
+					timer.slot = None
+					self.expired += 1
+					timer.callback()
+				else:
+					self.schedule(timer)
+		self.handle = self.loop.call_later(self.tick, self.run)
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+
+#_____________________________________________________________________________
+#
+# Upstream parent SOCKS5 servers: chaining and load balancing
+#
+# Author:   Samdney  <contact@carolin-zoebelein.de>
+# D4A7 35E8 D47F 801F 2CF6 2BA7 927A FD3C DE47 E13B
+# License:  See LICENSE for licensing information
+#_____________________________________________________________________________
+
+"""
+***Upstream parents***
+
+=> A CONNECT can be forwarded through a parent SOCKS5 server instead of
+	dialing the target server directly (tiers of proxies):
+
+	client -> this proxy -> parent -> target server
+
+=> The parent is dialed with the SOCKS5 client of socks5.py (Hallo, optional
+	Username/Password, CONNECT with the DST.ADDR/DST.PORT of the client's
+	request). The client is blocking, so every dial runs in a thread of a
+	small pool, the event loop only waits for the result.
+=> After the handshake the socket to the parent is relayed like a socket to
+	a target server.
+
+---
+Choosing a parent
+---
+Only healthy parents are used:
+	least_inflight:	fewest sessions currently running through the parent
+	ewma:			lowest exponentially weighted moving average of the
+					handshake latency, weighted with the in-flight sessions:
+						ewma * (inflight + 1)
+					a parent without samples (new, or ejected and not
+					checked since) counts with the mean ewma of the others,
+					if none has samples: least_inflight
+
+ewma = alpha * latency + (1 - alpha) * ewma, after every handshake and every
+health check, the first sample is taken as it is. The latency is measured in
+the thread of the dial, time waiting for a free thread does not count.
+
+---
+Health checks
+---
+=> Every check_interval seconds each parent gets a Hallo (no CONNECT). Dead
+	(no answer within check_timeout) or slow (latency > max_latency) parents
+	are ejected, a later good check brings them back.
+=> max_fails dials in a row failing eject a parent at once, without waiting
+	for the next check.
+=> No healthy parent: the dial fails, the session is closed.
+"""
+
+import asyncio
+import concurrent.futures
+import socket
+import time
+
+from socks5 import *
+
+Socks5_Protocol = Protocol()
+
+DIAL_ATTEMPTS	= 2		# parents tried per session
+
+class Parent():
+
+	def __init__(self,family,addr):
+		self.family		= family
+		self.addr		= addr
+		self.inflight	= 0			# sessions running through this parent
+		self.ewma		= None		# seconds, handshake latency, None: no samples
+		self.healthy	= True
+		self.fails		= 0			# dials failed in a row
+		self.sessions	= 0			# sessions started through this parent
+
+	def __repr__(self):
+		return "%s:%d" % (self.addr[0], self.addr[1])
+
+
+# Socket of a dial, which finished after its session was cancelled
+def close_dialed(future):
+	if not future.cancelled() and future.exception() is None:
+		sock, latency = future.result()
+		sock.close()
+
+
+class UpstreamPool():
+
+	def __init__(self,parents,policy="least_inflight",username=None,password=None,
+				connect_timeout=10,check_interval=5,check_timeout=2,max_latency=1.0,
+				max_fails=3,alpha=0.3,threads=32):
+		if policy not in ("least_inflight", "ewma"):
+			raise ValueError("unknown upstream policy: %s" % policy)
+		self.parents			= [Parent(family, addr) for family, addr in parents]
+		self.policy				= policy
+		self.username			= username
+		self.password			= password
+		self.connect_timeout	= connect_timeout
+		self.check_interval		= check_interval
+		self.check_timeout		= check_timeout
+		self.max_latency		= max_latency
+		self.max_fails			= max_fails
+		self.alpha				= alpha
+		self.executor			= concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+		self.checking			= None
+
+		methods = Socks5_Protocol.METHOD_NOAUTH
+		if username is not None:
+			methods += Socks5_Protocol.METHOD_USERNAME
+		self.methods = methods
+
+	def start(self,loop):
+		if self.parents and self.check_interval:
+			self.checking = loop.create_task(self.health_checks())
+
+	# Running dials are finished by their threads
+	def close(self):
+		if self.checking:
+			self.checking.cancel()
+			self.checking = None
+		self.executor.shutdown(wait=False)
+
+	def choose(self,exclude=()):
+		ewma = self.policy == "ewma"
+		if ewma:
+			samples = [p.ewma for p in self.parents if p.healthy and p.ewma is not None]
+			ewma = bool(samples)
+			if ewma:
+				mean = sum(samples) / len(samples)
+		best, best_cost = None, None
+		for parent in self.parents:
+			if not parent.healthy or parent in exclude:
+				continue
+			if ewma:
+				cost = (mean if parent.ewma is None else parent.ewma) * (parent.inflight + 1)
+			else:
+				cost = parent.inflight
+			if best is None or cost < best_cost:
+				best, best_cost = parent, cost
+		return best
+
+	def record(self,parent,latency):
+		if parent.ewma is None:
+			parent.ewma = latency
+		else:
+			parent.ewma = self.alpha * latency + (1 - self.alpha) * parent.ewma
+
+	def release(self,parent):
+		parent.inflight -= 1
+
+	# Blocking, runs in a thread of the pool. Returns the connected socket
+	# after the CONNECT to the parent and the latency of the handshake.
+	def dial(self,parent,ATYP,DST_ADDR,DST_PORT,profile=None):
+		start = time.monotonic()
+		Socks5_Client = Client()
+		Socks5_Client.init_socketToProxy(parent.family, socket.SOCK_STREAM, parent.addr,
+										self.connect_timeout,profile)
+		try:
+			Socks5_Client.hallo_send(Socks5_Protocol.VER, bytes([len(self.methods)]),
+									self.methods)
+			Socks5_Client.hallo_recv()
+			if Socks5_Client.method == Socks5_Protocol.METHOD_USERNAME:
+				Socks5_Client.auth_send(self.username, self.password)
+				Socks5_Client.auth_recv()
+			Socks5_Client.connect_send(Socks5_Protocol.VER, Socks5_Protocol.CMD_CONNECT,
+									Socks5_Protocol.RSV, ATYP, DST_ADDR, DST_PORT)
+			Socks5_Client.connect_recv()
+		except Exception:
+			Socks5_Client.sockToProxy.close()
+			raise
+		return Socks5_Client.sockToProxy, time.monotonic() - start
+
+	# Blocking: Hallo only, returns the latency
+	def check(self,parent):
+		start = time.monotonic()
+		Socks5_Client = Client()
+		Socks5_Client.init_socketToProxy(parent.family, socket.SOCK_STREAM, parent.addr,
+										self.check_timeout)
+		try:
+			Socks5_Client.hallo_send(Socks5_Protocol.VER, bytes([len(self.methods)]),
+									self.methods)
+			Socks5_Client.hallo_recv()
+		finally:
+			Socks5_Client.sockToProxy.close()
+		return time.monotonic() - start
+
+	# Returns (parent, non-blocking socket). The caller has to call
+	# release(parent) at the end of the session. profile: socket options
+	# (see sockopts.py), set before the connect.
+	async def connect(self,ATYP,DST_ADDR,DST_PORT,profile=None):
+		tried = []
+		for i in range(DIAL_ATTEMPTS):
+			parent = self.choose(tried)
+			if parent is None:
+				break
+			tried.append(parent)
+			parent.inflight += 1
+			dialing = self.executor.submit(self.dial, parent, ATYP, DST_ADDR, DST_PORT,
+											profile)
+			try:
+				sock, latency = await asyncio.wrap_future(dialing)
+			except ConnectError:
+				# The parent answered with a REP: it is alive, the target is
+				# not. Another parent would not do better.
+				parent.inflight -= 1
+				parent.fails = 0
+				raise
+			except Exception as e:
+				parent.inflight -= 1
+				parent.fails += 1
+				if parent.fails >= self.max_fails and parent.healthy:
+					parent.healthy = False
+					parent.ewma = None
+					print("[*] Parent %r Ejected: %d Dials Failed" % (parent, parent.fails))
+				continue
+			except asyncio.CancelledError:
+				# The thread finishes the dial, nobody is interested anymore
+				parent.inflight -= 1
+				dialing.add_done_callback(close_dialed)
+				raise
+			self.record(parent, latency)
+			parent.fails = 0
+			parent.sessions += 1
+			sock.settimeout(None)
+			sock.setblocking(False)
+			return parent, sock
+		raise Socks5Error("no parent available")
+
+	async def health_checks(self):
+		loop = asyncio.get_running_loop()
+		while True:
+			checks = [loop.run_in_executor(self.executor, self.check, parent)
+					for parent in self.parents]
+			results = await asyncio.gather(*checks, return_exceptions=True)
+			for parent, latency in zip(self.parents, results):
+				healthy = not isinstance(latency, BaseException) \
+							and latency <= self.max_latency
+				if not isinstance(latency, BaseException):
+					self.record(parent, latency)
+				if healthy:
+					parent.fails = 0
+				if healthy != parent.healthy:
+					parent.healthy = healthy
+					if healthy:
+						print("[*] Parent %r Healthy Again" % (parent))
+					else:
+						parent.ewma = None
+						print("[*] Parent %r Ejected By Health Check" % (parent))
+			await asyncio.sleep(self.check_interval)